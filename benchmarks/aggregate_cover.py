@@ -0,0 +1,55 @@
+''' Validation of the aggregated background traffic ("clients" -> "aggregate_cover", see
+    classes/CoverSource.py) against the explicit clients. Runs the full simulation with both
+    modes for the same seeds and reports the mean and the standard deviation over the runs of
+    the entropy, the latency and the wall time.
+
+    Run from the root of the repository:
+
+    python3 -m benchmarks.aggregate_cover -clients 1000 -runs 5
+'''
+import argparse
+import contextlib
+import copy
+import io
+import json
+import tempfile
+
+import numpy
+
+from simulation_modes import test_mode
+
+
+def run_mode(conf, aggregate, seed):
+    conf = copy.deepcopy(conf)
+    conf["clients"]["aggregate_cover"] = aggregate
+    conf["logging"]["enabled"] = False
+    conf["simulation"]["seed"] = seed
+
+    with tempfile.TemporaryDirectory() as exp_dir, contextlib.redirect_stdout(io.StringIO()):
+        return test_mode.run(exp_dir=exp_dir, conf_dic=conf)
+
+
+def main(args):
+    with open(args.config_file) as json_file:
+        conf = json.load(json_file)
+    conf["clients"]["number"] = args.clients
+    conf["misc"]["num_target_packets"] = args.targets
+    conf["phases"]["cooldown"] = args.targets
+    conf["simulation"]["engine"] = args.engine
+
+    print("%d clients, %s topology, %d target packets, %d runs" % (args.clients, conf["network"]["topology"], args.targets, args.runs))
+    print("%-10s %18s %18s %18s" % ("clients", "entropy", "latency", "wall time [s]"))
+    for aggregate in [False, True]:
+        results = [run_mode(conf, aggregate, seed) for seed in range(args.runs)]
+        row = ["%8.4f +- %6.4f" % (numpy.mean([r[k] for r in results]), numpy.std([r[k] for r in results])) for k in ["entropy", "latency", "wall_time"]]
+        print("%-10s %18s %18s %18s" % ("aggregated" if aggregate else "explicit", row[0], row[1], row[2]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The config file used as a base for the benchmark")
+    parser.add_argument("-clients", type=int, default=1000, help="Number of clients")
+    parser.add_argument("-targets", type=int, default=200, help="Number of target packets of each run")
+    parser.add_argument("-runs", type=int, default=5, help="Number of runs of each mode")
+    parser.add_argument("-engine", default="heap", help="The simulation engine, simpy or heap")
+    main(parser.parse_args())
@@ -0,0 +1,70 @@
+''' Benchmark of building the network with a large number of clients. For each number of clients
+    it builds the Network with the clients dormant (classes/ClientPool.py), and then with all the
+    clients built, as the explicit client traffic needs. Each configuration runs in its own Python
+    process and reports the construction time and the growth of the peak RSS.
+
+    Run from the root of the repository:
+
+    python3 -m benchmarks.client_population -clients 100000 1000000
+'''
+import argparse
+import copy
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from classes.Net import Network
+from simulation_modes import test_mode
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # ru_maxrss is in KB on Linux
+
+
+def run_worker(conf, clients, mode):
+    conf = copy.deepcopy(conf)
+    conf["clients"]["number"] = clients
+    conf["logging"]["enabled"] = False
+    conf["simulation"]["seed"] = 0
+
+    env = test_mode.setup_env(conf)
+    rss_before = peak_rss_mb()
+    time_started = time.perf_counter()
+    net = Network(env, conf["network"]["topology"], conf, (None, None, None))
+    if mode == "built":
+        for c in net.clients:
+            pass
+    build_time = time.perf_counter() - time_started
+
+    return {"build_time" : build_time, "added_rss_mb" : peak_rss_mb() - rss_before, "built" : len(net.clients.built)}
+
+
+def main(args):
+    with open(args.config_file) as json_file:
+        conf = json.load(json_file)
+
+    if args.worker is not None:
+        print(json.dumps(run_worker(conf, args.clients[0], args.worker)))
+        return
+
+    print("%s topology" % conf["network"]["topology"])
+    print("%-10s %-8s %12s %14s %10s" % ("clients", "mode", "build [s]", "added RSS [MB]", "built"))
+    for clients in args.clients:
+        for mode in ["dormant", "built"]:
+            out = subprocess.run([sys.executable, "-m", "benchmarks.client_population", "-config_file", args.config_file, "-clients", str(clients),
+                                  "-worker", mode], stdout=subprocess.PIPE, universal_newlines=True)
+            if out.returncode != 0:
+                print("%-10d %-8s %12s %14s %10s" % (clients, mode, "-", "out of memory" if out.returncode < 0 else "failed", "-"))
+                continue
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print("%-10d %-8s %12.2f %14.1f %10d" % (clients, mode, r["build_time"], r["added_rss_mb"], r["built"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The config file used as a base for the benchmark")
+    parser.add_argument("-clients", type=int, nargs="+", default=[100000, 1000000], help="Numbers of clients")
+    parser.add_argument("-worker", default=None, help=argparse.SUPPRESS)
+    main(parser.parse_args())
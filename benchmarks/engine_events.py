@@ -0,0 +1,77 @@
+''' Benchmark comparing the SimPy engine with the heap engine (classes/Engine.py)
+    on the stratified topology. For each engine it reports the number of processed events
+    (SimPy events plus hop callbacks) per wall-clock second, and the simulated seconds
+    per wall-clock second, which is the number to compare, since the heap engine needs
+    fewer events for the same simulated traffic.
+
+    Run from the root of the repository:
+
+    python3 -m benchmarks.engine_events -clients 100 -ticks 200
+'''
+import argparse
+import copy
+import json
+import time
+
+from classes.Net import Network
+from simulation_modes import test_mode
+
+
+def count_events(env):
+    ''' Wraps env.step so that every processed event is counted. '''
+    counter = [0]
+    step = env.step
+
+    def counting_step():
+        counter[0] += 1
+        step()
+
+    env.step = counting_step
+    return counter
+
+
+def run_engine(conf, engine, ticks):
+    conf = copy.deepcopy(conf)
+    conf["simulation"]["engine"] = engine
+    conf["network"]["topology"] = "stratified"
+    conf["logging"]["enabled"] = False
+    conf["simulation"]["seed"] = 0
+
+    env = test_mode.setup_env(conf)
+    net = Network(env, "stratified", conf, (None, None, None))
+    for c in net.clients:
+        env.process(c.start(test_mode.choose(env, net.clients)))
+        env.process(c.start_loop_cover_traffc())
+
+    counter = count_events(env)
+    time_started = time.perf_counter()
+    env.run(until=ticks)
+    wall = time.perf_counter() - time_started
+
+    return {"engine" : engine,
+            "events" : counter[0],
+            "wall_time" : wall,
+            "events_per_sec" : counter[0] / wall,
+            "sim_sec_per_wall_sec" : ticks / wall,
+            "packets_received" : env.total_messages_received}
+
+
+def main(args):
+    with open(args.config_file) as json_file:
+        conf = json.load(json_file)
+    conf["clients"]["number"] = args.clients
+    conf["clients"]["cover_traffic"] = True
+
+    print("Stratified topology, %d clients, %d ticks" % (args.clients, args.ticks))
+    print("%-8s %12s %10s %14s %16s %12s" % ("engine", "events", "wall [s]", "events/sec", "sim sec/wall sec", "delivered"))
+    for engine in ["simpy", "heap"]:
+        r = run_engine(conf, engine, args.ticks)
+        print("%-8s %12d %10.2f %14.0f %16.2f %12d" % (r["engine"], r["events"], r["wall_time"], r["events_per_sec"], r["sim_sec_per_wall_sec"], r["packets_received"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The config file used as a base for the benchmark")
+    parser.add_argument("-clients", type=int, default=100, help="Number of clients")
+    parser.add_argument("-ticks", type=float, default=200, help="Simulated time of each run")
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+''' Microbenchmark of the entropy update of the packets leaving the last mixes (Node.update_entropy):
+    the per-entry Python loop it replaced, and the immediate and deferred modes of
+    classes/EntropyAccumulator.py. The departing distributions are random sparse distributions
+    over the given number of target packets, with the given number of nonzero entries.
+
+    Run from the root of the repository:
+
+    python3 -m benchmarks.entropy_update -targets 20000 -entries 10 100 1000
+'''
+import argparse
+import math
+import time
+
+import numpy
+
+from classes.EntropyAccumulator import EntropyAccumulator
+
+
+def python_loop(entropy, mass):
+    for i, pr in mass.items():
+        if pr != 0.0:
+            entropy[i] += -(float(pr) * math.log(float(pr), 2))
+
+
+def random_masses(rng, targets, entries, number):
+    masses = []
+    for m in range(number):
+        indices = rng.choice(targets, entries, replace=False)
+        p = rng.random(entries)
+        masses.append(dict(zip(indices.tolist(), (p / p.sum()).tolist())))
+    return masses
+
+
+def main(args):
+    rng = numpy.random.default_rng(0)
+    print("%d target packets, %d departing packets" % (args.targets, args.packets))
+    print("%-10s %14s %14s %14s %14s" % ("entries", "loop [us]", "immediate [us]", "deferred [us]", "max diff"))
+    for entries in args.entries:
+        masses = random_masses(rng, args.targets, entries, args.packets)
+        results = []
+        times = []
+        for mode in ["loop", "immediate", "deferred"]:
+            entropy = numpy.zeros(args.targets)
+            accumulator = EntropyAccumulator(entropy, deferred=(mode == "deferred"))
+            time_started = time.perf_counter()
+            for mass in masses:
+                if mode == "loop":
+                    python_loop(entropy, mass)
+                else:
+                    accumulator.add(mass)
+            accumulator.flush()
+            times.append((time.perf_counter() - time_started) / args.packets * 1e6)
+            results.append(entropy)
+        diff = max(numpy.abs(r - results[0]).max() for r in results[1:])
+        print("%-10d %14.2f %14.2f %14.2f %14.2e" % (entries, times[0], times[1], times[2], diff))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-targets", type=int, default=20000, help="Number of target packets")
+    parser.add_argument("-entries", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Numbers of nonzero entries of the distributions")
+    parser.add_argument("-packets", type=int, default=2000, help="Number of departing packets")
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+''' Benchmark comparing runs with and without recycling of the delivered dummy packets
+    ("packet" -> "recycle"). Each configuration runs in its own Python process, so that the
+    reported peak RSS belongs to it alone. For each run it reports the wall time, the number
+    of garbage collections and the time spent in them, and the peak RSS.
+
+    Run from the root of the repository:
+
+    python3 -m benchmarks.packet_pool -clients 10000 -ticks 10
+'''
+import argparse
+import copy
+import gc
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from classes.Net import Network
+from simulation_modes import test_mode
+
+
+def track_gc():
+    ''' Counts the garbage collections and the time spent in them, using gc.callbacks. '''
+    stats = {"collections" : 0, "gc_time" : 0.0}
+    started = [0.0]
+
+    def callback(phase, info):
+        if phase == "start":
+            started[0] = time.perf_counter()
+        else:
+            stats["collections"] += 1
+            stats["gc_time"] += time.perf_counter() - started[0]
+
+    gc.callbacks.append(callback)
+    return stats
+
+
+def run_worker(conf, recycle, ticks):
+    conf = copy.deepcopy(conf)
+    conf["packet"]["recycle"] = recycle
+    conf["logging"]["enabled"] = False
+    conf["simulation"]["seed"] = 0
+
+    env = test_mode.setup_env(conf)
+    net = Network(env, conf["network"]["topology"], conf, (None, None, None))
+    for c in net.clients:
+        env.process(c.start(test_mode.choose(env, net.clients)))
+        env.process(c.start_loop_cover_traffc())
+
+    stats = track_gc()
+    time_started = time.perf_counter()
+    env.run(until=ticks)
+    stats["wall_time"] = time.perf_counter() - time_started
+    stats["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # ru_maxrss is in KB on Linux
+    stats["packets_received"] = env.total_messages_received
+    stats["free_packets"] = len(net.free_packets)
+    return stats
+
+
+def main(args):
+    with open(args.config_file) as json_file:
+        conf = json.load(json_file)
+    conf["clients"]["number"] = args.clients
+    conf["clients"]["cover_traffic"] = True
+    conf["simulation"]["engine"] = args.engine
+
+    if args.worker is not None:
+        print(json.dumps(run_worker(conf, args.worker == "pooled", args.ticks)))
+        return
+
+    print("%d clients, %s topology, %s engine, %d ticks" % (args.clients, conf["network"]["topology"], args.engine, args.ticks))
+    print("%-10s %10s %12s %12s %14s %10s" % ("packets", "wall [s]", "collections", "gc time [s]", "peak RSS [MB]", "delivered"))
+    for worker in ["unpooled", "pooled"]:
+        out = subprocess.run([sys.executable, "-m", "benchmarks.packet_pool", "-config_file", args.config_file, "-clients", str(args.clients),
+                              "-ticks", str(args.ticks), "-engine", args.engine, "-worker", worker], stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print("%-10s %10.2f %12d %12.3f %14.1f %10d" % (worker, r["wall_time"], r["collections"], r["gc_time"], r["peak_rss_mb"], r["packets_received"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The config file used as a base for the benchmark")
+    parser.add_argument("-clients", type=int, default=10000, help="Number of clients")
+    parser.add_argument("-ticks", type=float, default=10, help="Simulated time of each run")
+    parser.add_argument("-engine", default="heap", help="The simulation engine, simpy or heap")
+    parser.add_argument("-worker", default=None, help=argparse.SUPPRESS)
+    main(parser.parse_args())
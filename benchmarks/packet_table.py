@@ -0,0 +1,69 @@
+''' Benchmark of the memory taken by in-flight dummy packets, with Packet objects
+    ("packet" -> "backend": "objects") and with the struct-of-arrays PacketTable ("table").
+    Each backend runs in its own Python process: it creates the given number of dummy packets,
+    keeps all of them alive (as if they were all waiting in the pools of the mixnodes at once)
+    and reports the creation time and the growth of the peak RSS.
+
+    Run from the root of the repository:
+
+    python3 -m benchmarks.packet_table -packets 1000000
+'''
+import argparse
+import copy
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from classes.Net import Network
+from classes.Packet import Packet
+from simulation_modes import test_mode
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # ru_maxrss is in KB on Linux
+
+
+def run_worker(conf, backend, num_packets):
+    conf = copy.deepcopy(conf)
+    conf["packet"]["backend"] = backend
+    conf["packet"]["table_capacity"] = num_packets
+    conf["logging"]["enabled"] = False
+    conf["simulation"]["seed"] = 0
+
+    env = test_mode.setup_env(conf)
+    rss_before = peak_rss_mb() # Before the network, so that the preallocated table is counted
+    net = Network(env, conf["network"]["topology"], conf, (None, None, None))
+
+    time_started = time.perf_counter()
+    in_flight = [Packet.dummy(conf=conf, net=net, dest=net.clients[i % len(net.clients)], sender=net.clients[i % len(net.clients)]) for i in range(num_packets)]
+    create_time = time.perf_counter() - time_started
+
+    added_mb = peak_rss_mb() - rss_before
+    return {"create_time" : create_time, "added_rss_mb" : added_mb, "bytes_per_packet" : added_mb * 1024 * 1024 / len(in_flight)}
+
+
+def main(args):
+    with open(args.config_file) as json_file:
+        conf = json.load(json_file)
+
+    if args.worker is not None:
+        print(json.dumps(run_worker(conf, args.worker, args.packets)))
+        return
+
+    print("%d in-flight packets, %s topology" % (args.packets, conf["network"]["topology"]))
+    print("%-10s %12s %14s %18s" % ("backend", "create [s]", "added RSS [MB]", "bytes per packet"))
+    for backend in ["objects", "table"]:
+        out = subprocess.run([sys.executable, "-m", "benchmarks.packet_table", "-config_file", args.config_file, "-packets", str(args.packets),
+                              "-worker", backend], stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print("%-10s %12.2f %14.1f %18.1f" % (backend, r["create_time"], r["added_rss_mb"], r["bytes_per_packet"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The config file used as a base for the benchmark")
+    parser.add_argument("-packets", type=int, default=1000000, help="Number of in-flight packets")
+    parser.add_argument("-worker", default=None, help=argparse.SUPPRESS)
+    main(parser.parse_args())
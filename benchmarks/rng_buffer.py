@@ -0,0 +1,81 @@
+''' Microbenchmark of the ways of drawing the delays of the nodes: one call of the generator
+    per draw, popping from a list of pre-drawn values (as Node did before classes/RandomBuffer.py),
+    and RandomBuffer. For each it reports the time per draw, and the memory held by the buffers
+    of the given number of nodes with two streams each (sending and cover traffic delays).
+
+    Run from the root of the repository:
+
+    python3 -m benchmarks.rng_buffer -draws 1000000 -nodes 10000
+'''
+import argparse
+import time
+import tracemalloc
+
+import numpy
+
+from classes.RandomBuffer import RandomBuffer
+
+
+class ListBuffer(object):
+    ''' The previous way: lists of 10000 pre-drawn values, popped from the end. '''
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.delays = {}
+
+    def exponential(self, scale):
+        delays = self.delays.get(scale)
+        if not delays:
+            delays = self.delays[scale] = list(self.rng.exponential(scale, 10000))
+        return float(delays.pop())
+
+
+class DirectDraw(object):
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def exponential(self, scale):
+        return float(self.rng.exponential(scale))
+
+
+def time_per_draw(buffer, draws):
+    exponential = buffer.exponential
+    time_started = time.perf_counter()
+    for i in range(draws):
+        exponential(0.1)
+    return (time.perf_counter() - time_started) / draws
+
+
+def memory_of_nodes(make_buffer, nodes, draws_per_node):
+    ''' Memory held by the buffers of the nodes, after each node drew from two streams. '''
+    tracemalloc.start()
+    buffers = [make_buffer() for i in range(nodes)]
+    for buffer in buffers:
+        for i in range(draws_per_node):
+            buffer.exponential(0.02)
+            buffer.exponential(0.05)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return memory
+
+
+def main(args):
+    rng = numpy.random.default_rng(0)
+    candidates = [("direct", lambda: DirectDraw(rng)), ("list", lambda: ListBuffer(rng)), ("RandomBuffer", lambda: RandomBuffer(rng, args.buffer))]
+
+    print("%d draws, %d nodes drawing %d values per stream" % (args.draws, args.nodes, args.draws_per_node))
+    print("%-14s %14s %14s" % ("", "ns per draw", "memory [MB]"))
+    for name, make_buffer in candidates:
+        per_draw = time_per_draw(make_buffer(), args.draws)
+        memory = memory_of_nodes(make_buffer, args.nodes, args.draws_per_node)
+        print("%-14s %14.1f %14.1f" % (name, per_draw * 1e9, memory / 1024.0 / 1024.0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-draws", type=int, default=1000000, help="Number of draws timed")
+    parser.add_argument("-nodes", type=int, default=10000, help="Number of nodes for the memory measurement")
+    parser.add_argument("-draws_per_node", type=int, default=10, help="Draws per stream of each node for the memory measurement")
+    parser.add_argument("-buffer", type=int, default=4096, help="The max_size of RandomBuffer")
+    main(parser.parse_args())
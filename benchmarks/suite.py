@@ -0,0 +1,273 @@
+''' Benchmark suite of the simulator, with a tracked baseline.
+
+    End-to-end scenarios: the traffic of the clients (with loop cover traffic) through each topology,
+    for each number of clients, simulated for a fixed number of ticks. Every scenario runs in its own
+    Python process, and reports the number of processed events (SimPy events plus hop callbacks) per
+    wall-clock second, the simulated seconds per wall-clock second and the peak RSS of the process.
+
+    Micro-benchmarks of the hot paths: Packet.dummy, Node.add_pkt_in_pool, Node.forward_packet,
+    Network.select_random_route, StructuredMessage.__str__, OnlineMetrics.add_packet and the log based
+    metrics of metrics/anonymity_metrics.py. They report operations (packets, routes, log rows) per second.
+
+    The results are compared with the baseline file: a throughput lower, or a peak RSS higher, than the
+    baseline by more than the tolerance is flagged as a regression (and the exit code is 1), as is a
+    benchmark which fails, e.g., runs out of memory. The first run writes the baseline (as does the
+    first run of a new benchmark), -update overwrites it with the current results. Baselines are only
+    comparable on the same machine.
+
+    Run from the root of the repository:
+
+    python3 -m benchmarks.suite
+    python3 -m benchmarks.suite -only micro -tolerance 0.1
+    python3 -m benchmarks.suite -topologies stratified -clients 100 1000 -update
+'''
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.engine_events import count_events
+from classes.Net import Network
+from classes.OnlineMetrics import OnlineMetrics
+from classes.Packet import Packet
+from classes.Utilities import StructuredMessage
+from metrics import anonymity_metrics
+from simulation_modes import test_mode
+
+
+TOPOLOGIES = ["cascade", "stratified", "multi_cascade", "p2p"]
+
+# Whether a higher value of the measure is better
+MEASURES = {"events_per_sec" : True, "sim_sec_per_wall_sec" : True, "peak_rss_mb" : False, "ops_per_sec" : True}
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # ru_maxrss is in KB on Linux
+
+
+def bench_conf(conf, topology, clients, engine):
+    conf = copy.deepcopy(conf)
+    conf["network"]["topology"] = topology
+    conf["clients"]["number"] = clients
+    conf["clients"]["cover_traffic"] = True
+    conf["simulation"]["engine"] = engine
+    conf["simulation"]["seed"] = 0
+    conf["logging"]["enabled"] = False
+    return conf
+
+
+def run_scenario(conf, topology, clients, engine, ticks):
+    ''' Runs an end-to-end scenario. Executed in its own process, so that the peak RSS is its own. '''
+    conf = bench_conf(conf, topology, clients, engine)
+    env = test_mode.setup_env(conf)
+    net = Network(env, topology, conf, (None, None, None))
+    nodes = net.peers if topology == "p2p" else net.clients
+    for c in nodes:
+        env.process(c.start(test_mode.choose(env, nodes)))
+        env.process(c.start_loop_cover_traffc())
+
+    counter = count_events(env)
+    time_started = time.perf_counter()
+    env.run(until=ticks)
+    wall = time.perf_counter() - time_started
+
+    return {"events_per_sec" : counter[0] / wall,
+            "sim_sec_per_wall_sec" : ticks / wall,
+            "peak_rss_mb" : peak_rss_mb()}
+
+
+def timed(repeat, ops, fn, *args):
+    ''' Returns the number of operations per second of fn(*args), which performs ops operations,
+        in the fastest of repeat runs (the slower ones are slowed down by the rest of the machine).
+    '''
+    best = float("inf")
+    for _ in range(repeat):
+        time_started = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - time_started)
+    return {"ops_per_sec" : ops / best}
+
+
+def run_micro(conf, engine, n, repeat, pool_size=100):
+    ''' Runs the micro-benchmarks, each performing n operations, on a stratified network of 100 clients. '''
+    conf = bench_conf(conf, "stratified", 100, engine)
+    env = test_mode.setup_env(conf)
+    net = Network(env, "stratified", conf, (None, None, None))
+    client = net.clients[0]
+    mix = net.mixnodes[0]
+    results = {}
+
+    def dummies():
+        for _ in range(n):
+            Packet.dummy(conf=conf, net=net, dest=client, sender=client)
+    results["Packet.dummy"] = timed(repeat, n, dummies)
+
+    packets = [Packet.dummy(conf=conf, net=net, dest=client, sender=client) for _ in range(n)]
+    for i, p in enumerate(packets[::10]):
+        p.probability_mass = {i % 1000 : 1.0} # Some of the packets are tracked, as in the measurement phase
+    for p in packets:
+        p.current_node = 0
+        p.route[0] = mix.index
+
+    # The pool is filled with pool_size packets which are then all forwarded, so that it stays of a realistic size
+    add_time = float("inf")
+    forward_time = float("inf")
+    for _ in range(repeat):
+        times = [0.0, 0.0]
+        for start in range(0, n, pool_size):
+            chunk = packets[start:start + pool_size]
+            time_started = time.perf_counter()
+            for p in chunk:
+                mix.add_pkt_in_pool(p)
+            time_added = time.perf_counter()
+            for p in chunk:
+                mix.forward_packet(p)
+            times[0] += time_added - time_started
+            times[1] += time.perf_counter() - time_added
+        add_time = min(add_time, times[0])
+        forward_time = min(forward_time, times[1])
+    results["Node.add_pkt_in_pool"] = {"ops_per_sec" : n / add_time}
+    results["Node.forward_packet"] = {"ops_per_sec" : n / forward_time}
+
+    def routes():
+        for _ in range(n):
+            net.select_random_route(client)
+    results["Network.select_random_route"] = timed(repeat, n, routes)
+
+    packet = packets[0]
+    row = ("RCV_PKT_REAL", 103.06743395190479, client.id, packet.id, packet.type, 12, 101.0, 102.82742301921009, 103.06743395190479, 1) \
+          + tuple(packet.sender_estimates) + (1, [net.nodes[i] for i in packet.route], packet.pool_logs)
+    def log_rows():
+        for _ in range(n):
+            str(StructuredMessage(metadata=row))
+    results["StructuredMessage.__str__"] = timed(repeat, n, log_rows)
+
+    metrics = OnlineMetrics()
+    client.label = 1
+    for p in packets:
+        p.real_sender = client
+        p.time_sent = 1.0
+        p.time_delivered = 1.5
+        p.sender_estimates[:] = (0.9, 0.07, 0.03)
+    def online():
+        for p in packets:
+            metrics.add_packet(p)
+    results["OnlineMetrics.add_packet"] = timed(repeat, n, online)
+
+    rng = np.random.default_rng(0)
+    estimates = rng.dirichlet([10.0, 1.0, 1.0], size=n)
+    log = pd.DataFrame({"PrOthers" : estimates[:, 0], "PrSenderA" : estimates[:, 1], "PrSenderB" : estimates[:, 2],
+                        "RealSenderLabel" : np.ones(n, dtype=np.int64), "PacketTimeSent" : rng.uniform(0.0, 100.0, n)})
+    log["PacketTimeDelivered"] = log["PacketTimeSent"] + rng.exponential(0.3, n)
+    entropy = pd.DataFrame(rng.uniform(0.0, 8.0, (max(n // 1000, 1), 1000)), columns=["Entropy%d" % i for i in range(1000)])
+    results["anonymity_metrics.getUnlinkability"] = timed(repeat, n, anonymity_metrics.getUnlinkability, log)
+    results["anonymity_metrics.computeLatencyBreakdown"] = timed(repeat, n, anonymity_metrics.computeLatencyBreakdown, log)
+    results["anonymity_metrics.getEntropy"] = timed(repeat, entropy.size, anonymity_metrics.getEntropy, entropy, 1000)
+    return results
+
+
+def run_worker(args, conf):
+    if args.worker == "micro":
+        return run_micro(conf, args.engine, args.ops, args.repeat)
+    (topology, clients) = args.worker.split(":")
+    return run_scenario(conf, topology, int(clients), args.engine, args.ticks)
+
+
+def run_in_process(args, worker):
+    ''' Runs a worker (a scenario, or the micro-benchmarks) in its own Python process. Returns its results, or None if it failed. '''
+    out = subprocess.run([sys.executable, "-m", "benchmarks.suite", "-config_file", args.config_file, "-engine", args.engine,
+                          "-ticks", str(args.ticks), "-ops", str(args.ops), "-repeat", str(args.repeat), "-worker", worker], stdout=subprocess.PIPE, universal_newlines=True)
+    if out.returncode != 0:
+        return None
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def compare(name, results, baseline, tolerance):
+    ''' Prints the results of a benchmark next to its baseline. Returns the list of the regressed measures. '''
+    regressions = []
+    for measure, value in results.items():
+        base = baseline.get(name, {}).get(measure)
+        if base is None:
+            print("%-45s %-22s %14.1f %14s" % (name, measure, value, "-"))
+            continue
+        change = (value - base) / base
+        regressed = (change < -tolerance) if MEASURES[measure] else (change > tolerance)
+        if regressed:
+            regressions.append((name, measure))
+        print("%-45s %-22s %14.1f %14.1f %+9.1f%% %s" % (name, measure, value, base, 100.0 * change, "REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main(args):
+    with open(args.config_file) as json_file:
+        conf = json.load(json_file)
+
+    if args.worker is not None:
+        print(json.dumps(run_worker(args, conf)))
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    print("%-45s %-22s %14s %14s %10s" % ("benchmark", "measure", "current", "baseline", "change"))
+    workers = []
+    if args.only in [None, "e2e"]:
+        workers += ["%s:%d" % (t, c) for t in args.topologies for c in args.clients]
+    if args.only in [None, "micro"]:
+        workers.append("micro")
+
+    results = {}
+    regressions = []
+    for worker in workers:
+        r = run_in_process(args, worker)
+        if r is None:
+            # A crashed (or out of memory) scenario must not pass the gate
+            print("%-45s %-22s %14s %14s %10s REGRESSION" % (worker, "-", "failed", "-", "-"))
+            regressions.append((worker, "failed"))
+            continue
+        benches = r if worker == "micro" else {"e2e/" + worker : r}
+        for name, values in benches.items():
+            results[name] = values
+            regressions += compare(name, values, baseline, args.tolerance)
+
+    # The benchmarks without a baseline get the current results as their baseline
+    new = {name : values for name, values in results.items() if args.update or name not in baseline}
+    if new:
+        baseline.update(new)
+        with open(args.baseline, "w") as f:
+            json.dump({"machine" : platform.node(), "python" : platform.python_version(), "date" : str(datetime.datetime.now()),
+                       "engine" : args.engine, "ticks" : args.ticks, "ops" : args.ops, "results" : baseline}, f, indent=2, sort_keys=True)
+        print("> Baseline written into %s" % args.baseline)
+
+    if regressions:
+        print("> %d regressions: %s" % (len(regressions), ", ".join("%s %s" % r for r in regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The config file used as a base for the benchmarks")
+    parser.add_argument("-baseline", default="benchmarks/baseline.json", help="The baseline file, written by the first run")
+    parser.add_argument("-update", action="store_true", help="Overwrite the baseline with the current results")
+    parser.add_argument("-tolerance", type=float, default=0.2, help="Relative change beyond which a measure is flagged as a regression")
+    parser.add_argument("-only", choices=["e2e", "micro"], default=None, help="Run only the end-to-end scenarios or only the micro-benchmarks")
+    parser.add_argument("-topologies", nargs="+", default=TOPOLOGIES, help="Topologies of the end-to-end scenarios")
+    parser.add_argument("-clients", type=int, nargs="+", default=[100, 1000, 10000], help="Numbers of clients of the end-to-end scenarios")
+    parser.add_argument("-ticks", type=float, default=10, help="Simulated time of each end-to-end scenario")
+    parser.add_argument("-engine", default="heap", help="The engine of the simulation (simpy or heap)")
+    parser.add_argument("-ops", type=int, default=100000, help="Number of operations of each micro-benchmark")
+    parser.add_argument("-repeat", type=int, default=5, help="Number of runs of each micro-benchmark, of which the fastest is kept")
+    parser.add_argument("-worker", default=None, help=argparse.SUPPRESS)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,80 @@
+import numpy
+from classes.Client import Client
+
+
+class ClientPool(object):
+    ''' This module implements the lazily built list of the clients of the network (Network.clients).
+        A client which has not been used yet is dormant: it is only a row of the arrays of the pool
+        (its sending rate and its label), and its Client object is built the first time it is accessed,
+        e.g., when its traffic is started or when it is chosen as the destination of a packet.
+        Dormant clients have no buffered messages, since messages are only ever added to built clients.
+
+        The pool behaves as the list of clients it replaces: indexing and iterating build the clients,
+        pop() takes the last client out of the list (e.g., to make it a target sender).
+
+        Keyword arguments:
+        env - the simulation environment,
+        conf - the configuration of the simulation,
+        net - the network, whose nodes list (Network.nodes) gets the built clients,
+        loggers - the loggers of the clients,
+        number - the number of clients.
+    '''
+
+    def __init__(self, env, conf, net, loggers, number):
+        self.env = env
+        self.conf = conf
+        self.net = net
+        self.loggers = loggers
+        self.number = int(number)
+        self.active = self.number # The clients at rows >= active have been popped
+
+        self.rate = numpy.full(self.number, float(conf["clients"]["rate_sending"]))
+        self.label = numpy.zeros(self.number, dtype=numpy.int8)
+        self.built = {} # row : Client
+
+
+    def client(self, row):
+        ''' Returns the client of the given row, building it if it is still dormant. '''
+        client = self.built.get(row)
+        if client is None:
+            client = Client(self.env, self.conf, self.net, loggers=self.loggers)
+            client.index = row
+            client.label = int(self.label[row])
+            client.rate_sending = 1.0 / self.rate[row]
+            self.built[row] = client
+            self.net.nodes[row] = client
+        return client
+
+
+    def built_clients(self):
+        ''' Returns the clients which have been built, including the popped ones. '''
+        return list(self.built.values())
+
+
+    def background_rate(self):
+        ''' Returns the summed sending rate of the clients still in the list. '''
+        return float(self.rate[:self.active].sum())
+
+
+    def pop(self):
+        if self.active == 0:
+            raise IndexError("pop from empty client pool")
+        self.active -= 1
+        return self.client(self.active)
+
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.active
+        if not 0 <= i < self.active:
+            raise IndexError("client index out of range")
+        return self.client(int(i))
+
+
+    def __iter__(self):
+        for row in range(self.active):
+            yield self.client(row)
+
+
+    def __len__(self):
+        return self.active
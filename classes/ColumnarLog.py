@@ -0,0 +1,82 @@
+import glob
+import os
+import numpy
+
+
+# Columns of the binary logs, in the order of the fields logged by the nodes (see Node.register_received_packet).
+# Packet and message IDs are integers (see env.ids), client IDs are hex strings of id_len bytes.
+# The Route and PoolSizes fields of the text packet log are not stored.
+def sender_estimate_columns(num_labels):
+    ''' Names of the columns of the sender estimates: PrOthers, then PrSenderA, PrSenderB, ... for the target senders. '''
+    return ["PrOthers"] + ["PrSender" + (chr(ord("A") + l) if l < 26 else str(l + 1)) for l in range(num_labels - 1)]
+
+def packet_log_columns(num_labels=3):
+    return ([("Type", "S16"), ("CurrentTime", "f8"), ("ClientID", "S64"), ("PacketID", "i8"), ("PacketType", "S16"), ("MessageID", "i8"),
+             ("PacketTimeQueued", "f8"), ("PacketTimeSent", "f8"), ("PacketTimeDelivered", "f8"), ("TotalFragments", "i8")]
+            + [(name, "f8") for name in sender_estimate_columns(num_labels)] + [("RealSenderLabel", "i8")])
+
+PACKET_LOG_COLUMNS = packet_log_columns()
+
+MESSAGE_LOG_COLUMNS = [("Type", "S16"), ("CurrentTime", "f8"), ("ClientID", "S64"), ("MessageID", "i8"), ("NumPackets", "i8"), ("MsgTimeQueued", "f8"),
+                       ("MsgTimeSent", "f8"), ("MsgTimeDelivered", "f8"), ("MsgTransitTime", "f8"), ("MsgSize", "i8"), ("MsgRealSender", "i8")]
+
+def entropy_log_columns(num_target_packets):
+    return [("Entropy" + str(x), "f8") for x in range(num_target_packets)]
+
+
+class ColumnarLogger(object):
+    ''' This module implements a typed, chunked, columnar replacement of the text loggers.
+        Records are written into a preallocated NumPy record buffer, and every time the buffer is full
+        (or the logger is flushed) its rows are saved as the next chunk file <path>.<chunk>.npy.
+
+        The logger accepts the same StructuredMessage records as the text loggers, so the nodes
+        log in the same way whatever the format is. Fields beyond the columns are ignored.
+    '''
+
+    def __init__(self, path, columns, chunk_size=100000):
+        self.path = path
+        self.dtype = numpy.dtype(columns)
+        self.num_columns = len(columns)
+        self.chunk_size = int(chunk_size)
+        self.buffer = numpy.zeros(self.chunk_size, dtype=self.dtype)
+        self.pos = 0
+        self.num_chunks = 0
+
+        # Drop the chunks of a previous run logged into the same place
+        for f in glob.glob(glob.escape(path) + ".*.npy"):
+            os.remove(f)
+
+
+    def info(self, record):
+        ''' Logs the given StructuredMessage. '''
+        self.buffer[self.pos] = tuple(record.metadata[:self.num_columns])
+        self.pos += 1
+        if self.pos == self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        ''' Saves the buffered rows as a new chunk. '''
+        if self.pos == 0:
+            return
+        numpy.save("%s.%05d.npy" % (self.path, self.num_chunks), self.buffer[:self.pos])
+        self.num_chunks += 1
+        self.pos = 0
+
+
+def iter_chunks(path):
+    ''' Yields the chunks (NumPy record arrays) of the columnar log at the given path, in order. '''
+    for f in sorted(glob.glob(glob.escape(path) + ".*.npy")):
+        yield numpy.load(f)
+
+
+def read_log(path):
+    ''' Returns the whole columnar log at the given path as a single NumPy record array. '''
+    chunks = list(iter_chunks(path))
+    if chunks == []:
+        return None
+    return numpy.concatenate(chunks)
+
+
+def exists(path):
+    return glob.glob(glob.escape(path) + ".*.npy") != []
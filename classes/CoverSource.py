@@ -0,0 +1,70 @@
+from classes.Packet import Packet
+
+
+class CoverSource(object):
+    ''' This module implements an aggregated source of the background traffic ("clients" -> "aggregate_cover").
+        Instead of running two processes for each of the background clients, whose traffic is made
+        only of dummy loop packets, their traffic entering the network through a particular first mix
+        is generated by a single source. The superposition of independent Poisson streams is a Poisson
+        stream with the summed rate, and the packets of the clients go through the given first mix with
+        its first hop probability, so the source sends a Poisson stream of rate
+
+            (summed sending rates + summed cover traffic rates of the background clients) * first hop probability
+
+        of dummy packets with routes drawn among those starting at its mix. All the packets are sent
+        on behalf of (and loop back to) a single representative background client.
+
+        Keyword arguments:
+        env - the simulation environment,
+        conf - the configuration of the simulation,
+        net - the network,
+        client - the representative background client, sender and destination of the packets,
+        first - the index of the first mix in Network.nodes,
+        rate - the rate of the source [packets per tick].
+    '''
+
+    def __init__(self, env, conf, net, client, first, rate):
+        self.env = env
+        self.conf = conf
+        self.net = net
+        self.client = client
+        self.first = first
+        self.rate = rate
+        self.pkts_sent = 0
+
+
+    def start(self):
+        scale = 1.0 / self.rate
+        while True:
+            delay = self.client.random.exponential(scale)
+            yield self.env.timeout(delay)
+
+            route = self.net.route_sampler.route_through(self.first, self.client)
+            tmp_pkt = Packet.dummy(conf=self.conf, net=self.net, dest=self.client, sender=self.client, route=route)
+            tmp_pkt.time_queued = self.env.now
+            self.client.send_packet(tmp_pkt)
+            self.env.total_messages_sent += 1
+            self.pkts_sent += 1
+
+
+def background_rate(conf, clients):
+    ''' The summed rate of the traffic of the background clients: their sending rates, plus the
+        rates of their loop cover traffic if enabled. '''
+    rate = clients.background_rate()
+    if conf["clients"]["cover_traffic"]:
+        rate += len(clients) * float(conf["clients"]["cover_traffic_rate"])
+    return rate
+
+
+def start_cover_sources(env, conf, net, clients, share=1.0):
+    ''' Starts one CoverSource per first mix, replacing the background clients still in the
+        given ClientPool (which thus stay dormant). Returns the list of the sources.
+        The sources generate the given share of the background traffic (in a parallel run,
+        every source shard generates its share, see simulation_modes/parallel_mode.py).
+    '''
+    total_rate = background_rate(conf, clients) * share
+    first_hops, probabilities = net.route_sampler.first_hops()
+    sources = [CoverSource(env, conf, net, clients[0], int(first), total_rate * p) for first, p in zip(first_hops, probabilities) if p > 0.0]
+    for s in sources:
+        env.process(s.start())
+    return sources
@@ -0,0 +1,57 @@
+import simpy
+from heapq import heappush, heappop
+from itertools import count
+
+
+class HopEnvironment(simpy.Environment):
+    ''' This module implements a SimPy compatible environment in which packet hops are
+        not SimPy processes, but plain callbacks kept in a separate heap of
+        (time, seq, callback, packet) entries. The long-lived client loops are still
+        ordinary SimPy processes living in the SimPy event queue; on each step we run
+        whichever of the two queues holds the earliest entry.
+    '''
+
+    def __init__(self, initial_time=0):
+        super().__init__(initial_time)
+        self._hops = []
+        self._hop_seq = count()
+
+
+    def schedule_callback(self, delay, callback, packet):
+        ''' Schedules callback(packet) to be called after the given delay.
+
+            Keyword arguments:
+            delay - the time after which the callback should be called,
+            callback - the function to be called, usually a method of the Node handling the hop,
+            packet - the packet which is passed to the callback.
+        '''
+        heappush(self._hops, (self._now + delay, next(self._hop_seq), callback, packet))
+
+
+    def peek(self):
+        if self._hops and self._hops[0][0] < super().peek():
+            return self._hops[0][0]
+        return super().peek()
+
+
+    def step(self):
+        # On ties SimPy events go first, so that e.g. env.run(until=...) stops before the hops
+        # scheduled at exactly that time.
+        hops = self._hops
+        if hops and (not self._queue or hops[0][0] < self._queue[0][0]):
+            self._now, _, callback, packet = heappop(hops)
+            callback(packet)
+        else:
+            super().step()
+
+
+def make_environment(conf):
+    ''' Creates the simulation environment of the engine selected in the config. '''
+
+    engine = conf.get("simulation", {}).get("engine", "simpy")
+    if engine == "simpy":
+        return simpy.Environment()
+    elif engine == "heap":
+        return HopEnvironment()
+    else:
+        raise Exception("Didn't recognize the simulation engine")
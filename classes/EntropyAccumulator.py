@@ -0,0 +1,65 @@
+import numpy
+
+
+def entropy_terms(p):
+    ''' Returns -p * log2(p) for every entry of the array p, 0 for the entries which are 0. '''
+    terms = numpy.zeros(len(p))
+    nonzero = p > 0.0
+    terms[nonzero] = -p[nonzero] * numpy.log2(p[nonzero])
+    return terms
+
+
+class EntropyAccumulator(object):
+    ''' This module accumulates the entropy of the target packets at the last mixes: for every packet
+        leaving a last mix, -p * log2(p) of each target packet it may be (see Node.update_entropy) is
+        added into the given entropy array, in place.
+
+        In the immediate mode, each departing distribution is reduced with a single vector operation.
+        In the deferred mode ("metrics" -> "entropy_mode": "deferred"), the distributions are only copied
+        into a buffer, and reduced in blocks of block_size entries by one bincount, which pays off with
+        tens of thousands of target packets. flush() must be called before reading the entropy array.
+
+        Keyword arguments:
+        entropy - the array of the entropies of the target packets, updated in place,
+        deferred - whether to reduce the distributions in blocks,
+        block_size - the number of buffered entries of the deferred mode.
+    '''
+
+    def __init__(self, entropy, deferred=False, block_size=65536):
+        self.entropy = entropy
+        self.deferred = deferred
+        self.indices = numpy.empty(block_size if deferred else 0, dtype=numpy.int64)
+        self.probabilities = numpy.empty(block_size if deferred else 0)
+        self.size = 0
+
+
+    def add(self, mass):
+        ''' Adds the entropy of the distribution of a departing packet.
+
+            Keyword arguments:
+            mass - the probability mass of the packet, a {target packet index : probability} dict.
+        '''
+        n = len(mass)
+        if n == 0:
+            return
+        if not self.deferred:
+            indices = numpy.fromiter(mass.keys(), dtype=numpy.int64, count=n)
+            self.entropy[indices] += entropy_terms(numpy.fromiter(mass.values(), dtype=float, count=n)) # The indices are unique
+            return
+
+        if self.size + n > len(self.indices):
+            self.flush()
+            if n > len(self.indices):
+                self.indices = numpy.empty(n, dtype=numpy.int64)
+                self.probabilities = numpy.empty(n)
+        self.indices[self.size:self.size + n] = numpy.fromiter(mass.keys(), dtype=numpy.int64, count=n)
+        self.probabilities[self.size:self.size + n] = numpy.fromiter(mass.values(), dtype=float, count=n)
+        self.size += n
+
+
+    def flush(self):
+        ''' Reduces the buffered distributions into the entropy array. '''
+        if self.size == 0:
+            return
+        self.entropy += numpy.bincount(self.indices[:self.size], weights=entropy_terms(self.probabilities[:self.size]), minlength=len(self.entropy))
+        self.size = 0
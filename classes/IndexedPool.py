@@ -0,0 +1,96 @@
+import collections
+
+
+class IndexedPool(object):
+    ''' This module implements the pool of a mix with active queue management ("mixnodes" -> "AQM").
+        Like the dict it replaces, it maps the packet IDs to the packets, but it also keeps the packets
+        in a list, so that a random packet can be picked and removed in O(1) (the removed packet is
+        swapped with the last one), and, if ordered, their arrival order, so that the oldest packet can
+        be found in amortised O(1).
+
+        Every added packet gets a sequence number of the pool, so that an entry of the arrival order is
+        not mistaken for a later packet with the same ID (e.g., an ACK, which reuses the ID of its packet).
+
+        Keyword arguments:
+        ordered - whether to keep the arrival order, needed only by oldest().
+    '''
+
+    __slots__ = ['packets', 'seqs', 'positions', 'order', 'ordered', 'next_seq']
+
+    def __init__(self, ordered=True):
+        self.packets = []
+        self.seqs = [] # Sequence numbers, aligned with packets
+        self.positions = {} # packet ID : position in packets
+        self.order = collections.deque() # (sequence number, packet ID, arrival time) in arrival order, possibly of removed packets
+        self.ordered = ordered
+        self.next_seq = 0
+
+
+    def add(self, packet, now):
+        self.positions[packet.id] = len(self.packets)
+        self.packets.append(packet)
+        self.seqs.append(self.next_seq)
+        if self.ordered:
+            self.order.append((self.next_seq, packet.id, now))
+        self.next_seq += 1
+
+
+    def pop(self, packet_id, default=None):
+        ''' Removes the packet of the given ID and returns it, or returns default if it is not in the pool. '''
+        i = self.positions.pop(packet_id, None)
+        if i is None:
+            return default
+        packet = self.packets[i]
+        last = self.packets.pop()
+        last_seq = self.seqs.pop()
+        if last is not packet:
+            self.packets[i] = last
+            self.seqs[i] = last_seq
+            self.positions[last.id] = i
+        if self.ordered:
+            self.trim()
+        return packet
+
+
+    def in_pool(self, entry):
+        ''' Whether the entry of the arrival order is of a packet still in the pool. '''
+        i = self.positions.get(entry[1])
+        return i is not None and self.seqs[i] == entry[0]
+
+
+    def trim(self):
+        ''' Removes the entries of the removed packets from the front of the arrival order. '''
+        order = self.order
+        while order and not self.in_pool(order[0]):
+            order.popleft()
+
+
+    def random(self, rng):
+        ''' Returns a packet of the pool picked uniformly at random. '''
+        return self.packets[rng.integers(len(self.packets))]
+
+
+    def oldest(self):
+        ''' Returns the packet which has been in the pool for the longest time and its arrival time. '''
+        self.trim()
+        (_, packet_id, arrival) = self.order[0]
+        return self.packets[self.positions[packet_id]], arrival
+
+
+    def values(self):
+        return list(self.packets)
+
+
+    def clear(self):
+        self.packets.clear()
+        self.seqs.clear()
+        self.positions.clear()
+        self.order.clear()
+
+
+    def __contains__(self, packet_id):
+        return packet_id in self.positions
+
+
+    def __len__(self):
+        return len(self.packets)
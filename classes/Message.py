@@ -1,5 +1,4 @@
-from classes.Utilities import random_string
-import random
+from classes.Utilities import random_payload
 from classes.Packet import Packet
 import math
 
@@ -7,12 +6,12 @@ class Message():
     ''' This class defines an object of a Message, which is a message send between
     the sender and recipient. '''
 
-    __slots__ = ['conf', 'id', 'payload', 'real_sender', 'time_queued', 'time_sent', 'time_delivered', 'transit_time', 'reconstruct', 'complete_receiving', 'pkts']
+    __slots__ = ['conf', 'id', 'payload', 'real_sender', 'time_queued', 'time_sent', 'time_delivered', 'transit_time', 'reconstruct', 'complete_receiving', 'dropped', 'pkts']
     def __init__(self, conf, net, payload, dest, real_sender, id=None):
 
         self.conf = conf
 
-        self.id = id or random_string(self.conf["misc"]["id_len"])
+        self.id = id if id is not None else next(net.env.ids)
         self.payload = payload
         self.real_sender = real_sender
 
@@ -24,6 +23,7 @@ class Message():
 
         # State on reception
         self.complete_receiving = False
+        self.dropped = False # Whether one of its packets was dropped (see Network.drop_packet)
         # Packets
         self.pkts = self.split_into_packets(net, dest)
 
@@ -32,13 +32,35 @@ class Message():
     def random(cls, conf, net, sender, dest):
         ''' This class method creates a random message, with random payload. '''
 
-        size = random.randint(conf["message"]["min_msg_size"], conf["message"]["max_msg_size"])
-        payload = random_string(size)
+        size = int(net.rng.integers(conf["message"]["min_msg_size"], conf["message"]["max_msg_size"] + 1))
+        payload = random_payload(conf, size)
 
         m = cls(conf=conf, net=net, payload=payload, real_sender=sender, dest=dest)
         return m
 
 
+    @classmethod
+    def remote(cls, conf, id, payload, real_sender, num_packets, time_queued, time_sent):
+        ''' Rebuilds a message sent from another shard of a parallel run (see classes/ShardNet.py)
+            from the information carried by its packets. The packets of a message get the IDs
+            following the one of the message (see split_into_packets).
+        '''
+        m = cls.__new__(cls)
+        m.conf = conf
+        m.id = id
+        m.payload = payload
+        m.real_sender = real_sender
+        m.time_queued = time_queued
+        m.time_sent = time_sent
+        m.time_delivered = None
+        m.transit_time = None
+        m.reconstruct = set(range(id + 1, id + 1 + num_packets))
+        m.complete_receiving = False
+        m.dropped = False
+        m.pkts = [None] * num_packets # Only their number is known
+        return m
+
+
     def split_into_packets(self, net, dest):
         ''' Function splits the payload of the message into the fixed size blocks
             and encodes them into the objects of class Packet.
@@ -61,8 +83,7 @@ class Message():
             fragments = [self.payload[i:i + int(self.conf["packet"]["packet_size"])] for i in range(0, len(self.payload), int(self.conf["packet"]["packet_size"]))]
 
         for i, f in enumerate(fragments):
-            rand_route = net.select_random_route()
-            rand_route = rand_route + [dest]
+            rand_route = net.select_random_route(dest)
             tmp_pkt = Packet(conf=self.conf, route=rand_route, payload=f, sender=self.real_sender, dest=dest, msg_id=self.id, type="REAL", order=i+1, num=num_fragments, message=self)
             pkts.append(tmp_pkt)
             self.reconstruct.add(tmp_pkt.id)
@@ -1,75 +1,157 @@
+import collections
 import simpy
-import random
+from classes.RandomBuffer import RandomBuffer
 
-class MixGuard(object):
-    __slots__ = ['env', 'conf', 'net', 'logger', 'layer', 'id', 'resource_queue', 'queue', 'resource_queue', 'max_capacity']
 
-    def __init__(self, env, conf, net, id=None, layer=None, logger=None):
+class MixGuard(object):
+    ''' This module implements the gateway (guard) placed in front of the first layer of mixes
+        ("network" -> "stratified" -> "num_gateways"). The gateway does not mix: it queues the incoming
+        packets in FIFO order and serves them with "servers" parallel servers (modelled by resource_queue),
+        each packet taking a service time drawn from the service-time model ("deterministic" or "exponential"
+        with the mean "service_time"). The queue holds at most "capacity" packets; when it is full, the
+        capacity policy decides which packet is dropped:
+
+            tail   - the arriving packet,
+            random - a random packet of the queue (the arriving one is queued),
+            red    - Random Early Detection: the arriving packet is dropped with a probability growing
+                     linearly from 0 to "red_max_p" while the moving average of the queue length grows
+                     from "red_min" to "red_max", always above "red_max" or if the queue is full.
+
+        The gateway is event-driven: its serving process waits on an event which is triggered when a packet
+        arrives into the empty queue, so an idle gateway costs no events.
+
+        Keyword arguments:
+        env - the simulation environment,
+        conf - the configuration of the simulation, with the parameters of the gateways in conf["gateways"],
+        net - the network,
+        id - the ID of the gateway.
+    '''
+    __slots__ = ['env', 'conf', 'net', 'id', 'index', 'rng', 'random', 'queue', 'resource_queue', 'wakeup', 'max_capacity', 'policy',
+                 'service', 'service_time', 'red_min', 'red_max', 'red_max_p', 'red_weight', 'avg_queue', 'pkts_received', 'pkts_sent', 'pkts_dropped']
+
+    def __init__(self, env, conf, net, id=None):
 
         self.env = env
         self.conf = conf
-        self.layer = layer
         self.net = net
-        self.logger = logger
-        self.id = id or random_string(self.conf["misc"]["id_len"])
+        self.id = id
+        self.index = None # Position in Network.nodes
+        self.rng = env.rng
+        self.random = RandomBuffer(self.rng, conf.get("simulation", {}).get("rng_buffer", 4096))
+
+        gateways = conf["gateways"]
+        self.max_capacity = int(gateways["capacity"])
+        self.policy = gateways["policy"]
+        if self.policy not in ["tail", "random", "red"]:
+            raise Exception("Didn't recognize the capacity policy of the gateways")
+        self.service = gateways["service"]
+        if self.service not in ["deterministic", "exponential"]:
+            raise Exception("Didn't recognize the service-time model of the gateways")
+        self.service_time = float(gateways["service_time"])
+        self.red_min = float(gateways.get("red_min", 0.25 * self.max_capacity))
+        self.red_max = float(gateways.get("red_max", 0.75 * self.max_capacity))
+        self.red_max_p = float(gateways.get("red_max_p", 0.1))
+        self.red_weight = float(gateways.get("red_weight", 0.002))
+        self.avg_queue = 0.0
+
+        # Resource queue to model congestion: the packets being served hold one of its servers
+        self.resource_queue = simpy.Resource(self.env, capacity=int(gateways["servers"]))
+        self.queue = collections.deque()
+        self.wakeup = None # Triggered when a packet arrives while the serving process waits for one
+
+        self.pkts_received = 0
+        self.pkts_sent = 0
+        self.pkts_dropped = 0
 
-        self.max_capacity = 100
-        # Resource queue to model congestion
-        self.resource_queue = simpy.PriorityResource(self.env, capacity=self.max_capacity)
-        self.queue = []
 
     def start(self):
-        print("> %s started" % self.id)
-        yield self.env.timeout(0)
-
+        ''' Starts the serving process of the gateway. '''
         self.env.process(self.flush_packets())
 
 
-    def set_network(self, topology):
-        ''' Function sets a given network topology.
+    def reseed(self, rng):
+        self.rng = rng
+        self.random = RandomBuffer(rng, self.random.max_size)
 
-            Keyword arguments:
-            topology - a topology of the network.
-        '''
-        self.topology = topology
 
     def process_packet(self, packet):
-        yield self.env.timeout(0)
+        self.add_packet_to_queue(packet)
+        return
+        yield
+
+
+    def receive_packet(self, packet):
         self.add_packet_to_queue(packet)
 
 
     def add_packet_to_queue(self, packet):
-        ''' Adding packet to the internal queue.
-            Check whether the queue is not too large.
+        ''' Adds the packet to the queue, applying the capacity policy,
+            and wakes up the serving process if it waits for packets.
         '''
+        self.pkts_received += 1
+        if self.policy == "red":
+            self.avg_queue += self.red_weight * (len(self.queue) - self.avg_queue)
+            if self.red_drop():
+                self.drop_packet(packet)
+                return
+        elif len(self.queue) >= self.max_capacity:
+            if self.policy == "tail":
+                self.drop_packet(packet)
+                return
+            victim = self.rng.integers(len(self.queue))
+            dropped = self.queue[victim]
+            del self.queue[victim]
+            self.drop_packet(dropped)
+
         self.queue.append(packet)
-        self.manage_queue()
+        if self.wakeup is not None:
+            wakeup, self.wakeup = self.wakeup, None
+            wakeup.succeed()
+
+
+    def red_drop(self):
+        ''' Decides whether RED drops the arriving packet. '''
+        if len(self.queue) >= self.max_capacity or self.avg_queue >= self.red_max:
+            return True
+        if self.avg_queue < self.red_min:
+            return False
+        return self.rng.random() < self.red_max_p * (self.avg_queue - self.red_min) / (self.red_max - self.red_min)
+
+
+    def drop_packet(self, packet):
+        self.pkts_dropped += 1
+        self.net.drop_packet(packet, recycle=True)
+
 
     def flush_packets(self):
-        ''' Continusly check whether there are any packets
-            to send.
+        ''' Serves the queued packets in FIFO order, as soon as a server is free.
+            Waits on the wakeup event while the queue is empty.
         '''
         while True:
-            if len(self.queue) > 1:
-                packet = self.queue.pop()
-                self.env.process(self.handel_packet(packet))
-                # yield self.env.timeout(1)
-            else:
-                yield self.env.timeout(1)
+            if not self.queue:
+                self.wakeup = self.env.event()
+                yield self.wakeup
+            request = self.resource_queue.request()
+            yield request
+            packet = self.queue.popleft() # The queue may have changed while waiting for the server, but not emptied
+            self.env.process(self.handle_packet(packet, request))
+
+
+    def get_service_time(self):
+        if self.service == "exponential":
+            return self.random.exponential(self.service_time)
+        return self.service_time
 
-    def manage_queue(self):
-        if len(self.queue) > self.max_capacity:
-            self.queue = []
 
-    def handel_packet(self, packet):
-        with self.resource_queue.request() as req:
-            yield req
-            yield self.env.timeout(1)
-            self.forward_packet(packet)
+    def handle_packet(self, packet, request):
+        yield self.env.timeout(self.get_service_time())
+        self.resource_queue.release(request)
+        self.forward_packet(packet)
 
 
     def forward_packet(self, packet):
-        self.env.process(self.net.forward_packet(packet))
+        self.pkts_sent += 1
+        self.net.dispatch_packet(packet)
 
     def __hash__(self):
         return self.id.__hash__()
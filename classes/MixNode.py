@@ -1,6 +1,5 @@
 import numpy
 import simpy
-import random
 from classes.Utilities import random_string, StructuredMessage
 from classes.Node import Node
 import experiments.Settings
@@ -15,11 +14,10 @@ class MixNode(Node):
 
 
     def drop_random(self):
-        '''Drops a packet from the pool at random, and returns it.'''
+        '''Drops a packet from the pool at random, and returns it. Needs the pool of the AQM (see classes/IndexedPool.py).'''
 
-        pkt_id = random.choice(list(self.pool.keys()))
-        self.pool[pkt_id].dropped = True
-        pkt=self.pool.pop(pkt_id)
+        pkt = self.pool.random(self.rng)
+        self.drop_from_pool(pkt)
         return pkt
 
 
@@ -1,8 +1,11 @@
 import math
-import random
 import numpy
 from classes.Node import Node
-from classes.Client import Client
+from classes.ClientPool import ClientPool
+from classes.MixGuard import MixGuard
+from classes.PacketTable import PacketTable, TablePacket
+from classes.Packet import num_labels
+from classes.RouteSampler import RouteSampler
 import experiments.Settings
 import os
 
@@ -15,8 +18,16 @@ class Network(object):
         self.topology = {}
         self.type = type
         self.loggers = loggers
+        self.engine = conf.get("simulation", {}).get("engine", "simpy")
+        self.rng = env.rng
 
-        self.clients = [Client(env, conf, self, loggers = loggers, label=0) for i in range(int(conf["clients"]["number"]))]
+        # Delivered dummy packets, kept for reuse by Packet.dummy if "packet" -> "recycle" is set
+        self.recycle_packets = conf["packet"].get("recycle", False)
+        self.free_packets = []
+        self.gateways = []
+
+        # The clients are built lazily, see classes/ClientPool.py. In the p2p topology the peers act as the clients.
+        self.clients = ClientPool(env, conf, self, loggers, 0 if type == "p2p" else int(conf["clients"]["number"]))
 
         if type == "p2p":
             self.peers = [Node(env, conf, self, id="Peer%s" % i, loggers = loggers) for i in range(int(conf["clients"]["number"]))]
@@ -31,6 +42,8 @@ class Network(object):
                 self.topology["Type"] = "stratified"
                 num_mixnodes = int(self.conf["network"]["stratified"]["layers"]) * int(self.conf["network"]["stratified"]["layer_size"])
                 self.mixnodes = [Node(env, conf, self, id="M%s" % i, loggers = loggers) for i in range(num_mixnodes)]
+                # Gateways in front of the first layer, see classes/MixGuard.py
+                self.gateways = [MixGuard(env, conf, self, id="G%s" % i) for i in range(int(self.conf["network"]["stratified"].get("num_gateways", 0)))]
                 self.init_stratified()
             elif type == "multi_cascade":
                 self.topology["Type"] = "multi_cascade"
@@ -40,8 +53,33 @@ class Network(object):
             else:
                 raise Exception("Didn't recognize the network type")
         print("Current topology: ", self.topology["Type"])
+
+        # All the nodes, indexed by Node.index (used by the routes, see classes/RouteSampler.py).
+        # The rows of the dormant clients are None until the clients are built.
+        self.nodes = [None] * self.clients.number + (self.peers if type == "p2p" else self.mixnodes) + self.gateways
+        for i, node in enumerate(self.nodes[self.clients.number:], self.clients.number):
+            node.index = i
+        self.route_sampler = RouteSampler(self, conf["network"].get("route_buffer", 10000), conf["network"].get("bandwidth"))
+
+        # If "packet" -> "backend" is "table", dummy packets are rows of a PacketTable instead of Packet objects
+        self.packet_table = None
+        if conf["packet"].get("backend", "objects") == "table":
+            self.packet_table = PacketTable(self, conf["packet"].get("table_capacity", 100000), self.get_route_length() + 1, num_labels(conf))
+        for g in self.gateways:
+            g.start()
         # print("Batching yes/no: ", self.conf["mixnodes"]["batch"])
 
+    def get_route_length(self):
+        ''' Number of mixes (and gateways) on a route. '''
+        if self.topology["Type"] == "stratified":
+            return int(self.conf["network"]["stratified"]["layers"]) + (1 if self.gateways else 0)
+        elif self.topology["Type"] == "cascade":
+            return int(self.conf["network"]["cascade"]["cascade_len"])
+        elif self.topology["Type"] == "multi_cascade":
+            return int(self.conf["network"]["multi_cascade"]["cascade_len"])
+        elif self.topology["Type"] == "p2p":
+            return int(self.conf["network"]["p2p"]["path_length"])
+
     def init_p2p(self):
         self.topology["peers"] = self.peers.copy()
 
@@ -65,35 +103,122 @@ class Network(object):
             for j in range(0, mixes_per_layer):
                 self.topology[self.mixnodes[i * mixes_per_layer + j]] = layers[i + 1]
 
-    def select_random_route(self):
-        tmp_route = []
+    def reseed(self, rng):
+        ''' Switches the network and all its nodes to a new random stream.
 
-        if self.topology["Type"] == "stratified":
-            tmp_route = [random.choice(L) for L in self.topology["Layers"]]
-        elif self.topology["Type"] == "cascade":
-            tmp_route = self.topology["cascade"].copy()
-        elif self.topology["Type"] == "multi_cascade":
-            tmp_route = random.choice(self.topology["cascades"])
-        elif self.topology["Type"] == "p2p":
-            length = self.conf["network"]["p2p"]["path_length"]
-            tmp_route = random.sample(self.peers, length)
+            Keyword arguments:
+            rng - the new numpy.random.Generator.
+        '''
+        self.env.rng = rng
+        self.rng = rng
+        for node in self.clients.built_clients() + getattr(self, "mixnodes", []) + getattr(self, "peers", []) + self.gateways:
+            node.reseed(rng)
+        self.route_sampler.reseed(rng)
+
+
+    def recycle_packet(self, packet):
+        ''' Returns the row of a delivered packet to the packet table, or puts the delivered
+            dummy packet into the free list, if packet recycling is enabled.
+            The packet must not be referenced anywhere else anymore.
+
+            Keyword arguments:
+            packet - the delivered packet.
+        '''
+        if isinstance(packet, TablePacket):
+            packet.table.free(packet.row)
+        elif self.recycle_packets:
+            self.free_packets.append(packet)
+
+
+    def drop_packet(self, packet, recycle=False):
+        ''' Drops the packet from the network, e.g., when the queue of a gateway is full.
+            A dropped real packet is counted as lost, so that the simulation does not wait
+            for its message to be delivered.
+
+            Keyword arguments:
+            packet - the dropped packet,
+            recycle - whether the packet is not referenced anywhere anymore and can be recycled.
+        '''
+        packet.dropped = True
+        self.env.packets_dropped += 1
+        if packet.type == "REAL":
+            self.drop_message(packet.message)
+        elif packet.type == "DUMMY" and recycle:
+            self.recycle_packet(packet)
+
+
+    def drop_message(self, msg):
+        ''' Counts the message of a dropped real packet as lost, unless it has already been received.
+
+            Keyword arguments:
+            msg - the message of the dropped packet.
+        '''
+        if not msg.complete_receiving and not msg.dropped:
+            msg.dropped = True
+            self.env.message_ctr -= 1
+            if self.env.finished and self.env.message_ctr <= 0 and not self.env.stop_sim_event.triggered:
+                print('> The stop simulation condition happend.')
+                self.env.stop_sim_event.succeed()
+
+
+    def select_random_route(self, dest):
+        ''' Returns a random route ending at the given destination, as an int array
+            of indices into self.nodes (see classes/RouteSampler.py).
+
+            Keyword arguments:
+            dest - the destination node of the packet.
+        '''
+        return self.route_sampler.route(dest)
+
+
+    def dispatch_packet(self, packet, delay=0.0):
+        ''' Function hands over the packet to the network, using the way of scheduling
+            the hops of the engine set in the config ("simulation" -> "engine").
+
+            Keyword arguments:
+            packet - the packet to be forwarded,
+            delay - the time after which the packet is handed over.
+        '''
+        if self.engine == "heap":
+            self.env.schedule_callback(delay, self.deliver_packet, packet)
+        else:
+            self.env.process(self.forward_packet(packet, delay))
 
-        return tmp_route
 
+    def deliver_packet(self, packet):
+        ''' Counterpart of forward_packet used by the heap engine, called as a plain callback.
 
-    def forward_packet(self, packet):
+            Keyword arguments:
+            packet - the packet to be forwarded.
+        '''
+        next_node = self.nodes[packet.route[packet.current_node + 1]]
+        packet.current_node += 1
+        next_node.receive_packet(packet)
+
+
+    def forward_packet(self, packet, delay=0.0):
         ''' Function responsible for forwarding the packet, i.e.,
             checking what is the next hop of the packet and triggering the
             process_packet function by a particular node.
 
             Keyword arguments:
-            packet - the packet to be forwarded.
+            packet - the packet to be forwarded,
+            delay - the time after which the packet is handed over.
         '''
         # TODO: If needed, some network delay can be added.
-        yield self.env.timeout(0)
+        yield self.env.timeout(delay)
 
         # print(packet.current_node, packet.route, packet.dest)
-        next_node = packet.route[packet.current_node + 1]
+        self.hand_over(packet)
+
+
+    def hand_over(self, packet):
+        ''' Starts the processing of the packet by its next hop right away (simpy engine).
+
+            Keyword arguments:
+            packet - the packet to be forwarded.
+        '''
+        next_node = self.nodes[packet.route[packet.current_node + 1]]
         packet.current_node += 1
         self.env.process(next_node.process_packet(packet))
 
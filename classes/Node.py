@@ -1,9 +1,15 @@
-from classes.Utilities import random_string, StructuredMessage, get_exponential_delay
+from classes.Utilities import random_string, StructuredMessage
 import math
 import numpy as np
-from classes.Packet import Packet
+from classes.Packet import Packet, num_labels
 from classes.Message import Message
-import random
+from classes.PoolMixture import PoolMixture
+from classes.RandomBuffer import RandomBuffer
+from classes.IndexedPool import IndexedPool
+from classes.PacketTable import TablePacket
+
+# The time of processing the Sphinx packet (benchmarked using our Sphinx rust implementation).
+PROCESSING_TIME = 0.000386
 
 class Node(object):
 
@@ -13,6 +19,9 @@ class Node(object):
         self.conf = conf
         self.id = id or random_string(self.conf["misc"]["id_len"])
         self.net = net
+        self.index = None # Position in Network.nodes
+        self.rng = env.rng # The random stream of the run, see setup_env in simulation_modes/test_mode.py
+        self.random = RandomBuffer(self.rng, self.conf.get("simulation", {}).get("rng_buffer", 4096)) # All the delays are drawn through it
 
         self.pkts_received = 0
         self.pkts_sent = 0
@@ -20,12 +29,23 @@ class Node(object):
 
         self.avg_delay = 0.0 if self.conf["mixnodes"]["avg_delay"] == 0.0 else float(self.conf["mixnodes"]["avg_delay"])
 
+        # Active queue management of the pool ("mixnodes" -> "AQM"), see manage_pool
+        self.aqm = self.conf["mixnodes"]["AQM"] == True
+        self.pool_cap = int(self.conf["mixnodes"].get("pool_cap", 1000))
+        self.drop_policy = self.conf["mixnodes"].get("drop_policy", "random")
+        if self.drop_policy not in ["random", "oldest", "codel"]:
+            raise Exception("Didn't recognize the drop policy")
+        self.codel_target = float(self.conf["mixnodes"].get("codel_target", 0.5))
+        self.codel_interval = float(self.conf["mixnodes"].get("codel_interval", 1.0))
+        self.codel_first_above = None # When the sojourn time started to be above the target (plus the interval)
+        self.codel_drop_next = None
+        self.codel_count = 0
+        self.pkts_dropped = 0
+
         # State
-        self.pool = {}
+        self.pool = IndexedPool(ordered=(self.drop_policy != "random")) if self.aqm else {}
         self.inter_pkts = 0 #ctr which count how many new packets arrived since the last time a packet left
-        self.probability_mass = None
-        self.sender_estimates = None
-        self.pool = {}
+        self.mixture = PoolMixture(num_labels(self.conf))
         self.mixlogging = False
 
         self.loggers = loggers if loggers else None
@@ -47,8 +67,16 @@ class Node(object):
         self.num_received_packets = 0
         self.msg_buffer_in = {}
         self.start_logs = False
+
+        # Batch mixing ("mixnodes" -> "batch"), see add_pkt_in_batch
+        self.batching = self.conf["mixnodes"]["batch"] == True
+        self.batch_strategy = self.conf["mixnodes"].get("batch_strategy", "threshold")
+        if self.batch_strategy not in ["threshold", "timed", "threshold_or_timed"]:
+            raise Exception("Didn't recognize the batch strategy")
+        self.batch_size = int(self.conf["mixnodes"]["batch_size"])
+        self.batch_timeout = float(self.conf["mixnodes"].get("batch_timeout", 1.0))
+        self.batch_deadline = None # Time of the next timed flush, None until the timer is started
         self.batch_num = 0
-        self.free_to_batch = True
 
 
     def start(self, dest):
@@ -59,15 +87,10 @@ class Node(object):
         packet (i.e., cover loop packet).
         '''
 
-        delays = []
-
         while True:
             if self.alive:
-                if delays == []:
-                    delays = list(np.random.exponential(self.rate_sending, 10000))
-
-                delay = delays.pop()
-                yield self.env.timeout(float(delay))
+                delay = self.random.exponential(self.rate_sending)
+                yield self.env.timeout(delay)
 
                 if len(self.pkt_buffer_out) > 0: #If there is a packet to be send
                     tmp_pkt = self.pkt_buffer_out.pop(0)
@@ -89,14 +112,10 @@ class Node(object):
         '''
 
         if self.cover_traffic:
-            delays = []
             while True:
                 if self.alive:
-                    if delays == []:
-                        delays = list(np.random.exponential(self.cover_traffic_rate, 10000))
-
-                    delay = delays.pop()
-                    yield self.env.timeout(float(delay))
+                    delay = self.random.exponential(self.cover_traffic_rate)
+                    yield self.env.timeout(delay)
 
                     cover_loop_packet = Packet.dummy(conf=self.conf, net = self.net, dest=self, sender=self)
                     cover_loop_packet.time_queued = self.env.now
@@ -107,6 +126,16 @@ class Node(object):
         else:
             pass
 
+    def reseed(self, rng):
+        ''' Switches the node to a new random stream, dropping the delays already drawn from the old one.
+
+            Keyword arguments:
+            rng - the new numpy.random.Generator.
+        '''
+        self.rng = rng
+        self.random = RandomBuffer(rng, self.random.max_size)
+
+
     def send_packet(self, packet):
         ''' Methods sends a packet into the network,
          and logs information about the sending.
@@ -122,24 +151,85 @@ class Node(object):
         if packet.type == "REAL" and packet.message.time_sent is None:
             packet.message.time_sent = packet.time_sent
 
-        self.env.process(self.net.forward_packet(packet))
+        self.net.dispatch_packet(packet)
+
+
+    def add_pkt_in_batch(self, packet):
+        ''' Adds the packet into the pool of a batch mix, which flushes the whole pool at once:
+            when it holds batch_size packets ("threshold"), every batch_timeout ticks ("timed"),
+            or at whichever of the two comes first ("threshold_or_timed").
+
+            Keyword arguments:
+            packet - the packet added into the pool.
+        '''
+        self.add_pkt_in_pool(packet)
+        if self.batch_strategy != "threshold" and self.batch_deadline is None:
+            self.batch_deadline = self.env.now + self.batch_timeout
+            self.env.process(self.batch_timer())
+        if self.batch_strategy != "timed" and len(self.pool) >= self.batch_size:
+            self.flush_batch()
+
+
+    def batch_timer(self):
+        ''' Flushes the pool every batch_timeout ticks. A threshold flush moves the deadline,
+            in which case the timer just sleeps until the new one.
+        '''
+        while True:
+            yield self.env.timeout(self.batch_deadline - self.env.now)
+            if self.env.now >= self.batch_deadline:
+                self.flush_batch()
+
 
+    def flush_batch(self):
+        ''' Sends out all the packets of the pool in a random order. The packets leave the pool
+            together, and the i-th one is handed to the network after i times the processing time
+            of a packet (the cryptographic processing of the batch).
 
-    def process_batch_round(self):
-        ''' Additional function if we want to simulate a batching technique.
+            With the heap engine every packet gets one heap entry, which is its arrival at the next
+            hop (the packets arrive one by one, so this is the least there can be). With the simpy
+            engine the whole batch is released by a single process (see release_batch), instead of
+            one forwarding process per packet, i.e., one Timeout per packet instead of a Timeout and
+            the Initialize of a process.
         '''
         self.batch_num += 1
+        self.batch_deadline = self.env.now + self.batch_timeout
+
+        batch = list(self.pool.values())
+        # The mixture is the same for all the packets of the batch: the rows of the packet table get it at once
+        table = self.net.packet_table
+        if table is not None:
+            self.mixture.assign_rows(table, table.rows_of([p for p in batch if isinstance(p, TablePacket)]))
+        order = self.rng.permutation(len(batch))
+        offsets = PROCESSING_TIME * np.arange(1, len(batch) + 1)
+        heap = self.net.engine == "heap"
+        released = []
+        for i, offset in zip(order, offsets.tolist()):
+            packet = batch[i]
+            if table is None or not isinstance(packet, TablePacket):
+                self.mixture.assign(packet)
+            self.pkts_sent += 1
+            if self.index == packet.route[-2] and self.mixlogging:
+                self.update_entropy(packet)
+            if heap:
+                self.net.dispatch_packet(packet, offset)
+            else:
+                released.append(packet)
+        if released:
+            self.env.process(self.release_batch(released, self.env.now + offsets))
+        self.pool.clear()
+        self.mixture.clear()
 
-        batch = list(self.pool.keys())[:int(self.conf["mixnodes"]["batch_size"])]
-        random.shuffle(batch)
-        for pktid in batch:
-            if pktid in self.pool.keys():
-                pkt = self.pool[pktid]
-                yield self.env.timeout(0.000386) # add some delay for packet cryptographinc processing
-                self.forward_packet(pkt)
-        self.free_to_batch = True
-        return
-        yield
+
+    def release_batch(self, packets, times):
+        ''' Hands the packets of a flushed batch over to their next hops at the given times (simpy engine).
+
+            Keyword arguments:
+            packets - the packets of the batch, in the order in which they leave,
+            times - the times at which they are handed over.
+        '''
+        for packet, time in zip(packets, times.tolist()):
+            yield self.env.timeout(time - self.env.now)
+            self.net.hand_over(packet)
 
 
     def process_packet(self, packet):
@@ -156,25 +246,61 @@ class Node(object):
             self.env.process(self.process_received_packet(packet))
         else:
             self.pkts_received += 1
-            self.add_pkt_in_pool(packet)
 
-            if (self.net.type == "cascade" or self.net.type == "multi_cascade") and self.conf["mixnodes"]["batch"] == True:
-                if len(self.pool) >= int(self.conf["mixnodes"]["batch_size"]) and self.free_to_batch == True:
-                    self.free_to_batch = False
-                    self.env.process(self.process_batch_round())
+            if self.batching:
+                self.add_pkt_in_batch(packet)
             else:
-
-                delay = get_exponential_delay(self.avg_delay) if self.avg_delay != 0.0 else 0.0
-                wait = delay + 0.000386 # add the time of processing the Sphinx packet (benchmarked using our Sphinx rust implementation).
-                yield self.env.timeout(wait)
+                self.add_pkt_in_pool(packet)
+                yield self.env.timeout(self.get_mixing_delay())
 
                 if not packet.dropped: # It may get dropped if pool gets full, while waiting
                     self.forward_packet(packet)
-                else:
-                    pass
+                elif packet.type == "DUMMY":
+                    self.net.recycle_packet(packet)
+
+
+    def receive_packet(self, packet):
+        ''' Counterpart of process_packet used by the heap engine (see classes/Engine.py):
+            instead of running as a SimPy process, the packet is handled right away and
+            its departure from the pool is scheduled as a plain callback.
+
+            Keyword arguments:
+            packet - the packet which should be processed.
+        '''
+        if self.id == packet.dest.id:
+            self.register_received_packet(packet)
+        else:
+            self.pkts_received += 1
+
+            if self.batching:
+                self.add_pkt_in_batch(packet)
+            else:
+                self.add_pkt_in_pool(packet)
+                self.env.schedule_callback(self.get_mixing_delay(), self.release_packet, packet)
+
+
+    def release_packet(self, packet):
+        if not packet.dropped: # It may get dropped if pool gets full, while waiting
+            self.forward_packet(packet)
+        elif packet.type == "DUMMY":
+            self.net.recycle_packet(packet)
+
+
+    def get_mixing_delay(self):
+        if self.avg_delay == 0.0:
+            delay = 0.0
+        else:
+            delay = self.random.exponential(self.avg_delay)
+        return delay + PROCESSING_TIME
 
 
     def process_received_packet(self, packet):
+        self.register_received_packet(packet)
+        return
+        yield  # self.env.timeout(0.0)
+
+
+    def register_received_packet(self, packet):
         ''' 1. Processes the received packets and logs informatiomn about them.
             2. If enabled, it sends an ACK packet to the sender.
             3. Checks whether all the packets of particular message were received and logs the information about the reconstructed message.
@@ -193,8 +319,10 @@ class Node(object):
             if not msg.complete_receiving:
                 msg.register_received_pkt(packet)
                 self.msg_buffer_in[msg.id] = msg
+                if self.start_logs:
+                    self.env.metrics.add_packet(packet)
                 if self.conf["logging"]["enabled"] and self.packet_logger is not None and self.start_logs:
-                    self.packet_logger.info(StructuredMessage(metadata=("RCV_PKT_REAL", self.env.now, self.id, packet.id, packet.type, packet.msg_id, packet.time_queued, packet.time_sent, packet.time_delivered, packet.fragments, packet.sender_estimates[0], packet.sender_estimates[1], packet.sender_estimates[2], packet.real_sender.label, packet.route, packet.pool_logs)))
+                    self.packet_logger.info(StructuredMessage(metadata=("RCV_PKT_REAL", self.env.now, self.id, packet.id, packet.type, packet.msg_id, packet.time_queued, packet.time_sent, packet.time_delivered, packet.fragments) + tuple(packet.sender_estimates) + (packet.real_sender.label, [self.net.nodes[i] for i in packet.route], packet.pool_logs)))
 
             if msg.complete_receiving:
                 msg_transit_time = (msg.time_delivered - msg.time_sent)
@@ -208,43 +336,30 @@ class Node(object):
                   self.env.stop_sim_event.succeed()
 
         elif packet.type == "DUMMY":
-            pass
+            self.net.recycle_packet(packet)
         else:
             raise Exception("Packet type not recognised")
 
-        return
-        yield  # self.env.timeout(0.0)
-
     def forward_packet(self, packet):
-        if not self.probability_mass is None:
-            packet.probability_mass = self.probability_mass.copy()
-        if not self.sender_estimates is None:
-            packet.sender_estimates = self.sender_estimates.copy()
+        self.mixture.assign(packet)
 
         #If it has been dropped in the meantime, we just skip sending it.
-        try:
-            self.pool.pop(packet.id)
-        except Exception as e:
-            pass
-
-        # If the pool dries out, then we start measurments from scratch
-        if len(self.pool) == 0:
-            self.sender_estimates = None
-            self.probability_mass = None
+        if self.pool.pop(packet.id, None) is not None:
+            self.mixture.remove()
         self.pkts_sent += 1
 
         # If this is the last mixnode, update the entropy taking into account probabilities
         # of packets leaving the network
-        if self.id == packet.route[-2].id and self.mixlogging:
+        if self.index == packet.route[-2] and self.mixlogging:
             self.update_entropy(packet)
 
-        self.env.process(self.net.forward_packet(packet))
+        self.net.dispatch_packet(packet)
 
 
     def update_entropy(self, packet):
-        for i, pr in enumerate(packet.probability_mass):
-            if pr != 0.0:
-                self.env.entropy[i] += -(float(pr) * math.log(float(pr), 2))
+        # probability_mass is sparse, so we only visit the target packets which the
+        # leaving packet may actually be (see classes/EntropyAccumulator.py).
+        self.env.entropy_accumulator.add(packet.probability_mass)
 
 
     def add_pkt_in_pool(self, packet):
@@ -255,21 +370,62 @@ class Node(object):
             packet - the packet for which we update the probabilities vector
         '''
         self.inter_pkts += 1
-        if self.probability_mass is None and self.sender_estimates is None:
-            self.pool[packet.id] = packet
-            self.probability_mass = packet.probability_mass.copy()
-            self.sender_estimates = packet.sender_estimates.copy()
+        if self.aqm:
+            self.pool.add(packet, self.env.now)
+            self.mixture.add(packet)
+            self.manage_pool()
         else:
-            dist_pm = self.probability_mass * len(self.pool) + packet.probability_mass
-            dist_se = self.sender_estimates * len(self.pool) + packet.sender_estimates
+            self.pool[packet.id] = packet
+            self.mixture.add(packet)
+
+
+    def manage_pool(self):
+        ''' Active queue management of the pool: while the pool holds more than pool_cap packets,
+            drops a random packet ("random" drop policy) or the oldest one ("oldest" and "codel").
+            With the "codel" policy, it also drops the oldest packet when the time it has spent
+            in the pool stayed above codel_target for codel_interval, and then again after
+            codel_interval / sqrt(number of drops) while it stays above the target.
+        '''
+        if self.drop_policy == "codel":
+            packet, arrival = self.pool.oldest()
+            now = self.env.now
+            if now - arrival < self.codel_target:
+                self.codel_first_above = None
+                self.codel_drop_next = None
+                self.codel_count = 0
+            elif self.codel_first_above is None:
+                self.codel_first_above = now + self.codel_interval
+            elif now >= self.codel_first_above and (self.codel_drop_next is None or now >= self.codel_drop_next):
+                self.drop_from_pool(packet)
+                self.codel_count += 1
+                self.codel_drop_next = now + self.codel_interval / math.sqrt(self.codel_count)
+
+        while len(self.pool) > self.pool_cap:
+            if self.drop_policy == "random":
+                self.drop_from_pool(self.pool.random(self.rng))
+            else:
+                self.drop_from_pool(self.pool.oldest()[0])
 
-            self.pool[packet.id] = packet  # Add Packet in Pool
 
-            dist_pm = dist_pm / float(len(self.pool))
-            dist_se = dist_se / float(len(self.pool))
+    def drop_from_pool(self, packet):
+        ''' Drops the packet from the pool. Like a leaving packet, the dropped packet may be any
+            of the packets of the pool, so the probability mass of the target packets it takes
+            out of the network (and the entropy it would have added at the last mix) is recorded.
 
-            self.probability_mass = dist_pm.copy()
-            self.sender_estimates = dist_se.copy()
+            Keyword arguments:
+            packet - the dropped packet.
+        '''
+        self.mixture.assign(packet)
+        if self.mixlogging:
+            for i, pr in packet.probability_mass.items():
+                if pr != 0.0:
+                    self.env.mass_dropped[i] += pr
+                    self.env.entropy_dropped[i] += -(float(pr) * math.log(float(pr), 2))
+        self.pool.pop(packet.id)
+        self.mixture.remove()
+        self.pkts_dropped += 1
+        # A packet of a batch mix is not referenced anywhere else, otherwise its release is still scheduled
+        self.net.drop_packet(packet, recycle=self.batching)
 
 
     def set_start_logs(self, time=0.0):
@@ -300,7 +456,7 @@ class Node(object):
             msg.time_queued = current_time  # The time when the message was created and placed into the queue
             for pkt in msg.pkts:
                 pkt.time_queued = current_time
-                pkt.probability_mass[i] = 1.0
+                pkt.probability_mass = {i : 1.0}
             self.add_to_buffer(msg.pkts)
             self.env.message_ctr += 1
             i += 1
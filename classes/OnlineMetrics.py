@@ -0,0 +1,145 @@
+import math
+import numpy
+
+
+def histogram_quantile(histogram, bucket_width, q, maximum):
+    ''' Approximates the q-quantile of the values counted in a fixed-bucket histogram, with the definition
+        of numpy.percentile (linear interpolation between the order statistics around rank q * (n - 1)).
+        The values of a bucket are taken as evenly spread over it, so the result is within one bucket
+        width of the exact quantile, except for the values in the last bucket (over the range of the
+        histogram), which are taken as the maximum.
+
+        Keyword arguments:
+        histogram - the counts of the buckets, the last one counting the values over its range,
+        bucket_width - the width of a bucket,
+        q - the quantile, in [0, 1],
+        maximum - the largest value counted.
+    '''
+    cumulative = numpy.cumsum(histogram)
+    n = int(cumulative[-1]) if len(cumulative) > 0 else 0
+    if n == 0:
+        return None
+
+    def order_statistic(k):
+        i = int(numpy.searchsorted(cumulative, k, side="right"))
+        if i >= len(histogram) - 1:
+            return maximum
+        below = cumulative[i - 1] if i > 0 else 0
+        return min((i + (k - below + 0.5) / float(histogram[i])) * bucket_width, maximum)
+
+    rank = q * (n - 1)
+    k = int(math.floor(rank))
+    value = order_statistic(k)
+    if k + 1 < n:
+        value += (rank - k) * (order_statistic(k + 1) - value)
+    return float(value)
+
+
+class OnlineMetrics(object):
+    ''' This module implements streaming accumulators of the metrics of the tracked packets, updated
+        as the packets are received, so that the metrics of a run are available without writing
+        or parsing the logs:
+        - latency: Welford running mean/variance and a fixed-bucket histogram for the quantiles,
+        - unlinkability: running sums of the epsilons and counts of the packets adding to delta for every
+          pair (real sender, other target sender) of target sender labels, computed from sender_estimates
+          as in metrics/anonymity_metrics.py.
+    '''
+
+    def __init__(self, num_labels=3, latency_max=10.0, latency_buckets=10000):
+        self.num_packets = 0
+        self.latency_mean = 0.0
+        self.latency_m2 = 0.0
+        self.latency_max = 0.0
+
+        self.bucket_width = float(latency_max) / int(latency_buckets)
+        self.histogram = numpy.zeros(int(latency_buckets) + 1, dtype=numpy.int64) # The last bucket counts latencies over latency_max
+
+        # Indexed by [real sender label, other target sender label]; label 0 (other senders) is not a target
+        self.num_labels = int(num_labels)
+        self.epsilon_sum = numpy.zeros((self.num_labels, self.num_labels))
+        self.epsilon_count = numpy.zeros((self.num_labels, self.num_labels), dtype=numpy.int64)
+        self.dlts = numpy.zeros((self.num_labels, self.num_labels), dtype=numpy.int64)
+        self.label_packets = numpy.zeros(self.num_labels, dtype=numpy.int64)
+        self.other_labels = [numpy.array([o for o in range(1, self.num_labels) if o != l], dtype=numpy.int64) for l in range(self.num_labels)]
+
+
+    def add_packet(self, packet):
+        ''' Updates the accumulators with a received tracked packet.
+
+            Keyword arguments:
+            packet - the received packet.
+        '''
+        self.num_packets += 1
+
+        latency = float(packet.time_delivered - packet.time_sent)
+        diff = latency - self.latency_mean
+        self.latency_mean += diff / self.num_packets
+        self.latency_m2 += diff * (latency - self.latency_mean)
+        self.latency_max = max(self.latency_max, latency)
+        self.histogram[min(int(latency / self.bucket_width), len(self.histogram) - 1)] += 1
+
+        label = packet.real_sender.label
+        if label > 0:
+            self.label_packets[label] += 1
+            others = self.other_labels[label]
+            pr_real = float(packet.sender_estimates[label])
+            pr_other = packet.sender_estimates[others]
+            zero = (pr_other == 0.0)
+            self.dlts[label, others[zero]] += 1
+            if pr_real != 0.0:
+                others = others[~zero]
+                ratios = pr_real / packet.sender_estimates[others]
+                self.epsilon_sum[label, others] += numpy.fromiter(map(math.log, ratios), dtype=float, count=len(ratios))
+                self.epsilon_count[label, others] += 1
+
+
+    def merge(self, other):
+        ''' Adds the packets of another OnlineMetrics, with the same parameters, e.g., of another shard
+            of a parallel run (see simulation_modes/parallel_mode.py).
+        '''
+        if other.num_packets == 0:
+            return
+        n = self.num_packets + other.num_packets
+        diff = other.latency_mean - self.latency_mean
+        self.latency_m2 += other.latency_m2 + diff * diff * self.num_packets * other.num_packets / n
+        self.latency_mean += diff * other.num_packets / n
+        self.num_packets = n
+        self.latency_max = max(self.latency_max, other.latency_max)
+        self.histogram += other.histogram
+        self.epsilon_sum += other.epsilon_sum
+        self.epsilon_count += other.epsilon_count
+        self.dlts += other.dlts
+        self.label_packets += other.label_packets
+
+
+    def latency_quantile(self, q):
+        ''' Approximates the q-quantile of the latency from the histogram, see histogram_quantile. '''
+        return histogram_quantile(self.histogram, self.bucket_width, q, self.latency_max)
+
+
+    def pairwise(self):
+        ''' Returns the matrices of epsilon and delta of every pair [real sender label, other target sender label],
+            NaN for the pairs without packets. '''
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            epsilon = self.epsilon_sum / self.epsilon_count
+            delta = self.dlts / self.label_packets[:, None].astype(float)
+        delta[:, 0] = numpy.nan
+        delta[numpy.arange(self.num_labels), numpy.arange(self.num_labels)] = numpy.nan
+        return (epsilon, delta)
+
+
+    def results(self):
+        ''' Returns the metrics, using the same names as the log based ones (see metrics/anonymity_metrics.py).
+            epsilon and delta are over all the pairs of target senders, epsilon_max and delta_max are the ones
+            of the worst pair. '''
+        pairs = self.num_packets * max(self.num_labels - 2, 1)
+        (epsilon, delta) = self.pairwise()
+        return {"epsilon" : float(self.epsilon_sum.sum() / self.epsilon_count.sum()) if self.epsilon_count.sum() > 0 else None,
+                "delta" : float(self.dlts.sum()) / pairs if self.num_packets > 0 else None,
+                "epsilon_max" : float(numpy.nanmax(epsilon)) if self.epsilon_count.sum() > 0 else None,
+                "delta_max" : float(numpy.nanmax(delta)) if not numpy.isnan(delta).all() else None,
+                "latency" : self.latency_mean if self.num_packets > 0 else None,
+                "latency_std" : math.sqrt(self.latency_m2 / self.num_packets) if self.num_packets > 0 else None,
+                "latency_p50" : self.latency_quantile(0.50),
+                "latency_p95" : self.latency_quantile(0.95),
+                "latency_p99" : self.latency_quantile(0.99)}
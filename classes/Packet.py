@@ -1,6 +1,18 @@
-from classes.Utilities import random_string
+from classes.Utilities import random_payload
+from types import MappingProxyType
 import numpy
 
+# Probability mass carried by packets which are not one of the tracked target packets.
+# It is shared by all such packets, hence read-only; tracked packets get their own
+# sparse {target packet index : probability} dict instead.
+EMPTY_MASS = MappingProxyType({})
+
+
+def num_labels(conf):
+    ''' Number of sender labels: 0 for all the other senders, then one per target sender ("misc" -> "num_target_senders"). '''
+    return int(conf["misc"].get("num_target_senders", 2)) + 1
+
+
 class Packet():
     ''' This module implements the Packet object, which is the data structure responsible for
         transporting message blocks among clients.
@@ -11,7 +23,7 @@ class Packet():
 
     def __init__(self, conf, route, payload, sender, dest, type, packet_id = None, msg_id="DUMMY", order=1, num=1, message=None):
         self.conf = conf
-        self.id = packet_id or random_string(32)
+        self.id = packet_id if packet_id is not None else next(sender.env.ids)
 
         self.route = route
         self.payload = payload
@@ -36,21 +48,51 @@ class Packet():
         self.time_delivered = None
 
         # Measurements
-        self.sender_estimates = numpy.array([0.0, 0.0, 0.0]) #Other, A, B
+        self.sender_estimates = numpy.zeros(num_labels(conf)) #Other, A, B, ...
         self.sender_estimates[self.real_sender.label] = 1.0
-        self.probability_mass = numpy.zeros(self.conf["misc"]["num_target_packets"])
+        self.probability_mass = EMPTY_MASS
 
         if self.type=="REAL":
             self.message.reconstruct.add(self.id)
 
 
+    def reuse(self, route, payload, sender, dest, type, msg_id):
+        ''' Resets a delivered packet (see Network.recycle_packet) so that it can be sent again
+            as a new packet, reusing its lists and arrays. Only used for packets without a message.
+        '''
+        self.id = next(sender.env.ids)
+
+        self.route = route
+        self.payload = payload
+        self.real_sender = sender
+        self.dest = dest
+
+        self.msg_id = msg_id
+        self.message = None
+        self.fragments = 1
+        self.type = type
+        del self.pool_logs[:]
+
+        self.dropped = False
+        self.current_node = -1
+        self.times_transmitted = 0
+        self.ACK_Received = False
+        self.time_queued = None
+        self.time_sent = None
+        self.time_delivered = None
+
+        self.sender_estimates.fill(0.0)
+        self.sender_estimates[self.real_sender.label] = 1.0
+        self.probability_mass = EMPTY_MASS
+        return self
+
+
     @classmethod
     def new(cls, conf, net, dest, payload, sender, type, num, msg_id):
         '''Method used for constructing a new Packet where
         the content is defined by the client but the route is generated on the constructor.'''
 
-        rand_route = net.select_random_route()
-        rand_route = rand_route + [dest]
+        rand_route = net.select_random_route(dest)
         return cls(conf=conf, route=rand_route, payload=payload, sender=sender, dest=dest, type=type, num=num, msg_id=msg_id)
 
 
@@ -58,26 +100,27 @@ class Packet():
     def ack(cls, conf, net, dest, sender, packet_id, msg_id):
         '''  The class method used for creating an ack Packet. '''
 
-        payload = random_string(conf["packet"]["packet_size"])
-        rand_route = net.select_random_route()
-        rand_route = rand_route + [dest]
+        payload = random_payload(conf, conf["packet"]["packet_size"])
+        rand_route = net.select_random_route(dest)
         return cls(conf=conf, route=rand_route, payload=payload, sender=sender, dest=dest, packet_id=packet_id, msg_id=msg_id, type="ACK")
 
     @classmethod
-    def dummy(cls, conf, net, dest, sender):
-        '''  The class method used for creating a dummy Packet. '''
-
-        payload = random_string(conf["packet"]["packet_size"])
-        rand_route = net.select_random_route()
-        rand_route = rand_route + [dest]
+    def dummy(cls, conf, net, dest, sender, route=None):
+        '''  The class method used for creating a dummy Packet. The route is drawn at random, unless given. '''
+
+        payload = random_payload(conf, conf["packet"]["packet_size"])
+        rand_route = net.select_random_route(dest) if route is None else route
+        if net.packet_table is not None:
+            return net.packet_table.new_packet(route=rand_route, payload=payload, sender=sender, dest=dest, type="DUMMY", msg_id="-")
+        if net.free_packets:
+            return net.free_packets.pop().reuse(route=rand_route, payload=payload, sender=sender, dest=dest, type="DUMMY", msg_id="-")
         return cls(conf=conf, route=rand_route, payload=payload, sender=sender, dest=dest, type="DUMMY", msg_id="-")
 
     @classmethod
     def dummy_ack(cls, conf, net, dest, sender):
 
-        payload = random_string(conf["packet"]["ack_packet_size"])
-        rand_route = net.select_random_route()
-        rand_route = rand_route + [dest]
+        payload = random_payload(conf, conf["packet"]["ack_packet_size"])
+        rand_route = net.select_random_route(dest)
         return cls(conf=conf, route=rand_route, payload=payload, sender=sender, dest=dest, type="DUMMY_ACK", msg_id="DUMMY_ACK")
 
 
@@ -0,0 +1,201 @@
+import numpy
+from classes.Packet import EMPTY_MASS
+
+
+TYPES = ["REAL", "DUMMY", "ACK", "DUMMY_ACK"]
+TYPE_CODES = {t : i for i, t in enumerate(TYPES)}
+
+
+class PacketTable(object):
+    ''' This module implements the struct-of-arrays backend of the in-flight packets ("packet" -> "backend": "table").
+        Instead of one Packet object per packet, with its own route list and estimates array, every packet
+        is a row of preallocated NumPy columns: the route (indices into Network.nodes) is a row of a 2D array, the times
+        as floats (NaN for None), the sender estimates as a row of a 2D array. Rows are handed out from a stack
+        of free rows and returned once the packet is delivered; the columns grow by doubling when full.
+
+        The rest of the simulator handles the packets through TablePacket handles, which expose the same
+        attributes as Packet. Node pools keep those handles; the only operation over many packets of a pool,
+        giving a flushed batch the mixture of the pool (Node.flush_batch), is a vector operation on their rows,
+        see rows_of and assign. The other pool operations (e.g., the drops of the AQM) change the mixture of
+        the pool after every packet, so they stay per packet.
+    '''
+
+    def __init__(self, net, capacity, route_length, num_labels=3):
+        self.net = net
+        self.conf = net.conf
+        self.route_length = route_length
+        self.num_labels = num_labels
+        self.capacity = 0
+        self.in_use = 0
+        self.allocate(int(capacity))
+
+
+    def allocate(self, capacity):
+        ''' Creates (or grows) the columns to the given capacity, keeping the existing rows. '''
+        old = self.capacity
+
+        def grow(column, shape, dtype, fill):
+            new = numpy.full(shape, fill, dtype=dtype)
+            if old > 0:
+                new[:old] = column
+            return new
+
+        self.id = grow(getattr(self, "id", None), capacity, numpy.int64, -1)
+        self.type = grow(getattr(self, "type", None), capacity, numpy.int8, 0)
+        self.sender = grow(getattr(self, "sender", None), capacity, numpy.int32, -1)
+        self.dest = grow(getattr(self, "dest", None), capacity, numpy.int32, -1)
+        self.route = grow(getattr(self, "route", None), (capacity, self.route_length), numpy.int32, -1)
+        self.current_node = grow(getattr(self, "current_node", None), capacity, numpy.int16, -1)
+        self.fragments = grow(getattr(self, "fragments", None), capacity, numpy.int32, 1)
+        self.times_transmitted = grow(getattr(self, "times_transmitted", None), capacity, numpy.int16, 0)
+        self.dropped = grow(getattr(self, "dropped", None), capacity, numpy.bool_, False)
+        self.ack_received = grow(getattr(self, "ack_received", None), capacity, numpy.bool_, False)
+        self.time_queued = grow(getattr(self, "time_queued", None), capacity, numpy.float64, numpy.nan)
+        self.time_sent = grow(getattr(self, "time_sent", None), capacity, numpy.float64, numpy.nan)
+        self.time_delivered = grow(getattr(self, "time_delivered", None), capacity, numpy.float64, numpy.nan)
+        self.estimates = grow(getattr(self, "estimates", None), (capacity, self.num_labels), numpy.float64, 0.0)
+        # References to shared objects (payloads, message IDs, the empty probability mass), 8 bytes per row
+        self.payload = grow(getattr(self, "payload", None), capacity, object, None)
+        self.msg_id = grow(getattr(self, "msg_id", None), capacity, object, None)
+        self.probability_mass = grow(getattr(self, "probability_mass", None), capacity, object, EMPTY_MASS)
+
+        # Stack of free rows, the next one to use at the top (only grows when all rows are in use)
+        self.free_rows = numpy.empty(capacity, dtype=numpy.int64)
+        self.free_rows[:capacity - old] = numpy.arange(capacity - 1, old - 1, -1)
+        self.num_free = capacity - old
+        self.capacity = capacity
+
+
+    def new_packet(self, route, payload, sender, dest, type, msg_id):
+        ''' Allocates a row for a new packet and returns its TablePacket handle.
+
+            Keyword arguments:
+            route - the route, as indices into Network.nodes, including the destination,
+            payload - the payload of the packet,
+            sender - the sending node,
+            dest - the destination node,
+            type - the type of the packet (see TYPES),
+            msg_id - the ID of the message of the packet.
+        '''
+        if self.num_free == 0:
+            self.allocate(2 * self.capacity)
+        self.num_free -= 1
+        row = int(self.free_rows[self.num_free])
+        self.in_use += 1
+
+        self.id[row] = next(sender.env.ids)
+        self.type[row] = TYPE_CODES[type]
+        self.sender[row] = sender.index
+        self.dest[row] = dest.index
+        self.route[row] = route
+        self.current_node[row] = -1
+        self.fragments[row] = 1
+        self.times_transmitted[row] = 0
+        self.dropped[row] = False
+        self.ack_received[row] = False
+        self.time_queued[row] = numpy.nan
+        self.time_sent[row] = numpy.nan
+        self.time_delivered[row] = numpy.nan
+        self.estimates[row].fill(0.0)
+        self.estimates[row, sender.label] = 1.0
+        self.payload[row] = payload
+        self.msg_id[row] = msg_id
+        self.probability_mass[row] = EMPTY_MASS
+        return TablePacket(self, row)
+
+
+    def free(self, row):
+        ''' Returns the row of a delivered packet. Its TablePacket handle must not be used anymore. '''
+        self.payload[row] = None
+        self.probability_mass[row] = EMPTY_MASS
+        self.free_rows[self.num_free] = row
+        self.num_free += 1
+        self.in_use -= 1
+
+
+    def rows_of(self, packets):
+        ''' Returns the array of rows of the given TablePacket handles. '''
+        return numpy.fromiter((p.row for p in packets), dtype=numpy.int64, count=len(packets))
+
+
+    def assign(self, rows, estimates, probability_mass):
+        ''' Sets the sender estimates and the probability mass of all the given rows at once.
+            The rows share the probability mass dict, which is never updated in place.
+        '''
+        self.estimates[rows] = estimates
+        self.probability_mass[rows] = probability_mass
+
+
+    def nbytes(self):
+        ''' Memory used by the columns (not counting the shared objects referenced by the object columns). '''
+        return sum(getattr(self, c).nbytes for c in ["id", "type", "sender", "dest", "route", "current_node", "fragments", "times_transmitted",
+                                                       "dropped", "ack_received", "time_queued", "time_sent", "time_delivered", "estimates",
+                                                       "payload", "msg_id", "probability_mass", "free_rows"])
+
+
+def _column(name, to_python=None, from_python=None):
+    def get(self):
+        value = getattr(self.table, name)[self.row]
+        return to_python(value) if to_python else value
+
+    def set(self, value):
+        getattr(self.table, name)[self.row] = from_python(value) if from_python else value
+
+    return property(get, set)
+
+
+def _time_to_python(value):
+    return None if value != value else float(value) # NaN stands for None
+
+
+def _time_from_python(value):
+    return numpy.nan if value is None else value
+
+
+class TablePacket(object):
+    ''' Handle of a packet stored in a PacketTable, exposing the same attributes as Packet. '''
+
+    __slots__ = ['table', 'row']
+
+    message = None
+    pool_logs = ()
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    conf = property(lambda self: self.table.conf)
+    id = _column("id", int)
+    type = _column("type", lambda code: TYPES[code], lambda t: TYPE_CODES[t])
+    payload = _column("payload")
+    msg_id = _column("msg_id")
+    fragments = _column("fragments", int)
+    current_node = _column("current_node", int)
+    times_transmitted = _column("times_transmitted", int)
+    dropped = _column("dropped", bool)
+    ACK_Received = _column("ack_received", bool)
+    time_queued = _column("time_queued", _time_to_python, _time_from_python)
+    time_sent = _column("time_sent", _time_to_python, _time_from_python)
+    time_delivered = _column("time_delivered", _time_to_python, _time_from_python)
+    probability_mass = _column("probability_mass")
+
+    @property
+    def real_sender(self):
+        return self.table.net.nodes[self.table.sender[self.row]]
+
+    @property
+    def dest(self):
+        return self.table.net.nodes[self.table.dest[self.row]]
+
+    @property
+    def route(self):
+        return self.table.route[self.row]
+
+    @property
+    def sender_estimates(self):
+        # A view into the table, so in-place updates (e.g. by PoolMixture.assign) write into the table
+        return self.table.estimates[self.row]
+
+    @sender_estimates.setter
+    def sender_estimates(self, value):
+        self.table.estimates[self.row] = value
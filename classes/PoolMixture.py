@@ -0,0 +1,100 @@
+import numpy
+from classes.Packet import EMPTY_MASS
+
+
+class PoolMixture(object):
+    ''' This module implements the running mixture of the distributions (probability mass over
+        the target packets and the sender estimates) carried by the packets in a mix pool.
+
+        Instead of the normalised mixture, we keep an unnormalised accumulator together with
+        the number of packets in the pool, and we normalise only when a packet leaves. The
+        accumulator is stored as weights * scale, so that a departure (which shrinks the total
+        but not the mixture) is a single multiplication of the scale, while an arrival only
+        touches the entries carried by the arriving packet.
+    '''
+
+    __slots__ = ['mass', 'estimates', 'scale', 'count']
+
+    # Below this value we fold the scale back into the accumulator to keep it well conditioned.
+    MIN_SCALE = 1e-100
+
+    def __init__(self, num_labels=3):
+        self.mass = {}
+        self.estimates = numpy.zeros(num_labels)
+        self.scale = 1.0
+        self.count = 0
+
+
+    def add(self, packet):
+        ''' Adds the distributions of the packet entering the pool into the accumulator.
+
+            Keyword arguments:
+            packet - the packet which entered the pool.
+        '''
+        inv_scale = 1.0 / self.scale
+        mass = self.mass
+        for i, pr in packet.probability_mass.items():
+            mass[i] = mass.get(i, 0.0) + pr * inv_scale
+        self.estimates += packet.sender_estimates * inv_scale
+        self.count += 1
+
+
+    def assign(self, packet):
+        ''' Sets the distributions of the given packet to the current mixture of the pool.
+
+            Keyword arguments:
+            packet - the packet leaving the pool.
+        '''
+        if self.count == 0:
+            return
+        factor = self.scale / self.count
+        packet.probability_mass = {i : w * factor for i, w in self.mass.items()} if self.mass else EMPTY_MASS
+        # Every packet owns its sender_estimates array, so we can write into it instead of allocating a new one
+        numpy.multiply(self.estimates, factor, out=packet.sender_estimates)
+
+
+    def assign_rows(self, table, rows):
+        ''' Counterpart of assign for many packets of a PacketTable at once, e.g., a flushed batch.
+
+            Keyword arguments:
+            table - the PacketTable of the packets,
+            rows - the array of the rows of the packets leaving the pool.
+        '''
+        if self.count == 0 or len(rows) == 0:
+            return
+        factor = self.scale / self.count
+        table.assign(rows, self.estimates * factor, {i : w * factor for i, w in self.mass.items()} if self.mass else EMPTY_MASS)
+
+
+    def remove(self):
+        ''' Removes one packet share from the accumulator. All packets in the pool carry the mixture,
+            so the mixture itself does not change, only the total mass shrinks by 1/count.
+        '''
+        self.count -= 1
+        if self.count <= 0:
+            self.clear()
+            return
+
+        self.scale *= self.count / (self.count + 1.0)
+        if self.scale < self.MIN_SCALE:
+            self.renormalise()
+
+
+    def renormalise(self):
+        scale = self.scale
+        for i in self.mass:
+            self.mass[i] *= scale
+        self.estimates *= scale
+        self.scale = 1.0
+
+
+    def clear(self):
+        ''' If the pool dries out, then we start measurments from scratch. '''
+        self.mass = {}
+        self.estimates = numpy.zeros(len(self.estimates))
+        self.scale = 1.0
+        self.count = 0
+
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,272 @@
+import cProfile
+import collections
+import json
+import os
+import signal
+import time
+import simpy
+
+
+MISSING = object()
+
+
+def profiling_enabled(conf):
+    profiling = conf.get("profiling", {})
+    return bool(profiling.get("counters", False) or profiling.get("cprofile", False) or profiling.get("flamegraph", False))
+
+
+def start_profiler(env, conf, net, loggers, run_dir):
+    ''' Creates and starts the Profiler of a run, writing into run_dir / "profiling" -> "dir",
+        if any of the profiling outputs is enabled in the config. Returns None otherwise, in which
+        case nothing of the run is touched.
+    '''
+    if not profiling_enabled(conf):
+        return None
+    profiler = Profiler(env, conf, net, loggers, os.path.join(run_dir, conf["profiling"].get("dir", "profile")))
+    profiler.start()
+    return profiler
+
+
+def event_name(event):
+    ''' Name of a SimPy event in the counters: its type, and the process it resumes if any. '''
+    name = type(event).__name__
+    for callback in event.callbacks or ():
+        process = getattr(callback, "__self__", None)
+        if isinstance(process, simpy.events.Process):
+            return "%s -> %s" % (name, process._generator.__qualname__)
+    return name
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (getattr(code, "co_qualname", code.co_name), os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class TimedMixture(object):
+    ''' Stands in for the PoolMixture of a node (which has slots, so its methods cannot be
+        replaced), timing the probability mass updates.
+    '''
+
+    def __init__(self, mixture, profiler):
+        self.mixture = mixture
+        self.add = profiler.timed("PoolMixture.add", mixture.add)
+        self.assign = profiler.timed("PoolMixture.assign", mixture.assign)
+        self.remove = profiler.timed("PoolMixture.remove", mixture.remove)
+
+    def __getattr__(self, name):
+        return getattr(self.mixture, name)
+
+    def __len__(self):
+        return len(self.mixture)
+
+
+class Profiler(object):
+    ''' This module implements the instrumentation of a run, enabled by the "profiling" section of the config.
+        When all of its outputs are disabled no Profiler is created, so the run pays nothing for it.
+
+        "counters": the methods of the hot paths are replaced, on the objects of the run, by timed wrappers:
+        every processed event is counted and timed per type (the SimPy event and the process it resumes, or
+        the hop callback of the heap engine), as are the pool updates of the mixes, the probability mass math,
+        the route selection, the dispatching of the packets, the entropy updates and the loggers. Every mix
+        also gets a histogram of the size of its pool at the arrival of a packet. The timers are inclusive,
+        e.g., Node.add_pkt_in_pool includes PoolMixture.add. The counters are written into counters.json.
+
+        "cprofile": the run is profiled with cProfile, and the stats are written into profile.pstats
+        (python3 -m pstats profile.pstats, or snakeviz).
+
+        "flamegraph": the stack of the run is sampled every "sample_interval" seconds of CPU time (SIGPROF),
+        and the samples are written into profile.collapsed, in the collapsed stack format of flamegraph.pl
+        (also read by speedscope).
+
+        Keyword arguments:
+        env - the simulation environment,
+        conf - the configuration of the simulation,
+        net - the network,
+        loggers - the tuple of the packet, message and entropy loggers,
+        out_dir - the directory into which the outputs are written.
+    '''
+
+    def __init__(self, env, conf, net, loggers, out_dir):
+        profiling = conf.get("profiling", {})
+        self.env = env
+        self.net = net
+        self.loggers = loggers
+        self.out_dir = out_dir
+        self.counters = bool(profiling.get("counters", False))
+        self.cprofile = cProfile.Profile() if profiling.get("cprofile", False) else None
+        self.samples = collections.Counter() if profiling.get("flamegraph", False) else None
+        self.sample_interval = float(profiling.get("sample_interval", 0.001))
+
+        self.patches = [] # (object, attribute, original value), undone by stop
+        self.events = {} # event name : [count, seconds]
+        self.timers = {} # timer name : [calls, seconds]
+        self.pool_sizes = {} # node : histogram of the pool size at the arrival of a packet
+        self.wall_time = 0.0
+
+
+    def patch(self, obj, name, value):
+        self.patches.append((obj, name, obj.__dict__.get(name, MISSING)))
+        setattr(obj, name, value)
+
+
+    def timed(self, name, fn):
+        ''' Returns fn wrapped so that its calls are counted and timed under the given name. '''
+        timer = self.timers.setdefault(name, [0, 0.0])
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            started = clock()
+            result = fn(*args, **kwargs)
+            timer[0] += 1
+            timer[1] += clock() - started
+            return result
+        return wrapper
+
+
+    def instrument_step(self):
+        env = self.env
+        step = env.step
+        queue = env._queue
+        hops = getattr(env, "_hops", None) # The hop callbacks of the heap engine, see classes/Engine.py
+        events = self.events
+        clock = time.perf_counter
+
+        def profiled_step():
+            # The same choice of the next entry as HopEnvironment.step
+            if hops and (not queue or hops[0][0] < queue[0][0]):
+                callback = hops[0][2]
+                name = getattr(callback, "__qualname__", type(callback).__name__)
+            elif queue:
+                name = event_name(queue[0][3])
+            else:
+                name = "-"
+            entry = events.get(name)
+            if entry is None:
+                entry = events[name] = [0, 0.0]
+            started = clock()
+            step()
+            entry[0] += 1
+            entry[1] += clock() - started
+        self.patch(env, "step", profiled_step)
+
+
+    def instrument_node(self, node):
+        timer = self.timers.setdefault("Node.add_pkt_in_pool", [0, 0.0])
+        sizes = self.pool_sizes[node] = []
+        add = node.add_pkt_in_pool
+        clock = time.perf_counter
+
+        def add_pkt_in_pool(packet):
+            started = clock()
+            add(packet)
+            timer[0] += 1
+            timer[1] += clock() - started
+            size = len(node.pool)
+            if size >= len(sizes):
+                sizes.extend([0] * (size + 1 - len(sizes)))
+            sizes[size] += 1
+        self.patch(node, "add_pkt_in_pool", add_pkt_in_pool)
+        self.patch(node, "forward_packet", self.timed("Node.forward_packet", node.forward_packet))
+        self.patch(node, "flush_batch", self.timed("Node.flush_batch", node.flush_batch))
+        self.patch(node, "mixture", TimedMixture(node.mixture, self))
+
+
+    def instrument(self):
+        self.instrument_step()
+        for node in self.mixnodes():
+            self.instrument_node(node)
+
+        net = self.net
+        for name in ["dispatch_packet", "send_window", "receive_window"]: # The last two only in parallel runs, see classes/ShardNet.py
+            if hasattr(net, name):
+                self.patch(net, name, self.timed("%s.%s" % (type(net).__name__, name), getattr(net, name)))
+        for name in ["route", "route_through"]:
+            self.patch(net.route_sampler, name, self.timed("RouteSampler.%s" % name, getattr(net.route_sampler, name)))
+        accumulator = self.env.entropy_accumulator
+        self.patch(accumulator, "add", self.timed("%s.add" % type(accumulator).__name__, accumulator.add))
+        for name, logger in zip(["packet", "message", "entropy"], self.loggers):
+            if logger is not None:
+                self.patch(logger, "info", self.timed("log.%s" % name, logger.info))
+
+
+    def mixnodes(self):
+        return self.net.peers if self.net.type == "p2p" else self.net.mixnodes
+
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+
+
+    def start(self):
+        if self.counters:
+            self.instrument()
+        if self.samples is not None:
+            self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+            signal.setitimer(signal.ITIMER_PROF, self.sample_interval, self.sample_interval)
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        self.time_started = time.perf_counter()
+
+
+    def stop(self):
+        ''' Stops the profiling, undoes the instrumentation and writes the outputs. '''
+        self.wall_time = time.perf_counter() - self.time_started
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.samples is not None:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self.previous_handler)
+        for (obj, name, value) in reversed(self.patches):
+            if value is MISSING:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, value)
+        self.patches = []
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        if self.counters:
+            with open(os.path.join(self.out_dir, "counters.json"), "w") as f:
+                json.dump(self.results(), f, indent=2)
+            self.print_counters()
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(os.path.join(self.out_dir, "profile.pstats"))
+        if self.samples is not None:
+            with open(os.path.join(self.out_dir, "profile.collapsed"), "w") as f:
+                for stack, count in sorted(self.samples.items()):
+                    f.write("%s %d\n" % (stack, count))
+        print("> Profile written into %s" % self.out_dir)
+
+
+    def results(self):
+        ''' Returns the counters of the run. '''
+        nodes = {}
+        for node in self.mixnodes():
+            sizes = self.pool_sizes.get(node, [])
+            arrivals = sum(sizes)
+            nodes[node.id] = {"packets_received" : node.pkts_received,
+                              "packets_sent" : node.pkts_sent,
+                              "packets_dropped" : node.pkts_dropped,
+                              "pool_size_mean" : sum(i * n for i, n in enumerate(sizes)) / arrivals if arrivals else 0.0,
+                              "pool_size_hist" : sizes}
+        for g in self.net.gateways:
+            nodes[g.id] = {"packets_received" : g.pkts_received, "packets_sent" : g.pkts_sent, "packets_dropped" : g.pkts_dropped}
+
+        return {"wall_time" : self.wall_time,
+                "events" : {name : {"count" : c, "seconds" : s} for name, (c, s) in sorted(self.events.items(), key=lambda e: -e[1][1])},
+                "timers" : {name : {"calls" : c, "seconds" : s} for name, (c, s) in sorted(self.timers.items(), key=lambda t: -t[1][1])},
+                "nodes" : nodes}
+
+
+    def print_counters(self, top=10):
+        results = self.results()
+        print("> Wall time of the run: %.2f s, %d events" % (self.wall_time, sum(c for c, _ in self.events.values())))
+        print("%-60s %12s %10s" % ("event", "count", "seconds"))
+        for name, e in list(results["events"].items())[:top]:
+            print("%-60s %12d %10.3f" % (name, e["count"], e["seconds"]))
+        print("%-60s %12s %10s" % ("timer", "calls", "seconds"))
+        for name, t in results["timers"].items():
+            print("%-60s %12d %10.3f" % (name, t["calls"], t["seconds"]))
@@ -0,0 +1,68 @@
+import functools
+import numpy
+
+
+class RandomBuffer(object):
+    ''' This module hands out random draws from buffers refilled in bulk. Each distribution
+        (with its parameters, e.g. the exponential with mean 0.1) has its own NumPy array and
+        cursor, so draws with different parameters never mix. The first buffer of a stream is
+        small and each refill doubles it up to max_size, so that nodes which draw rarely
+        (e.g. thousands of clients) do not hold large buffers.
+
+        Keyword arguments:
+        rng - the numpy.random.Generator the draws come from,
+        max_size - the largest number of draws made at once.
+    '''
+
+    __slots__ = ['rng', 'max_size', 'streams']
+
+    def __init__(self, rng, max_size=4096):
+        self.rng = rng
+        self.max_size = int(max_size)
+        self.streams = {}
+
+
+    def stream(self, key, draw):
+        ''' Returns the stream of the given key, creating it with the given draw(size) function. '''
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = Stream(draw, self.max_size)
+        return stream
+
+
+    def exponential(self, scale):
+        ''' Returns the next draw of the exponential distribution with the given scale (the mean). '''
+        stream = self.streams.get(scale)
+        if stream is None:
+            stream = self.stream(scale, functools.partial(self.rng.exponential, scale))
+        if stream.cursor == stream.size:
+            stream.refill()
+        value = stream.values[stream.cursor]
+        stream.cursor += 1
+        return value
+
+
+    def __len__(self):
+        ''' Number of buffered draws not handed out yet. '''
+        return sum(stream.size - stream.cursor for stream in self.streams.values())
+
+
+class Stream(object):
+    ''' The buffer of a single distribution. The draws are read through a memoryview
+        of the array, which returns them as Python floats. '''
+
+    __slots__ = ['draw', 'max_size', 'values', 'size', 'cursor']
+
+    MIN_SIZE = 16
+
+    def __init__(self, draw, max_size):
+        self.draw = draw
+        self.max_size = max_size
+        self.values = memoryview(numpy.empty(0))
+        self.size = 0
+        self.cursor = 0
+
+    def refill(self):
+        self.size = min(max(2 * self.size, self.MIN_SIZE), self.max_size)
+        self.values = memoryview(self.draw(self.size))
+        self.cursor = 0
@@ -0,0 +1,159 @@
+import numpy
+
+
+# Rounds of redrawing the p2p routes with repeated peers, after which the remaining routes are drawn without replacement
+MAX_REJECTION_ROUNDS = 100
+
+
+class RouteSampler(object):
+    ''' This module draws the random routes of the packets in large vectorised batches.
+        A route is a small int array of indices into Network.nodes: the mixes (or peers)
+        followed by the destination. Routes are drawn buffer_size at a time into a 2D array
+        and handed out row by row, so drawing a route costs a row copy instead of a draw per hop.
+
+        If bandwidths are given ("network" -> "bandwidth", one per mixnode, or per peer in p2p),
+        the mixes are selected proportionally to them: per layer in the stratified topology, and
+        proportionally to the bottleneck (smallest) bandwidth of the cascade in the multi cascade
+        topology. Weighted and uniform selection are drawn in the same batches. The gateways of the
+        stratified topology (see classes/MixGuard.py), if any, are the first hop, selected uniformly.
+    '''
+
+    def __init__(self, net, buffer_size=10000, bandwidth=None):
+        self.net = net
+        self.rng = net.rng
+        self.type = net.topology["Type"]
+        self.buffer_size = int(buffer_size)
+        self.route_length = net.get_route_length()
+
+        self.offset = net.clients.number # The mixes (or peers) follow the clients in Network.nodes
+        num_mixes = len(net.peers) if self.type == "p2p" else len(net.mixnodes)
+        weights = None if bandwidth is None else numpy.asarray(bandwidth, dtype=float)
+        if weights is not None and len(weights) != num_mixes:
+            raise Exception("The number of bandwidths does not match the number of mixnodes")
+
+        if self.type == "stratified":
+            self.num_layers = int(net.conf["network"]["stratified"]["layers"])
+            layer_size = int(net.conf["network"]["stratified"]["layer_size"])
+            self.choices = layer_size
+            self.p = None if weights is None else [w / w.sum() for w in weights.reshape(self.num_layers, layer_size)]
+            self.layer_offsets = self.offset + layer_size * numpy.arange(self.num_layers)
+            self.gateways = numpy.array([g.index for g in net.gateways], dtype=numpy.int64)
+        elif self.type == "cascade":
+            self.cascade = self.offset + numpy.arange(self.route_length)
+        elif self.type == "multi_cascade":
+            self.cascades = (self.offset + numpy.arange(num_mixes)).reshape(-1, self.route_length)
+            self.choices = len(self.cascades)
+            self.p = None if weights is None else weights.reshape(-1, self.route_length).min(axis=1)
+            self.p = None if self.p is None else self.p / self.p.sum()
+        elif self.type == "p2p":
+            self.weights = weights
+        else:
+            raise Exception("Didn't recognize the network type")
+
+        self.buffer = numpy.empty((0, self.route_length + 1), dtype=numpy.int32)
+        self.cursor = 0
+
+
+    def reseed(self, rng):
+        ''' Switches the sampler to a new random stream, dropping the routes already drawn from the old one. '''
+        self.rng = rng
+        self.buffer = self.buffer[:0]
+        self.cursor = 0
+
+
+    def draw(self, n):
+        ''' Draws n routes of mixes (or peers), as a (n, route_length) array of indices into Network.nodes. '''
+        if self.type == "stratified":
+            if self.p is None:
+                hops = self.rng.integers(self.choices, size=(n, self.num_layers))
+            else:
+                hops = numpy.column_stack([self.rng.choice(self.choices, size=n, p=p) for p in self.p])
+            if len(self.gateways) > 0:
+                return numpy.column_stack([self.gateways[self.rng.integers(len(self.gateways), size=n)], hops + self.layer_offsets])
+            return hops + self.layer_offsets
+        elif self.type == "cascade":
+            return numpy.broadcast_to(self.cascade, (n, self.route_length))
+        elif self.type == "multi_cascade":
+            return self.cascades[self.rng.choice(self.choices, size=n, p=self.p)]
+        elif self.type == "p2p":
+            # Only the peers currently in Network.peers relay packets (the target peers are taken out of it)
+            peers = numpy.fromiter((peer.index for peer in self.net.peers), dtype=numpy.int64, count=len(self.net.peers))
+            p = None if self.weights is None else self.weights[peers - self.offset] / self.weights[peers - self.offset].sum()
+            available = len(peers) if p is None else numpy.count_nonzero(p)
+            if available < self.route_length:
+                raise Exception("Not enough peers (%d) for routes of %d distinct peers" % (available, self.route_length))
+            # Peers must not repeat on a route: the routes with repetitions are drawn again, which
+            # for uniform weights gives the same distribution as drawing without replacement.
+            hops = self.rng.choice(len(peers), size=(n, self.route_length), p=p)
+            repeated = self.has_repetitions(hops)
+            rounds = 0
+            while repeated.any() and rounds < MAX_REJECTION_ROUNDS:
+                hops[repeated] = self.rng.choice(len(peers), size=(int(repeated.sum()), self.route_length), p=p)
+                repeated = self.has_repetitions(hops)
+                rounds += 1
+            # With very skewed bandwidths a route may keep repeating peers, the rest is drawn without replacement
+            # (for non-uniform weights slightly different from the conditioned draws above).
+            for i in numpy.flatnonzero(repeated):
+                hops[i] = self.rng.choice(len(peers), size=self.route_length, replace=False, p=p)
+            return peers[hops]
+
+
+    @staticmethod
+    def has_repetitions(hops):
+        ordered = numpy.sort(hops, axis=1)
+        return (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+
+
+    def refill(self):
+        self.buffer = numpy.empty((self.buffer_size, self.route_length + 1), dtype=numpy.int32)
+        self.buffer[:, :-1] = self.draw(self.buffer_size)
+        self.cursor = 0
+
+
+    def route(self, dest):
+        ''' Returns the next route, ending at the given destination node.
+
+            Keyword arguments:
+            dest - the destination node of the packet.
+        '''
+        if self.cursor == len(self.buffer):
+            self.refill()
+        route = self.buffer[self.cursor].copy()
+        self.cursor += 1
+        route[-1] = dest.index
+        return route
+
+
+    def first_hops(self):
+        ''' Returns the mixes which can be the first hop of a route, as indices into Network.nodes,
+            and the probability of each of them being the first hop. Not defined for p2p.
+        '''
+        if self.type == "stratified" and len(self.gateways) > 0:
+            return self.gateways, numpy.full(len(self.gateways), 1.0 / len(self.gateways))
+        elif self.type == "stratified":
+            first = self.layer_offsets[0] + numpy.arange(self.choices)
+            return first, (numpy.full(self.choices, 1.0 / self.choices) if self.p is None else self.p[0])
+        elif self.type == "cascade":
+            return self.cascade[:1], numpy.ones(1)
+        elif self.type == "multi_cascade":
+            return self.cascades[:, 0], (numpy.full(self.choices, 1.0 / self.choices) if self.p is None else self.p)
+        else:
+            raise Exception("The first hops are only defined for the client-server topologies")
+
+
+    def route_through(self, first, dest):
+        ''' Returns a random route starting at the given first hop (see first_hops), i.e., drawn
+            from the routes conditioned on their first hop, and ending at the given destination.
+
+            Keyword arguments:
+            first - the index of the first mix of the route in Network.nodes,
+            dest - the destination node of the packet.
+        '''
+        if self.type == "multi_cascade":
+            route = numpy.empty(self.route_length + 1, dtype=numpy.int32)
+            route[:-1] = self.cascades[(first - self.offset) // self.route_length]
+            route[-1] = dest.index
+            return route
+        route = self.route(dest)
+        route[0] = first # The hops of the stratified topology are drawn independently per layer
+        return route
@@ -0,0 +1,89 @@
+import numpy
+from multiprocessing import shared_memory
+
+
+def packet_dtype(route_length, num_labels):
+    ''' The record of a packet handed over between two shards of a parallel run (see classes/ShardNet.py).
+        The sparse probability mass of the packet is stored apart, as the mass_len (key, value) pairs
+        starting at mass_start.
+
+        Keyword arguments:
+        route_length - the length of the routes (mixes, gateways and the destination),
+        num_labels - the number of sender labels (see Packet.sender_estimates).
+    '''
+    return numpy.dtype([("time", numpy.float64), ("id", numpy.int64), ("type", numpy.int8), ("dropped", numpy.bool_),
+                        ("sender", numpy.int64), ("label", numpy.int8), ("route", numpy.int64, (route_length,)),
+                        ("current_node", numpy.int16), ("times_transmitted", numpy.int32), ("fragments", numpy.int32),
+                        ("time_queued", numpy.float64), ("time_sent", numpy.float64),
+                        ("msg_id", numpy.int64), ("msg_size", numpy.int64), ("msg_time_queued", numpy.float64), ("msg_time_sent", numpy.float64),
+                        ("estimates", numpy.float64, (num_labels,)), ("mass_start", numpy.int64), ("mass_len", numpy.int32)])
+
+
+class ShardChannel(object):
+    ''' This module implements the queue of packets from one shard of a parallel run to another,
+        living in shared memory. The shards run the simulation in time windows; the producer writes
+        all the packets it hands over during window w into slot w % depth, and the consumer reads them
+        before it runs window w. The channel is created before the shard processes are forked, so both
+        sides map the same memory.
+
+        The producer of stage s writes window w in round w + s and the consumer of stage t reads it in
+        round w + t (see simulation_modes/parallel_mode.py), so depth = t - s + 1 slots ensure that a
+        slot is not overwritten before it has been read.
+
+        Keyword arguments:
+        dtype - the dtype of the packet records, see packet_dtype,
+        capacity - the maximum number of packets handed over in a window,
+        mass_capacity - the maximum number of probability mass entries of these packets,
+        depth - the number of slots.
+    '''
+
+    def __init__(self, dtype, capacity, mass_capacity, depth):
+        self.dtype = dtype
+        self.capacity = int(capacity)
+        self.mass_capacity = int(mass_capacity)
+        self.depth = int(depth)
+
+        sizes = [self.depth * 2 * 8, self.depth * self.capacity * dtype.itemsize, self.depth * self.mass_capacity * 8, self.depth * self.mass_capacity * 8]
+        self.shm = shared_memory.SharedMemory(create=True, size=sum(sizes))
+        offsets = numpy.cumsum([0] + sizes)
+        self.counts = numpy.ndarray((self.depth, 2), dtype=numpy.int64, buffer=self.shm.buf, offset=offsets[0])
+        self.records = numpy.ndarray((self.depth, self.capacity), dtype=dtype, buffer=self.shm.buf, offset=offsets[1])
+        self.mass_keys = numpy.ndarray((self.depth, self.mass_capacity), dtype=numpy.int64, buffer=self.shm.buf, offset=offsets[2])
+        self.mass_values = numpy.ndarray((self.depth, self.mass_capacity), dtype=numpy.float64, buffer=self.shm.buf, offset=offsets[3])
+        self.counts[:] = 0
+
+
+    def write(self, window, rows, mass_keys, mass_values):
+        ''' Writes the packets handed over in the given window.
+
+            Keyword arguments:
+            window - the number of the window,
+            rows - the list of the packet records, as tuples of the fields of the dtype,
+            mass_keys, mass_values - the concatenated probability mass entries of the packets.
+        '''
+        if len(rows) > self.capacity or len(mass_keys) > self.mass_capacity:
+            raise Exception("Too many packets handed over between two shards in a window (%d packets, %d mass entries), "
+                            "increase parallel -> channel_capacity / mass_capacity or decrease parallel -> window" % (len(rows), len(mass_keys)))
+        slot = window % self.depth
+        if rows:
+            self.records[slot, :len(rows)] = rows
+        if mass_keys:
+            self.mass_keys[slot, :len(mass_keys)] = mass_keys
+            self.mass_values[slot, :len(mass_values)] = mass_values
+        self.counts[slot] = (len(rows), len(mass_keys))
+
+
+    def read(self, window):
+        ''' Returns the packet records and the probability mass entries (keys, values) of the given window,
+            as views into the shared memory, valid until the producer writes the slot again.
+        '''
+        slot = window % self.depth
+        (n, m) = self.counts[slot]
+        return (self.records[slot, :n], self.mass_keys[slot, :m], self.mass_values[slot, :m])
+
+
+    def close(self, unlink=False):
+        del self.counts, self.records, self.mass_keys, self.mass_values
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
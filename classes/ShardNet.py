@@ -0,0 +1,240 @@
+import math
+from classes.Net import Network
+from classes.Message import Message
+from classes.Packet import Packet, EMPTY_MASS
+from classes.PacketTable import TYPES, TYPE_CODES
+from classes.Utilities import synthetic_payload_of_length
+from classes.EntropyAccumulator import EntropyAccumulator
+
+
+class RemoteNode(object):
+    ''' Stands in for a client living in another shard, e.g., the sender of a packet coming from
+        another shard. Only its position in Network.nodes and its label are known.
+    '''
+    __slots__ = ['index', 'label', 'id']
+
+    def __init__(self, index, label=0):
+        self.index = index
+        self.label = label
+        self.id = None
+
+    def __repr__(self):
+        return "Client%s" % self.index
+
+
+class SinkEntropy(object):
+    ''' Entropy accumulator of the shards other than the sinks: the entropy of the packets leaving
+        the last mixes is accumulated by the sinks, when they are delivered.
+    '''
+    def add(self, mass):
+        pass
+
+    def flush(self):
+        pass
+
+
+class ShardNetwork(Network):
+    ''' This module implements the part of the network simulated by one shard (process) of a parallel
+        run (see simulation_modes/parallel_mode.py). Every shard builds the whole network, but only
+        the nodes it owns get packets. The shards are grouped into stages: the sources (the traffic of
+        the clients), the gateways if any, one stage per layer of mixes, and the sinks, which own the
+        clients as recipients (the client of row i being owned by the sink i % number of sinks). The
+        mixes of a layer (and the gateways) are spread over the shards of their stage.
+
+        A packet whose next hop is owned by another shard is put into the outbox of that shard, and at
+        the end of every window the outboxes are written as records into the shared memory channels
+        (see classes/ShardChannel.py). The packets coming from other shards are rebuilt from the records,
+        and their arrival is scheduled at the time at which they were handed over.
+
+        The sinks register the delivered packets and accumulate the entropy of the packets leaving the
+        last mixes. The main sink, which owns the target recipient, also registers the real packets
+        dropped in the other shards (at the time of the drop), so the stop condition of the simulation
+        and the logs are handled by a single shard, as in a sequential run. Since a sink only learns the
+        time of the stop at the end of the window, it keeps the entropy at the start of the window and
+        the probability mass delivered since then, to compute the entropy at that time (see entropy_at).
+
+        Keyword arguments:
+        env, type, conf, loggers - as for Network,
+        stages - the list of the stages, each the list of the numbers of its shards,
+        shard - the number of this shard,
+        main_sink - the number of the sink owning the target recipient,
+        channels - dict {(producer shard, consumer shard) : ShardChannel},
+        measure_from - the time since which the entropy is accumulated (the end of the burn-in).
+    '''
+
+    def __init__(self, env, type, conf, loggers, stages, shard, main_sink, channels, measure_from):
+        super().__init__(env, type, conf, loggers)
+        if type != "stratified":
+            raise Exception("Parallel runs support only the stratified topology")
+        self.shard = shard
+        self.sinks = stages[-1]
+        self.main_sink = main_sink
+        self.stage = [i for i, s in enumerate(stages) if shard in s][0]
+        self.measure_from = measure_from
+
+        # The shard owning every entry of Network.nodes as a next hop
+        owner = [self.sinks[row % len(self.sinks)] for row in range(self.clients.number)] + [None] * (len(self.nodes) - self.clients.number)
+        first = 1
+        if self.gateways:
+            for i, g in enumerate(self.gateways):
+                owner[g.index] = stages[1][i % len(stages[1])]
+            first = 2
+        for l, layer in enumerate(self.topology["Layers"]):
+            for j, m in enumerate(layer):
+                owner[m.index] = stages[first + l][j % len(stages[first + l])]
+        self.owner = owner
+
+        self.inputs = [c for (p, s), c in sorted(channels.items()) if s == shard]
+        self.outputs = {s : c for (p, s), c in channels.items() if p == shard}
+        self.outboxes = {s : [] for s in self.outputs}
+
+        self.senders = {} # index : RemoteNode
+        self.messages = {} # id : Message rebuilt from its packets
+        self.recipient = RemoteNode(None) # The destination of the packets outside the sinks, only its (missing) id is used
+        self.is_sink = shard in self.sinks
+        self.window_entropy = env.entropy.copy() # The entropy at the start of the current window
+        self.window_masses = [] # (time, probability mass) delivered in the current window
+        if self.is_sink:
+            self.arrive = self.deliver_to_recipient
+        else:
+            env.entropy_accumulator = SinkEntropy()
+            self.arrive = self.deliver_packet
+
+
+    def dispatch_packet(self, packet, delay=0.0):
+        shard = self.owner[packet.route[packet.current_node + 1]]
+        if shard == self.shard:
+            super().dispatch_packet(packet, delay)
+        else:
+            self.outboxes[shard].append((self.env.now + delay, packet))
+
+
+    def drop_packet(self, packet, recycle=False):
+        packet.dropped = True
+        self.env.packets_dropped += 1
+        if packet.type == "REAL":
+            # The message is accounted for by the main sink, at the time of the drop
+            self.outboxes[self.main_sink].append((self.env.now, packet))
+        elif packet.type == "DUMMY" and recycle:
+            self.recycle_packet(packet)
+
+
+    def deliver_to_recipient(self, packet):
+        if packet.dropped:
+            self.drop_message(packet.message)
+            return
+        if self.env.now >= self.measure_from and packet.probability_mass:
+            self.env.entropy_accumulator.add(packet.probability_mass)
+            self.window_masses.append((self.env.now, packet.probability_mass))
+        self.deliver_packet(packet)
+
+
+    def entropy_at(self, time):
+        ''' Returns the entropy of the target packets delivered by this sink up to the given time,
+            which must be in the last window simulated.
+        '''
+        entropy = self.window_entropy.copy()
+        accumulator = EntropyAccumulator(entropy)
+        for (t, mass) in self.window_masses:
+            if t <= time:
+                accumulator.add(mass)
+        return entropy
+
+
+    def send_window(self, window):
+        ''' Writes the packets handed over to the other shards during the window into the channels. '''
+        nan = math.nan
+        for shard, channel in self.outputs.items():
+            box = self.outboxes[shard]
+            rows = []
+            keys = []
+            values = []
+            for (time, packet) in box:
+                mass = packet.probability_mass
+                sender = packet.real_sender
+                if packet.type == "REAL":
+                    msg = packet.message
+                    msg_fields = (msg.id, len(msg.payload), msg.time_queued, msg.time_sent)
+                else:
+                    msg_fields = (-1, 0, nan, nan)
+                rows.append((time, packet.id, TYPE_CODES[packet.type], packet.dropped, sender.index, sender.label, packet.route,
+                             packet.current_node, packet.times_transmitted, packet.fragments,
+                             nan if packet.time_queued is None else packet.time_queued, nan if packet.time_sent is None else packet.time_sent)
+                            + msg_fields + (packet.sender_estimates, len(keys), len(mass)))
+                if mass:
+                    keys.extend(mass.keys())
+                    values.extend(mass.values())
+            channel.write(window, rows, keys, values)
+
+            for (time, packet) in box:
+                if packet.type == "DUMMY":
+                    self.recycle_packet(packet)
+            del box[:]
+
+
+    def receive_window(self, window):
+        ''' Rebuilds the packets handed over by the other shards during the window, and schedules their arrivals. '''
+        now = self.env.now
+        schedule = self.env.schedule_callback
+        sink = self.is_sink
+        if sink:
+            self.env.entropy_accumulator.flush()
+            self.window_entropy[:] = self.env.entropy
+            del self.window_masses[:]
+        for channel in self.inputs:
+            (records, mass_keys, mass_values) = channel.read(window)
+            if len(records) == 0:
+                continue
+            routes = records["route"].copy()
+            estimates = records["estimates"].copy()
+            mass_keys = mass_keys.tolist()
+            mass_values = mass_values.tolist()
+            columns = [records[name].tolist() for name in ("time", "id", "type", "dropped", "sender", "label", "current_node", "times_transmitted", "fragments",
+                                                           "time_queued", "time_sent", "msg_id", "msg_size", "msg_time_queued", "msg_time_sent", "mass_start", "mass_len")]
+            for i, (time, id, type, dropped, sender, label, current_node, times_transmitted, fragments, time_queued, time_sent,
+                    msg_id, msg_size, msg_time_queued, msg_time_sent, mass_start, mass_len) in enumerate(zip(*columns)):
+                packet = self.free_packets.pop() if self.free_packets else Packet.__new__(Packet)
+                packet.conf = self.conf
+                packet.id = id
+                packet.route = routes[i]
+                packet.payload = None
+                packet.real_sender = self.senders.get(sender)
+                if packet.real_sender is None:
+                    packet.real_sender = self.senders[sender] = RemoteNode(sender, label)
+                packet.dest = self.clients.client(int(routes[i][-1])) if sink else self.recipient
+                packet.type = TYPES[type]
+                if packet.type == "REAL":
+                    packet.msg_id = msg_id
+                    packet.message = self.messages.get(msg_id)
+                    if packet.message is None:
+                        packet.message = self.messages[msg_id] = Message.remote(self.conf, msg_id, synthetic_payload_of_length(msg_size), packet.real_sender,
+                                                                                fragments, msg_time_queued, msg_time_sent)
+                else:
+                    packet.msg_id = "-"
+                    packet.message = None
+                packet.fragments = fragments
+                packet.pool_logs = []
+                packet.dropped = dropped
+                packet.current_node = current_node
+                packet.times_transmitted = times_transmitted
+                packet.ACK_Received = False
+                packet.time_queued = None if time_queued != time_queued else time_queued
+                packet.time_sent = None if time_sent != time_sent else time_sent
+                packet.time_delivered = None
+                packet.sender_estimates = estimates[i]
+                packet.probability_mass = dict(zip(mass_keys[mass_start:mass_start + mass_len], mass_values[mass_start:mass_start + mass_len])) if mass_len else EMPTY_MASS
+                schedule(time - now, self.arrive, packet)
+
+
+    def stats(self):
+        ''' Returns the counters of the nodes owned by this shard, which are merged into the summary of the run. '''
+        mixes = [m for m in self.mixnodes if self.owner[m.index] == self.shard]
+        return {"shard" : self.shard,
+                "stage" : self.stage,
+                "mix_pkts_sent" : {m.index : m.pkts_sent for m in mixes},
+                "mix_pkts_dropped" : sum(m.pkts_dropped for m in mixes),
+                "total_messages_sent" : self.env.total_messages_sent,
+                "total_messages_received" : self.env.total_messages_received,
+                "packets_dropped" : self.env.packets_dropped,
+                "mass_dropped" : self.env.mass_dropped,
+                "entropy_dropped" : self.env.entropy_dropped}
@@ -0,0 +1,83 @@
+import numpy
+
+
+def mser_truncation(series, batch_size=5):
+    ''' MSER-m truncation rule. The series is averaged over batches of batch_size observations,
+        and for every candidate truncation point d we compute
+            MSER(d) = sum_{i > d} (Y_i - mean(Y_{d+1..n}))^2 / (n - d)^2.
+        The warm-up period ends at the d minimising MSER(d). The rule is only trusted if this d
+        lies in the first half of the series, otherwise the series is too short (or not stationary).
+
+        Returns the truncation point (in observations), or None if the series is not long enough
+        to be considered stationary.
+
+        Keyword arguments:
+        series - the observations, in time order,
+        batch_size - the number of observations averaged into one batch (5 for MSER-5).
+    '''
+    num_batches = len(series) // batch_size
+    if num_batches < 4:
+        return None
+    y = numpy.asarray(series[:num_batches * batch_size], dtype=float).reshape(num_batches, batch_size).mean(axis=1)
+
+    # Sums of the tails y[d:], for every d, computed in one pass with reversed cumulative sums
+    tail_sum = numpy.cumsum(y[::-1])[::-1]
+    tail_sq_sum = numpy.cumsum((y * y)[::-1])[::-1]
+    tail_len = numpy.arange(num_batches, 0, -1, dtype=float)
+
+    sse = tail_sq_sum - tail_sum * tail_sum / tail_len
+    mser = sse[:-1] / (tail_len[:-1] * tail_len[:-1])
+    d = int(numpy.argmin(mser[:num_batches // 2 + 1]))
+    if mser[d] > numpy.min(mser[num_batches // 2 + 1:], initial=numpy.inf):
+        return None
+    return d * batch_size
+
+
+class SteadyStateDetector(object):
+    ''' This module implements the detection of the end of the burn-in phase. It periodically samples
+        the mean pool size of the mixes and the network throughput (packets sent by the mixes since the
+        last sample), and applies the MSER-5 rule to both series. As soon as both of them look stationary,
+        the steady event is triggered.
+    '''
+
+    def __init__(self, env, mixnodes, sample_interval=1.0, min_samples=50, max_time=None):
+        self.env = env
+        self.mixnodes = mixnodes
+        self.sample_interval = float(sample_interval)
+        self.min_samples = int(min_samples)
+        self.max_time = max_time
+
+        self.pool_sizes = []
+        self.throughputs = []
+        self.steady = env.event()
+        self.steady_time = None
+        self.truncation_time = None # When the system became stationary according to the MSER rule
+        self.detected = False
+
+
+    def monitor(self):
+        ''' Process sampling the state of the mixes until the network is in steady state
+            (or until max_time, if given).
+        '''
+        pkts_sent = sum(m.pkts_sent for m in self.mixnodes)
+        while True:
+            yield self.env.timeout(self.sample_interval)
+
+            self.pool_sizes.append(sum(len(m.pool) for m in self.mixnodes) / float(len(self.mixnodes)))
+            new_pkts_sent = sum(m.pkts_sent for m in self.mixnodes)
+            self.throughputs.append((new_pkts_sent - pkts_sent) / self.sample_interval)
+            pkts_sent = new_pkts_sent
+
+            if len(self.pool_sizes) >= self.min_samples:
+                d_pool = mser_truncation(self.pool_sizes)
+                d_throughput = mser_truncation(self.throughputs)
+                if d_pool is not None and d_throughput is not None:
+                    self.detected = True
+                    self.truncation_time = max(d_pool, d_throughput) * self.sample_interval
+                    break
+
+            if self.max_time is not None and self.env.now >= self.max_time:
+                break
+
+        self.steady_time = self.env.now
+        self.steady.succeed()
@@ -5,18 +5,47 @@ import logging
 import logging.handlers
 from experiments.Settings import *
 import json
-import numpy 
+import numpy
+from functools import lru_cache
 
 
 def random_string(size):
     return hexlify(urandom(size)).decode('utf8')
     # return ''.join(random.choice(chars) for x in range(size))
 
-def get_exponential_delay(avg_delay, cache=[]):
-    if cache == []:
-        cache.extend(list(numpy.random.exponential(avg_delay, 10000)))
 
-    return cache.pop()
+class SyntheticPayload(object):
+    ''' Payload of which we only need the length (e.g., for splitting messages into packets
+        and for size accounting), so no actual bytes are generated. Supports len() and slicing.
+    '''
+    __slots__ = ['size']
+
+    def __init__(self, size):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        return synthetic_payload_of_length(len(range(*key.indices(self.size))))
+
+    def __repr__(self):
+        return "<payload of %d characters>" % self.size
+
+
+@lru_cache(maxsize=None)
+def synthetic_payload_of_length(length):
+    # Payloads are immutable, so all payloads of the same length share one object
+    return SyntheticPayload(length)
+
+
+def random_payload(conf, size):
+    ''' Returns a payload standing in for random_string(size). If "packet" -> "synthetic_payload"
+        is set, the payload is a SyntheticPayload of the same length (2 * size hex characters).
+    '''
+    if conf["packet"].get("synthetic_payload", False):
+        return synthetic_payload_of_length(2 * size)
+    return random_string(size)
 
 class StructuredMessage(object):
     def __init__(self, metadata):
@@ -40,6 +69,14 @@ def setup_logger(logger_name, filehandler_name, capacity=50000000):
     logger = logging.getLogger(logger_name)
     logger.setLevel(logging.DEBUG)
 
+    # Loggers are global, so if we run more than one simulation in the same interpreter
+    # we have to drop the handlers writing into the log files of the previous run.
+    for h in list(logger.handlers):
+        h.close()
+        if isinstance(h, logging.handlers.MemoryHandler) and h.target is not None:
+            h.target.close()
+        logger.removeHandler(h)
+
     filehandler = logging.FileHandler(filehandler_name)
     memoryhandler = logging.handlers.MemoryHandler(
                     capacity=capacity,
@@ -1,16 +1,38 @@
 import math
+import os
 import numpy as np
+import pandas as pd
 from scipy import stats
+from classes import ColumnarLog
+from classes.OnlineMetrics import histogram_quantile
+
+
+def loadLog(log_dir, name, format=None):
+	''' Loads the log with the given name (e.g. packet_log) from the log directory as a DataFrame,
+	written either by the text loggers (format "text", name.csv) or by the columnar loggers
+	(format "columnar", name.*.npy). If the format is not given, it is detected from the files. '''
+	path = os.path.join(log_dir, name)
+	if format == "columnar" or (format is None and ColumnarLog.exists(path)):
+		return pd.DataFrame(ColumnarLog.read_log(path))
+	return pd.read_csv(path + '.csv', delimiter=';')
+
+
+def iterLogChunks(log_dir, name, format=None, chunksize=100000):
+	''' Yields the log with the given name in chunks, without loading it whole into memory.
+	Chunks of the text logs are DataFrames, chunks of the columnar logs are NumPy record arrays;
+	the metric functions below accept both. '''
+	path = os.path.join(log_dir, name)
+	if format == "columnar" or (format is None and ColumnarLog.exists(path)):
+		for chunk in ColumnarLog.iter_chunks(path):
+			yield chunk
+	else:
+		for chunk in pd.read_csv(path + '.csv', delimiter=';', chunksize=chunksize):
+			yield chunk
+
 
 def getEntropy(data, num_target_packets):
 	columnsNames = ['Entropy'+str(x) for x in range(num_target_packets)]
-	entropies = []
-	for column in columnsNames:
-		dist = data.iloc[0][column]
-		# suma = sum([float(x) for x in dist])
-		# print("For column %s the sum is %f" % (column, suma))
-		# entropies.append()
-		entropies.append(dist)
+	entropies = np.asarray(data.iloc[0][columnsNames], dtype=float)
 	return np.mean(entropies)
 
 # def getEntropy(data):
@@ -19,42 +41,100 @@ def getEntropy(data, num_target_packets):
 # 	return entropy
 
 
+def senderColumns(data):
+	''' Returns the names of the sender estimate columns of the target senders (PrSenderA, PrSenderB, ...),
+	the column i being the one of the sender label i + 1. '''
+	names = data.columns if isinstance(data, pd.DataFrame) else data.dtype.names
+	return [c for c in names if c.startswith("PrSender")]
 
-def getUnlinkability(data):
-	epsilon = []
-	dlts = 0
-	est_senderA = data["PrSenderA"]
-	est_senderB = data["PrSenderB"]
-	realSenderLabel = data["RealSenderLabel"]
-
-	for (prA, prB, label) in zip(est_senderA, est_senderB, realSenderLabel):
-		if label == 1:
-			if not float(prB) == 0.0:
-				ratio = float(prA) / float(prB)
-				if not ratio == 0.0:
-					epsilon.append(math.log(ratio))
-			else:
-				dlts += 1
-		elif label == 2:
-			if not float(prA) == 0.0:
-				ratio = float(prB) / float(prA)
-				if not ratio == 0.0:
-					epsilon.append(math.log(ratio))
-			else:
-				dlts += 1
-		else:
-			pass
+
+def unlinkabilityTerms(data):
+	''' For every pair (real sender, other target sender) of target sender labels, returns the log ratios
+	(epsilons) of the estimated probabilities of the real sender vs the other target sender of the packets
+	of the real sender, the number of these packets for which the other target sender has zero probability
+	(which add to delta) and the number of these packets, as a dict {(real, other) : (epsilons, dlts, packets)}.
+	All the pairs are computed in a single pass over the data. '''
+	columns = senderColumns(data)
+	pr = np.column_stack([np.asarray(data[c], dtype=float) for c in columns])
+	label = np.asarray(data["RealSenderLabel"])
+
+	terms = {}
+	for real in range(1, len(columns) + 1):
+		rows = (label == real)
+		prReal = pr[rows, real - 1]
+		for other in range(1, len(columns) + 1):
+			if other == real:
+				continue
+			prOther = pr[rows, other - 1]
+			nonzero = (prOther != 0.0)
+			ratio = prReal[nonzero] / prOther[nonzero]
+			ratio = ratio[ratio != 0.0]
+			# math.log rather than np.log, whose SIMD implementation may differ in the last bit,
+			# so that the results match the ones of the per-row computation exactly.
+			terms[(real, other)] = (np.fromiter(map(math.log, ratio), dtype=float, count=len(ratio)), int(np.count_nonzero(~nonzero)), len(prReal))
+	return terms
+
+
+def getUnlinkability(data, pairwise=False):
+	''' Returns (epsilon, delta) over all the pairs of target senders or, if pairwise is set,
+	the dict {(real sender label, other target sender label) : (epsilon, delta)}. '''
+	terms = unlinkabilityTerms(data)
+	if pairwise:
+		return {pair : (np.mean(epsilon) if len(epsilon) > 0 else None, float(dlts) / float(packets) if packets > 0 else None)
+				for pair, (epsilon, dlts, packets) in terms.items()}
+
+	epsilon = np.concatenate([t[0] for t in terms.values()]) if terms else np.zeros(0)
 	meanEps = None
-	if epsilon != []:
+	if len(epsilon) > 0:
 		meanEps = np.mean(epsilon)
-	delta = float(dlts) / float(len(est_senderA))
+	delta = float(sum(t[1] for t in terms.values())) / float(len(data["RealSenderLabel"]) * max(len(senderColumns(data)) - 1, 1))
 	return (meanEps, delta)
 
 
 def computeE2ELatency(df):
-	travelTime = []
-	for i, r in df.iterrows():
-	    timeSent = r['PacketTimeSent']
-	    timeDelivered = r['PacketTimeDelivered']
-	    travelTime.append(timeDelivered - timeSent)
+	travelTime = np.asarray(df['PacketTimeDelivered'], dtype=float) - np.asarray(df['PacketTimeSent'], dtype=float)
 	return np.mean(travelTime)
+
+
+def computeLatencyBreakdown(df):
+	''' Returns the mean and the 50th, 95th and 99th percentiles of the end-to-end latency of the packets. '''
+	travelTime = np.asarray(df['PacketTimeDelivered'], dtype=float) - np.asarray(df['PacketTimeSent'], dtype=float)
+	(p50, p95, p99) = np.percentile(travelTime, [50, 95, 99])
+	return {"mean" : np.mean(travelTime), "p50" : p50, "p95" : p95, "p99" : p99}
+
+
+def computePacketMetrics(chunks, latencyMax=10.0, latencyBuckets=10000):
+	''' Computes the unlinkability and the latency breakdown in a single pass over the chunks of
+	a packet log (see iterLogChunks), so logs bigger than the memory can be processed: only running
+	sums and a histogram of the latency of latencyBuckets buckets up to latencyMax are kept. The mean
+	latency, epsilon and delta are exact, the percentiles are approximated from the histogram as the
+	online ones (see classes/OnlineMetrics.py), within one bucket width of the exact ones. '''
+	epsilonSum = 0.0
+	epsilonCount = 0
+	dlts = 0
+	rows = 0
+	latencySum = 0.0
+	latencyCount = 0
+	latencyHighest = 0.0
+	bucketWidth = float(latencyMax) / int(latencyBuckets)
+	histogram = np.zeros(int(latencyBuckets) + 1, dtype=np.int64) # The last bucket counts latencies over latencyMax
+	for chunk in chunks:
+		terms = unlinkabilityTerms(chunk)
+		for (epsilon, chunkDlts, packets) in terms.values():
+			epsilonSum += math.fsum(epsilon)
+			epsilonCount += len(epsilon)
+			dlts += chunkDlts
+		rows += len(chunk["RealSenderLabel"]) * max(len(senderColumns(chunk)) - 1, 1)
+		travelTime = np.asarray(chunk['PacketTimeDelivered'], dtype=float) - np.asarray(chunk['PacketTimeSent'], dtype=float)
+		if len(travelTime) > 0:
+			latencySum += math.fsum(travelTime)
+			latencyCount += len(travelTime)
+			latencyHighest = max(latencyHighest, float(travelTime.max()))
+			histogram += np.bincount(np.minimum((travelTime / bucketWidth).astype(np.int64), len(histogram) - 1), minlength=len(histogram))
+
+	return {"epsilon" : epsilonSum / epsilonCount if epsilonCount > 0 else None,
+			"delta" : float(dlts) / float(rows) if rows > 0 else None,
+			"latency" : latencySum / latencyCount if latencyCount > 0 else None,
+			"latency_p50" : histogram_quantile(histogram, bucketWidth, 0.50, latencyHighest),
+			"latency_p95" : histogram_quantile(histogram, bucketWidth, 0.95, latencyHighest),
+			"latency_p99" : histogram_quantile(histogram, bucketWidth, 0.99, latencyHighest)}
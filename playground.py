@@ -25,17 +25,16 @@ if __name__ == "__main__":
 		except:
 			pass
 
-	test_mode.run(exp_dir='playground_experiment', conf_file=None, conf_dic=config)
-	throughput = test_mode.throughput
+	summary = test_mode.run(exp_dir='playground_experiment', conf_file=None, conf_dic=config)
+	throughput = summary["throughput"]
 
-	packetLogsDir = './playground_experiment/logs/packet_log.csv'
-	entropyLogsDir = './playground_experiment/logs/last_mix_entropy.csv'
-	packetLogs = pd.read_csv(packetLogsDir, delimiter=';')
-	entropyLogs = pd.read_csv(entropyLogsDir, delimiter=';')
+	log_format = config["logging"].get("format", "text")
+	packetLogs = anonymity_metrics.loadLog('./playground_experiment/logs', 'packet_log', log_format)
+	entropyLogs = anonymity_metrics.loadLog('./playground_experiment/logs', 'last_mix_entropy', log_format)
 
 	unlinkability = anonymity_metrics.getUnlinkability(packetLogs)
 	entropy = anonymity_metrics.getEntropy(entropyLogs, config["misc"]["num_target_packets"])
-	latency = anonymity_metrics.computeE2ELatency(packetLogs)
+	latency = anonymity_metrics.computeLatencyBreakdown(packetLogs)
 
 	print("\n\n")
 	print("Simulation finished. Below, you can check your results.")
@@ -48,8 +47,10 @@ if __name__ == "__main__":
 		print(">>> E2E Unlinkability: (epsilon=%f, delta=%f)" % unlinkability)
 	print("\n\n")
 	print("-------- Performance metrics --------")
-	print(">> Overall latency: %f seconds (including mixing delay and packet cryptographic processing)" % (latency))
+	print(">> Overall latency: %f seconds (including mixing delay and packet cryptographic processing)" % (latency["mean"]))
+	print(">> Latency percentiles: p50=%f, p95=%f, p99=%f seconds" % (latency["p50"], latency["p95"], latency["p99"]))
 	print(">> Throuhput of the network: %f [packets / second]" % throughput)
+	print(">> Burn-in phase: %f ticks" % summary["burnin_time"])
 	print("-------------------------------------------------------")
 
 	# except Exception as e:
@@ -0,0 +1,200 @@
+''' Fork mode: runs the burn-in phase once, and then forks a measurement run for every
+    point of a grid of measurement-phase parameters from the warmed-up network.
+
+    The snapshot of the steady state is the memory of the parent process itself: every
+    measurement run is an os.fork() child, which gets a copy-on-write copy of the whole
+    simulation (environment, pending events, pools) and continues from there. The burn-in
+    is therefore paid only once, instead of once per run. Requires a platform with os.fork
+    (Linux, macOS).
+
+    Only the parameters which are used after the burn-in can be varied:
+
+    {
+        "seed": 0,
+        "grid": {
+            "misc.num_target_packets": [100, 1000],
+            "clients.sim_add_buffer": [0.5, 1.0],
+            "phases.cooldown": [2000],
+            "target": [1, 2]
+        }
+    }
+
+    where "target" selects which of the two target senders sends the tracked messages.
+    Each fork continues with its own random stream (spawned from a master SeedSequence),
+    so the measurement runs are independent given the shared burn-in.
+
+    Run from the root of the repository:
+
+    python3 -m simulation_modes.fork_mode -config_file test_config.json -sweep_file forks.json -exp_dir fork_experiment
+'''
+import argparse
+import contextlib
+import copy
+import datetime
+import json
+import logging
+import os
+import sys
+import traceback
+
+import numpy
+import pandas as pd
+
+import experiments.Settings
+from classes.Net import Network
+from classes.Profiler import start_profiler
+from simulation_modes import test_mode, sweep_mode
+
+
+MEASUREMENT_PARAMS = ["misc.num_target_packets", "clients.sim_add_buffer", "phases.cooldown", "target"]
+
+
+def run_fork(run_id, run_dir, conf, params, seed_sequence, env, net, targets, mixnodes, time_started, time_started_unix):
+    ''' Runs the measurement phase of a single fork. Executed in the child process. '''
+
+    conf = copy.deepcopy(conf)
+    target = params.get("target", 1)
+    for path, value in params.items():
+        if path != "target":
+            sweep_mode.set_param(conf, path, value)
+
+    (senders, recipient) = targets
+    sender = senders[target - 1]
+
+    # Apply the measurement parameters which the network read when it was created
+    test_mode.setup_entropy(env, conf)
+    for node in senders + [recipient] + mixnodes:
+        node.conf = conf
+    sender.rate_generating = float(conf["clients"]["sim_add_buffer"])
+
+    rng = numpy.random.default_rng(seed_sequence)
+    env.seed_sequence = seed_sequence
+    net.reseed(rng)
+    for node in senders + [recipient]:
+        node.reseed(rng)
+
+    log_dir = os.path.join(run_dir, conf["logging"]["dir"])
+    os.makedirs(log_dir, exist_ok=True)
+    loggers = test_mode.get_loggers(log_dir, conf)
+    profiler = start_profiler(env, conf, net, loggers, run_dir)
+
+    summary = test_mode.run_measurement(env, conf, mixnodes, loggers, sender, recipient, time_started, time_started_unix,
+                                        entropy_before_cooldown=(net.type != "p2p"))
+    if profiler is not None:
+        profiler.stop()
+
+    result = {"run" : run_id}
+    result.update(params)
+    result.update(summary)
+    return result
+
+
+def run(exp_dir, grid, conf_file=None, conf_dic=None, seed=0, workers=None):
+    ''' Runs the burn-in once and the measurement runs as forks of it. Returns the table
+        (pandas DataFrame) of results, which is also written into exp_dir/fork_results.csv.
+
+        Keyword arguments:
+        exp_dir - the directory of the experiment; fork i is written into exp_dir/run_i,
+        grid - dict {parameter path : list of values}, see MEASUREMENT_PARAMS,
+        conf_file, conf_dic - the base configuration,
+        seed - the seed of the master SeedSequence; the burn-in uses its first spawned child
+               and fork i the (i+1)-th one,
+        workers - maximum number of forks running at the same time (by default the number of cores).
+    '''
+    if conf_file:
+        conf = experiments.Settings.load(conf_file)
+    elif conf_dic:
+        conf = conf_dic
+    else:
+        raise Exception("A configuration dictionary or file required")
+
+    for path in grid:
+        if path not in MEASUREMENT_PARAMS:
+            raise Exception("Parameter %s can not be changed after the burn-in" % path)
+    points = sweep_mode.expand_grid(grid)
+    seeds = numpy.random.SeedSequence(seed).spawn(len(points) + 1)
+    workers = workers or os.cpu_count() or 1
+
+    # The nodes only keep references to the loggers, the forks attach their own log files to them.
+    loggers = tuple(logging.getLogger(name) for name in test_mode.LOGGER_NAMES)
+    for l in loggers:
+        for h in list(l.handlers):
+            l.removeHandler(h)
+
+    env = test_mode.setup_env(conf, seeds[0])
+    type = conf["network"]["topology"]
+    net = Network(env, type, conf, loggers)
+    if type == "p2p":
+        targets = test_mode.start_p2p(env, conf, net)
+        mixnodes = net.peers
+    else:
+        targets = test_mode.start_client_server(env, conf, net)
+        mixnodes = net.mixnodes
+
+    time_started = env.now
+    time_started_unix = datetime.datetime.now()
+    burnin_time = test_mode.run_burnin(env, conf, mixnodes)
+    burnin_wall_time = (datetime.datetime.now() - time_started_unix).total_seconds()
+    print("> Burn-in done, forking %d measurement runs" % len(points))
+
+    running = {}
+    failed = []
+    for i, params in enumerate(points):
+        if len(running) >= workers:
+            (pid, status) = os.wait()
+            if status != 0:
+                failed.append(running[pid])
+            del running[pid]
+
+        run_dir = os.path.join(exp_dir, "run_%d" % i)
+        os.makedirs(run_dir, exist_ok=True)
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            with open(os.path.join(run_dir, "stdout.txt"), "w") as out, contextlib.redirect_stdout(out):
+                try:
+                    result = run_fork(i, run_dir, conf, params, seeds[i + 1], env, net, targets, mixnodes, time_started, time_started_unix)
+                    with open(os.path.join(run_dir, "result.json"), "w") as f:
+                        json.dump(result, f)
+                except Exception:
+                    traceback.print_exc(file=out)
+                    code = 1
+                out.flush()
+            os._exit(code)
+        running[pid] = i
+
+    while running:
+        (pid, status) = os.wait()
+        if status != 0:
+            failed.append(running[pid])
+        del running[pid]
+
+    results = []
+    for i in range(len(points)):
+        if i in failed:
+            print("> Run %d failed, see %s" % (i, os.path.join(exp_dir, "run_%d" % i, "stdout.txt")))
+            continue
+        with open(os.path.join(exp_dir, "run_%d" % i, "result.json")) as f:
+            results.append(json.load(f))
+
+    table = pd.DataFrame(results)
+    table["burnin_time"] = burnin_time
+    table["burnin_wall_time"] = burnin_wall_time
+    table.to_csv(os.path.join(exp_dir, "fork_results.csv"), sep=";", index=False)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The base config file")
+    parser.add_argument("-sweep_file", help="The json file describing the grid of measurement parameters")
+    parser.add_argument("-exp_dir", default="fork_experiment", help="The directory of the experiment")
+    parser.add_argument("-workers", type=int, default=None, help="Maximum number of forks running at the same time")
+    args = parser.parse_args()
+
+    with open(args.sweep_file) as json_file:
+        sweep = json.load(json_file)
+    os.makedirs(args.exp_dir, exist_ok=True)
+    table = run(exp_dir=args.exp_dir, grid=sweep["grid"], conf_file=args.config_file, seed=sweep.get("seed", 0), workers=args.workers)
+    print(table.to_string())
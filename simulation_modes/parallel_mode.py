@@ -0,0 +1,334 @@
+''' Parallel mode: runs the test mode simulation of the stratified topology sharded over processes.
+
+    The network is split into stages connected as a pipeline: the sources (the traffic of the clients,
+    spread over "parallel" -> "sources" shards), the gateways if any, one stage per layer of mixes (the mixes
+    of a layer spread over "parallel" -> "shards_per_layer" shards) and the sinks ("parallel" -> "sinks" shards),
+    which register the delivered packets, the client of row i as a recipient being owned by the sink i % sinks.
+    Every shard is a process simulating its part of the network in its own environment (see classes/ShardNet.py).
+
+    The synchronisation is conservative and window based. The simulated time is cut into windows of
+    "parallel" -> "window" ticks, and the shards advance in rounds separated by a barrier: in round r,
+    the shards of stage s simulate window r - s. Packets only move from a stage to a later one, and a packet
+    handed over at time t arrives at time t, so when a shard simulates a window it already has all the packets
+    the earlier stages handed over to it during that window, written into the shared memory channels in the
+    previous rounds (see classes/ShardChannel.py). No event is ever processed out of order, whatever the window,
+    so the windows can be much longer than the lookahead of a hop (the processing time of a packet, 0.000386),
+    which keeps the number of barriers low.
+
+    The main sink, which owns the target recipient, detects the stop condition (all the tracked messages
+    delivered or dropped) as a sequential run does, and publishes the time of the stop and the end of the
+    cooldown, at which all the shards stop. Every sink then takes its entropy at the time of the stop, and at
+    the end of the run the main sink sums the entropies of all the sinks and logs them. The online metrics
+    of the sinks are merged into the summary, which has the metrics of test_mode. The runs are statistically
+    equivalent to the sequential ones, but not identical to them, since every shard draws from its own
+    random stream.
+
+    The summary also has the CPU time of the busiest shard (shard_cpu_max) and of all the shards together
+    (shard_cpu_total): their ratio bounds the speedup over a sequential run, with one core per shard.
+
+    Only the fixed burn-in is supported, and the hop engine is always the heap one.
+
+    Run from the root of the repository:
+
+    python3 -m simulation_modes.parallel_mode -config_file test_config.json -exp_dir parallel_experiment
+'''
+import argparse
+import contextlib
+import copy
+import datetime
+import itertools
+import math
+import multiprocessing
+import os
+import time
+import traceback
+
+import numpy as np
+
+import experiments.Settings
+from classes.OnlineMetrics import OnlineMetrics
+from classes.Packet import num_labels
+from classes.Profiler import start_profiler
+from classes.ShardChannel import ShardChannel, packet_dtype
+from classes.ShardNet import ShardNetwork
+from classes.Utilities import StructuredMessage
+from simulation_modes import test_mode
+
+
+# The packet and message IDs of shard i start at i * ID_STRIDE
+ID_STRIDE = 2 ** 40
+
+
+def get_stages(conf):
+    ''' Returns the list of the stages of the pipeline, each the list of the numbers of its shards. '''
+    parallel = conf.get("parallel", {})
+    stratified = conf["network"]["stratified"]
+    sizes = [int(parallel.get("sources", 1))]
+    if int(stratified.get("num_gateways", 0)) > 0:
+        sizes.append(min(int(parallel.get("shards_per_layer", 1)), int(stratified["num_gateways"])))
+    sizes += [min(int(parallel.get("shards_per_layer", 1)), int(stratified["layer_size"]))] * int(stratified["layers"])
+    sizes.append(min(int(parallel.get("sinks", 1)), int(conf["clients"]["number"])))
+
+    numbers = itertools.count()
+    return [[next(numbers) for _ in range(size)] for size in sizes]
+
+
+def get_main_sink(conf, stages):
+    ''' Returns the number of the sink owning the target recipient, the last row of the clients
+        after the target senders (see test_mode.start_client_server).
+    '''
+    row = int(conf["clients"]["number"]) - num_labels(conf)
+    return stages[-1][row % len(stages[-1])]
+
+
+def get_channels(conf, stages):
+    ''' Creates the channels between the shards: from every shard to every shard of the next stage,
+        and from the gateways and the mixes to the main sink (for the dropped real packets).
+    '''
+    parallel = conf.get("parallel", {})
+    stratified = conf["network"]["stratified"]
+    route_length = int(stratified["layers"]) + (1 if int(stratified.get("num_gateways", 0)) > 0 else 0) + 1
+    dtype = packet_dtype(route_length, num_labels(conf))
+    capacity = int(parallel.get("channel_capacity", 10000))
+    mass_capacity = int(parallel.get("mass_capacity", 100000))
+
+    sink = len(stages) - 1
+    main_sink = get_main_sink(conf, stages)
+    channels = {}
+    for s in range(sink):
+        consumers = [(s + 1, c) for c in stages[s + 1]]
+        if s > 0 and s + 1 != sink:
+            consumers.append((sink, main_sink))
+        for p in stages[s]:
+            for (t, c) in consumers:
+                channels[(p, c)] = ShardChannel(dtype, capacity, mass_capacity, t - s + 1)
+    return channels
+
+
+def start_measurement(env, burnin, mixnodes, sender, recipient):
+    ''' Turns on the logging of the given mixes and starts the tracked messages of the target sender
+        (if any) at the end of the burn-in, as run_measurement in test_mode does.
+    '''
+    yield env.timeout(burnin)
+    for m in mixnodes:
+        m.mixlogging = True
+    if sender is not None:
+        env.process(sender.simulate_adding_packets_into_buffer(recipient))
+        print("> Started sending traffic for measurments")
+
+
+def simulate_shard(exp_dir, conf, stages, shard, channels, control, entropies, barrier, seed_sequence):
+    ''' Simulates the part of the network of one shard, in rounds synchronised with the other shards.
+        Executed in the process of the shard. Returns the counters of the shard.
+    '''
+    window = float(conf["parallel"].get("window", 0.1))
+    burnin = float(conf["phases"]["burnin"])
+    sink = get_main_sink(conf, stages)
+    time_started_unix = datetime.datetime.now()
+    cpu_started = time.process_time()
+
+    env = test_mode.setup_env(conf, seed_sequence)
+    env.ids = itertools.count(shard * ID_STRIDE)
+    log_dir = os.path.join(exp_dir, conf["logging"]["dir"])
+    loggers = test_mode.get_loggers(log_dir, conf) if shard == sink else (None, None, None)
+    net = ShardNetwork(env, "stratified", conf, loggers, stages, shard, sink, channels, burnin)
+    mixnodes = [m for m in net.mixnodes if net.owner[m.index] == shard]
+
+    # Every shard picks the same target senders and recipient (the last rows of the clients)
+    if shard in stages[0]:
+        (senders, recipient) = test_mode.start_client_server(env, conf, net, source=shard, num_sources=len(stages[0]))
+    else:
+        senders = test_mode.pick_target_senders(conf, net.clients)
+        recipient = net.clients.pop()
+    if net.owner[recipient.index] != sink:
+        raise Exception("The target recipient is not owned by the main sink")
+    env.process(start_measurement(env, burnin, mixnodes, senders[0] if shard == stages[0][0] else None, recipient))
+
+    stopped = {}
+    if shard == sink:
+        env.process(recipient.set_start_logs())
+        env.message_ctr = int(conf["misc"]["num_target_packets"])
+        env.finished = True
+
+        def stop(event):
+            print("> Main part of simulation finished. Starting cooldown phase.")
+            control[1] = env.now
+            control[0] = env.now + conf["phases"]["cooldown"]
+        env.stop_sim_event.callbacks.append(stop)
+
+    profiler = start_profiler(env, conf, net, loggers, os.path.join(exp_dir, "shard_%d" % shard))
+    time_end = math.inf
+    end_round = None
+    r = 0
+    while end_round is None or r < end_round:
+        w = r - net.stage
+        if w >= 0 and w * window < time_end:
+            net.receive_window(w)
+            until = min((w + 1) * window, time_end)
+            if until > env.now:
+                env.run(until=until)
+            net.send_window(w)
+        barrier.wait()
+        if end_round is None and control[0] < math.inf:
+            time_end = float(control[0])
+            end_round = int(math.ceil(time_end / window)) + len(stages) - 1
+            if net.is_sink:
+                # The sinks are all at the end of the window in which the main sink stopped
+                stopped["entropy"] = net.entropy_at(float(control[1]))
+        r += 1
+
+    if profiler is not None:
+        profiler.stop()
+    # The sinks publish their entropies (at the stop and at the end), which the main sink sums and logs
+    entropies = np.frombuffer(entropies, dtype=np.float64).reshape(len(stages[-1]), 2, -1)
+    if net.is_sink:
+        env.entropy_accumulator.flush()
+        entropies[stages[-1].index(shard)] = (stopped["entropy"], env.entropy)
+    barrier.wait()
+
+    result = net.stats()
+    result["rounds"] = r
+    result["wall_time"] = (datetime.datetime.now() - time_started_unix).total_seconds()
+    result["cpu_time"] = time.process_time() - cpu_started
+    if net.is_sink:
+        result.update({"metrics" : env.metrics, "sim_time" : env.now})
+    if shard == sink:
+        (entropy_stop, entropy_end) = entropies.sum(axis=0)
+        if loggers[2] is not None:
+            loggers[2].info(StructuredMessage(metadata=tuple(entropy_stop)))
+            loggers[2].info(StructuredMessage(metadata=tuple(entropy_end)))
+        print("> Cooldown phase finished.")
+        test_mode.flush_logs(loggers)
+        result.update({"entropy" : float(np.mean(entropy_stop)), "stop_time" : float(control[1])})
+    return result
+
+
+def run_shard(exp_dir, conf, stages, shard, channels, control, entropies, barrier, seed_sequence, results):
+    ''' Entry point of the process of a shard: runs it with its output redirected into
+        exp_dir/shard_<shard>.txt, and puts its result (or error) into the results queue.
+    '''
+    with open(os.path.join(exp_dir, "shard_%d.txt" % shard), "w") as out, contextlib.redirect_stdout(out):
+        try:
+            result = simulate_shard(exp_dir, conf, stages, shard, channels, control, entropies, barrier, seed_sequence)
+        except Exception:
+            traceback.print_exc(file=out)
+            barrier.abort()
+            result = {"shard" : shard, "error" : traceback.format_exc()}
+    results.put(result)
+
+
+def merge_results(conf, results, wall_time):
+    ''' Merges the results of the shards into the summary of the run, with the metrics of test_mode. '''
+    sink = [r for r in results if "entropy" in r][0]
+    sim_time = sink["sim_time"]
+    pkts_sent = {}
+    for r in results:
+        pkts_sent.update(r["mix_pkts_sent"])
+    mixthroughputs = [float(pkts_sent[i]) / sim_time for i in sorted(pkts_sent)]
+    received = sum(r["total_messages_received"] for r in results)
+
+    summary = {"throughput" : float(received) / sim_time,
+               "mix_throughput_mean" : float(np.mean(mixthroughputs)),
+               "mix_throughput_std" : float(np.std(mixthroughputs)),
+               "total_packets_received" : received,
+               "packets_dropped" : sum(r["packets_dropped"] for r in results),
+               "sim_time" : float(sim_time),
+               "wall_time" : wall_time.total_seconds()}
+    metrics = OnlineMetrics(num_labels=num_labels(conf), latency_max=conf.get("metrics", {}).get("latency_max", 10.0),
+                            latency_buckets=conf.get("metrics", {}).get("latency_buckets", 10000))
+    for r in results:
+        if "metrics" in r:
+            metrics.merge(r["metrics"])
+    summary.update(metrics.results())
+    summary["entropy"] = sink["entropy"]
+    summary["mix_packets_dropped"] = int(sum(r["mix_pkts_dropped"] for r in results))
+    summary["mass_dropped"] = float(np.mean(sum(r["mass_dropped"] for r in results)))
+    summary["entropy_dropped"] = float(np.mean(sum(r["entropy_dropped"] for r in results)))
+    summary["burnin_time"] = conf["phases"]["burnin"]
+    summary["shards"] = len(results)
+    summary["rounds"] = sink["rounds"]
+    summary["shard_cpu_max"] = max(r["cpu_time"] for r in results)
+    summary["shard_cpu_total"] = sum(r["cpu_time"] for r in results)
+    return summary
+
+
+def run(exp_dir, conf_file=None, conf_dic=None, seed_sequence=None):
+    ''' Runs the simulation sharded over processes. Returns the summary of the run, as test_mode.run.
+
+        Keyword arguments:
+        exp_dir - the directory of the experiment (logs, and the output of every shard in shard_<i>.txt),
+        conf_file, conf_dic - the configuration, with the parameters of the parallel run in conf["parallel"],
+        seed_sequence - numpy.random.SeedSequence from which the random streams of the shards are spawned
+                        (by default from "simulation" -> "seed").
+    '''
+    print("The experiment log directory is: %s" %exp_dir)
+    if conf_file:
+        conf = experiments.Settings.load(conf_file)
+    elif conf_dic:
+        conf = conf_dic
+    else:
+        raise Exception("A configuration dictionary or file required")
+
+    conf = copy.deepcopy(conf)
+    conf.setdefault("parallel", {})
+    conf.setdefault("simulation", {})["engine"] = "heap"
+    if conf["network"]["topology"] != "stratified":
+        raise Exception("Parallel runs support only the stratified topology")
+    if conf["phases"].get("burnin_mode", "fixed") != "fixed":
+        raise Exception("Parallel runs support only the fixed burn-in")
+
+    stages = get_stages(conf)
+    window = float(conf["parallel"].get("window", 0.1))
+    # The first stages run ahead of the sinks by up to one window per stage, and have to learn the end of
+    # the cooldown (published by the main sink at the end of the main part) before they pass it
+    if window * len(stages) > conf["phases"]["cooldown"]:
+        raise Exception("The window of a parallel run must be at most cooldown / %d" % len(stages))
+
+    os.makedirs(os.path.join(exp_dir, conf["logging"]["dir"]), exist_ok=True)
+    if seed_sequence is None:
+        seed_sequence = np.random.SeedSequence(conf["simulation"].get("seed"))
+    num_shards = stages[-1][-1] + 1
+    seeds = seed_sequence.spawn(num_shards)
+    print("Running %d shards in %d stages: %s" % (num_shards, len(stages), stages))
+
+    context = multiprocessing.get_context("fork")
+    channels = get_channels(conf, stages)
+    control = context.Array("d", [math.inf, math.inf], lock=False) # The end of the cooldown and the time of the stop, published by the main sink
+    entropies = context.Array("d", len(stages[-1]) * 2 * int(conf["misc"]["num_target_packets"]), lock=False)
+    barrier = context.Barrier(num_shards)
+    results = context.Queue()
+
+    time_started_unix = datetime.datetime.now()
+    processes = [context.Process(target=run_shard, args=(exp_dir, conf, stages, shard, channels, control, entropies, barrier, seeds[shard], results))
+                 for shard in range(num_shards)]
+    try:
+        for p in processes:
+            p.start()
+        shard_results = [results.get() for _ in processes]
+        for p in processes:
+            p.join()
+    finally:
+        for c in channels.values():
+            c.close(unlink=True)
+    wall_time = datetime.datetime.now() - time_started_unix
+
+    failed = [r for r in shard_results if "error" in r]
+    if failed:
+        raise Exception("Shard %d failed, see %s" % (failed[0]["shard"], os.path.join(exp_dir, "shard_%d.txt" % failed[0]["shard"])))
+
+    summary = merge_results(conf, shard_results, wall_time)
+    print("> Total Simulation Time [in ticks]: " + str(summary["sim_time"]) + "---------")
+    print("> Total Simulation Time [in unix time]: " + str(wall_time) + "---------")
+    print("Network throughput %f / second: " % summary["throughput"])
+    print("Average mix throughput %f / second, with std: %f" % (summary["mix_throughput_mean"], summary["mix_throughput_std"]))
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The config file")
+    parser.add_argument("-exp_dir", default="parallel_experiment", help="The directory of the experiment")
+    args = parser.parse_args()
+
+    os.makedirs(args.exp_dir, exist_ok=True)
+    print(run(exp_dir=args.exp_dir, conf_file=args.config_file))
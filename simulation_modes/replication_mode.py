@@ -0,0 +1,108 @@
+''' Replication mode: runs independent replications of the same configuration in parallel,
+    until the confidence intervals of the mean entropy and of the mean latency are narrow enough.
+
+    Replication i uses the i-th child of the master numpy.random.SeedSequence(seed), so the
+    whole procedure is reproducible. Replications are run in rounds of `workers` runs, and
+    after each round we check the half-widths of the confidence intervals against the targets
+    in the "replications" section of the config:
+
+    "replications": {
+        "min_runs": 3,             # never stop before this number of replications
+        "max_runs": 30,            # always stop after this number of replications
+        "confidence": 0.95,        # confidence level of the intervals
+        "entropy_halfwidth": 0.05, # target half-width of the mean entropy [bits]
+        "latency_halfwidth": 0.01  # target half-width of the mean latency [seconds]
+    }
+
+    Run from the root of the repository:
+
+    python3 -m simulation_modes.replication_mode -config_file test_config.json -exp_dir replication_experiment
+'''
+import argparse
+import os
+
+import numpy
+import pandas as pd
+from scipy import stats
+
+import experiments.Settings
+from simulation_modes import sweep_mode
+
+
+def confidence_halfwidth(values, confidence):
+    ''' Half-width of the Student t confidence interval of the mean of the values. '''
+    values = numpy.asarray(values, dtype=float)
+    if len(values) < 2:
+        return float("inf")
+    return float(stats.t.ppf((1.0 + confidence) / 2.0, len(values) - 1) * numpy.std(values, ddof=1) / numpy.sqrt(len(values)))
+
+
+def run(exp_dir, conf_file=None, conf_dic=None, seed=0, workers=None):
+    ''' Runs the replications and returns (summary, table), where the table (pandas DataFrame)
+        holds the results of every replication and is also written into
+        exp_dir/replication_results.csv.
+
+        Keyword arguments:
+        exp_dir - the directory of the experiment; replication i is written into exp_dir/run_i,
+        conf_file, conf_dic - the configuration,
+        seed - the seed of the master SeedSequence,
+        workers - number of worker processes (by default the number of cores).
+    '''
+    if conf_file:
+        conf = experiments.Settings.load(conf_file)
+    elif conf_dic:
+        conf = conf_dic
+    else:
+        raise Exception("A configuration dictionary or file required")
+
+    settings = conf["replications"]
+    min_runs = int(settings["min_runs"])
+    max_runs = int(settings["max_runs"])
+    confidence = float(settings["confidence"])
+    targets = {"entropy" : float(settings["entropy_halfwidth"]), "latency" : float(settings["latency_halfwidth"])}
+
+    round_size = workers or os.cpu_count() or 1
+    seeds = numpy.random.SeedSequence(seed).spawn(max_runs)
+
+    results = []
+    halfwidths = {}
+    with sweep_mode.make_executor(workers) as executor:
+        while len(results) < max_runs:
+            first = len(results)
+            last = min(max_runs, max(first + round_size, min_runs))
+            futures = [executor.submit(sweep_mode.run_point, i, os.path.join(exp_dir, "run_%d" % i), conf, {}, seeds[i]) for i in range(first, last)]
+            for future in futures:
+                r = future.result()
+                if r["error"] is not None:
+                    raise Exception("Replication %d failed: %s" % (r["run"], r["error"]))
+                results.append(r)
+
+            halfwidths = {m : confidence_halfwidth([r[m] for r in results], confidence) for m in targets}
+            print("> %d replications, half-widths: %s" % (len(results), ", ".join("%s=%f" % (m, h) for m, h in halfwidths.items())))
+            if len(results) >= min_runs and all(halfwidths[m] <= targets[m] for m in targets):
+                break
+
+    table = pd.DataFrame(results)
+    table.to_csv(os.path.join(exp_dir, "replication_results.csv"), sep=";", index=False)
+
+    summary = {"replications" : len(results), "converged" : all(halfwidths[m] <= targets[m] for m in targets)}
+    for m in targets:
+        summary[m] = float(table[m].mean())
+        summary[m + "_halfwidth"] = halfwidths[m]
+    return summary, table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The config file of the experiment")
+    parser.add_argument("-exp_dir", default="replication_experiment", help="The directory of the experiment")
+    parser.add_argument("-seed", type=int, default=0, help="The seed of the master SeedSequence")
+    parser.add_argument("-workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args()
+
+    os.makedirs(args.exp_dir, exist_ok=True)
+    summary, table = run(exp_dir=args.exp_dir, conf_file=args.config_file, seed=args.seed, workers=args.workers)
+    print("-------------------------------------------------------")
+    print(">>> Replications: %d (converged: %s)" % (summary["replications"], summary["converged"]))
+    print(">>> Entropy: %f +- %f" % (summary["entropy"], summary["entropy_halfwidth"]))
+    print(">>> Latency: %f +- %f" % (summary["latency"], summary["latency_halfwidth"]))
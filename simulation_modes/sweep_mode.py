@@ -0,0 +1,143 @@
+''' Parameter sweep mode: runs the test mode simulation for every point of a grid of
+    parameters, fanning the runs out over a pool of worker processes.
+
+    Each run gets its own experiment directory (so its own logs), its own random stream
+    (spawned from a master numpy.random.SeedSequence) and its own stdout file, and the
+    metrics of all the runs are collected into a single results table.
+
+    The sweep is described in a json file, for example:
+
+    {
+        "seed": 0,
+        "grid": {
+            "mixnodes.avg_delay": [0.05, 0.1, 0.5],
+            "network.stratified.layer_size": [3, 5],
+            "clients.number": [100, 200],
+            "clients.cover_traffic_rate": [1.0, 2.0]
+        }
+    }
+
+    Each key of the grid is the path of the parameter in the config, separated by dots.
+    Run from the root of the repository:
+
+    python3 -m simulation_modes.sweep_mode -config_file test_config.json -sweep_file sweep.json -exp_dir sweep_experiment
+'''
+import argparse
+import contextlib
+import copy
+import itertools
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy
+import pandas as pd
+
+import experiments.Settings
+from simulation_modes import test_mode
+
+
+def set_param(conf, path, value):
+    ''' Sets the value of a (nested) config parameter given by a dot separated path,
+        e.g., "network.stratified.layer_size".
+    '''
+    keys = path.split(".")
+    d = conf
+    for k in keys[:-1]:
+        d = d[k]
+    if keys[-1] not in d:
+        raise Exception("Parameter %s not found in the config" % path)
+    d[keys[-1]] = value
+
+
+def expand_grid(grid):
+    ''' Returns the list of all the parameter combinations of the grid, each as a dict {path : value}. '''
+    paths = sorted(grid.keys())
+    return [dict(zip(paths, values)) for values in itertools.product(*[grid[p] for p in paths])]
+
+
+def run_point(run_id, run_dir, conf, params, seed_sequence):
+    ''' Runs a single point of the sweep. Executed in a worker process. '''
+
+    conf = copy.deepcopy(conf)
+    for path, value in params.items():
+        set_param(conf, path, value)
+
+    log_dir = os.path.join(run_dir, conf["logging"]["dir"])
+    os.makedirs(log_dir, exist_ok=True)
+
+    result = {"run" : run_id}
+    result.update(params)
+    with open(os.path.join(run_dir, "stdout.txt"), "w") as out, contextlib.redirect_stdout(out):
+        try:
+            summary = test_mode.run(exp_dir=run_dir, conf_dic=conf, seed_sequence=seed_sequence)
+            result.update(summary) # The metrics are computed online during the run, so the logs are not needed
+            result["error"] = None
+        except Exception:
+            traceback.print_exc(file=out)
+            result["error"] = traceback.format_exc().splitlines()[-1]
+    return result
+
+
+def make_executor(workers=None):
+    # A fresh worker per run, so that no global state (loggers, caches) leaks between runs.
+    pool_args = {"max_workers" : workers}
+    if sys.version_info >= (3, 11):
+        pool_args["max_tasks_per_child"] = 1
+    return ProcessPoolExecutor(**pool_args)
+
+
+def run(exp_dir, grid, conf_file=None, conf_dic=None, seed=0, workers=None):
+    ''' Runs the sweep and returns the table (pandas DataFrame) of results,
+        which is also written into exp_dir/sweep_results.csv.
+
+        Keyword arguments:
+        exp_dir - the directory of the sweep; run i is written into exp_dir/run_i,
+        grid - dict {parameter path : list of values},
+        conf_file, conf_dic - the base configuration,
+        seed - the seed of the master SeedSequence, run i uses its i-th spawned child,
+        workers - number of worker processes (by default the number of cores).
+    '''
+    if conf_file:
+        conf = experiments.Settings.load(conf_file)
+    elif conf_dic:
+        conf = conf_dic
+    else:
+        raise Exception("A configuration dictionary or file required")
+
+    points = expand_grid(grid)
+    for params in points:
+        for path, value in params.items():
+            set_param(copy.deepcopy(conf), path, value)  # Fail early on a wrong parameter name
+
+    print("> Sweep of %d runs in %s" % (len(points), exp_dir))
+
+    results = []
+    with make_executor(workers) as executor:
+        seeds = numpy.random.SeedSequence(seed).spawn(len(points))
+        futures = [executor.submit(run_point, i, os.path.join(exp_dir, "run_%d" % i), conf, params, seeds[i]) for i, params in enumerate(points)]
+        for future in as_completed(futures):
+            r = future.result()
+            results.append(r)
+            print("> Run %d finished (%d / %d)%s" % (r["run"], len(results), len(points), "" if r["error"] is None else ", error: " + r["error"]))
+
+    table = pd.DataFrame(results).sort_values("run").reset_index(drop=True)
+    table.to_csv(os.path.join(exp_dir, "sweep_results.csv"), sep=";", index=False)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-config_file", default="test_config.json", help="The base config file of the sweep")
+    parser.add_argument("-sweep_file", help="The json file describing the grid of parameters")
+    parser.add_argument("-exp_dir", default="sweep_experiment", help="The directory of the sweep")
+    parser.add_argument("-workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args()
+
+    with open(args.sweep_file) as json_file:
+        sweep = json.load(json_file)
+    os.makedirs(args.exp_dir, exist_ok=True)
+    table = run(exp_dir=args.exp_dir, grid=sweep["grid"], conf_file=args.config_file, seed=sweep.get("seed", 0), workers=args.workers)
+    print(table.to_string())
@@ -1,6 +1,7 @@
 import simpy
 import os
 import datetime
+import itertools
 import numpy as np
 from collections import namedtuple
 
@@ -11,127 +12,147 @@ from classes.Net import *
 from classes.Client import *
 from classes.Net import *
 from classes.Utilities import *
+from classes.Engine import make_environment
+from classes.ColumnarLog import ColumnarLogger, MESSAGE_LOG_COLUMNS, packet_log_columns, sender_estimate_columns, entropy_log_columns
+from classes.Packet import num_labels
+from classes.SteadyState import SteadyStateDetector
+from classes.OnlineMetrics import OnlineMetrics
+from classes.EntropyAccumulator import EntropyAccumulator
+from classes.CoverSource import start_cover_sources
+from classes.Profiler import start_profiler
 
 
 throughput = 0.0
 
+LOGGER_NAMES = ('simulation.packet', 'simulation.messages', 'simulation.mix')
+
 def get_loggers(log_dir, conf):
+    if not conf["logging"]["enabled"]:
+        return (None, None, None)
+    if conf["logging"].get("format", "text") == "columnar":
+        return get_columnar_loggers(log_dir, conf)
 
-    packet_logger = setup_logger('simulation.packet', os.path.join(log_dir, 'packet_log.csv'))
-    packet_logger.info(StructuredMessage(metadata=("Type", "CurrentTime", "ClientID", "PacketID", "PacketType", "MessageID", "PacketTimeQueued", "PacketTimeSent", "PacketTimeDelivered", "TotalFragments", "PrOthers", "PrSenderA", "PrSenderB", "RealSenderLabel", "Route", "PoolSizes")))
+    packet_logger = setup_logger(LOGGER_NAMES[0], os.path.join(log_dir, 'packet_log.csv'))
+    packet_logger.info(StructuredMessage(metadata=("Type", "CurrentTime", "ClientID", "PacketID", "PacketType", "MessageID", "PacketTimeQueued", "PacketTimeSent", "PacketTimeDelivered", "TotalFragments") + tuple(sender_estimate_columns(num_labels(conf))) + ("RealSenderLabel", "Route", "PoolSizes")))
 
-    message_logger = setup_logger('simulation.messages', os.path.join(log_dir, 'message_log.csv'))
+    message_logger = setup_logger(LOGGER_NAMES[1], os.path.join(log_dir, 'message_log.csv'))
     message_logger.info(StructuredMessage(metadata=("Type", "CurrentTime", "ClientID", "MessageID", "NumPackets", "MsgTimeQueued", "MsgTimeSent", "MsgTimeDelivered", "MsgTransitTime", "MsgSize", "MsgRealSender")))
 
-    entropy_logger = setup_logger('simulation.mix', os.path.join(log_dir, 'last_mix_entropy.csv'))
+    entropy_logger = setup_logger(LOGGER_NAMES[2], os.path.join(log_dir, 'last_mix_entropy.csv'))
     entropy_logger.info(StructuredMessage(metadata=tuple(['Entropy'+str(x) for x in range(int(conf["misc"]["num_target_packets"]))])))
 
     return (packet_logger, message_logger, entropy_logger)
 
 
-def setup_env(conf):
-    env = simpy.Environment()
+def get_columnar_loggers(log_dir, conf):
+    ''' Binary counterpart of get_loggers, see classes/ColumnarLog.py. '''
+
+    chunk_size = conf["logging"].get("chunk_size", 100000)
+    packet_logger = ColumnarLogger(os.path.join(log_dir, 'packet_log'), packet_log_columns(num_labels(conf)), chunk_size)
+    message_logger = ColumnarLogger(os.path.join(log_dir, 'message_log'), MESSAGE_LOG_COLUMNS, chunk_size)
+    entropy_logger = ColumnarLogger(os.path.join(log_dir, 'last_mix_entropy'), entropy_log_columns(int(conf["misc"]["num_target_packets"])), 16)
+
+    return (packet_logger, message_logger, entropy_logger)
+
+
+def setup_env(conf, seed_sequence=None):
+    ''' Creates the simulation environment.
+
+        Keyword arguments:
+        conf - the configuration of the simulation,
+        seed_sequence - numpy.random.SeedSequence from which the random stream of the run is created.
+                        If not given, it is created from the "simulation" -> "seed" of the config
+                        (if the seed is null, the run is not reproducible).
+    '''
+    env = make_environment(conf)
+    if seed_sequence is None:
+        seed_sequence = np.random.SeedSequence(conf.get("simulation", {}).get("seed"))
+    env.seed_sequence = seed_sequence
+    env.rng = np.random.default_rng(seed_sequence)
+    env.ids = itertools.count() # Allocator of the packet and message IDs
     env.stop_sim_event = env.event()
     env.message_ctr = 0
     env.total_messages_sent = 0
     env.total_messages_received = 0
+    env.packets_dropped = 0
     env.finished = False
-    env.entropy = numpy.zeros(int(conf["misc"]["num_target_packets"]))
+    setup_entropy(env, conf)
+    env.metrics = OnlineMetrics(num_labels=num_labels(conf), latency_max=conf.get("metrics", {}).get("latency_max", 10.0),
+                                latency_buckets=conf.get("metrics", {}).get("latency_buckets", 10000))
 
     return env
 
 
+def setup_entropy(env, conf):
+    ''' Creates the arrays of the entropies of the target packets, see classes/EntropyAccumulator.py. '''
+    env.entropy = numpy.zeros(int(conf["misc"]["num_target_packets"]))
+    env.entropy_accumulator = EntropyAccumulator(env.entropy, deferred=conf.get("metrics", {}).get("entropy_mode", "immediate") == "deferred",
+                                                 block_size=conf.get("metrics", {}).get("entropy_block", 65536))
+    # Probability mass of the target packets and entropy taken out of the network by the dropped packets (see Node.drop_from_pool)
+    env.mass_dropped = numpy.zeros(int(conf["misc"]["num_target_packets"]))
+    env.entropy_dropped = numpy.zeros(int(conf["misc"]["num_target_packets"]))
 
-def run_p2p(env, conf, net, loggers):
+
+def choose(env, nodes):
+    return nodes[env.rng.integers(len(nodes))]
+
+
+def start_p2p(env, conf, net):
+    ''' Function picks the target senders and the target recipient among the peers
+        and starts the traffic of all the peers.
+
+        Returns the tuple (list of the target senders, target recipient).
+    '''
     print("Runninf P2P topology")
     peers = net.peers
     print("Number of active peers: ", len(peers))
 
-    SenderT1 = peers.pop()
-    SenderT1.label = 1
-    SenderT1.verbose = True
-
-    SenderT2 = peers.pop()
-    SenderT2.label = 2
-    SenderT2.verbose = True
-
+    senders = pick_target_senders(conf, peers)
     recipient = peers.pop()
 
     for c in peers:
-        env.process(c.start(random.choice(peers)))
+        env.process(c.start(choose(env, peers)))
         env.process(c.start_loop_cover_traffc())
 
-    env.process(SenderT1.start(dest=random.choice(peers)))
-    env.process(SenderT1.start_loop_cover_traffc())
-    env.process(SenderT2.start(dest=random.choice(peers)))
-    env.process(SenderT2.start_loop_cover_traffc())
+    for sender in senders:
+        env.process(sender.start(dest=choose(env, peers)))
+        env.process(sender.start_loop_cover_traffc())
     env.process(recipient.set_start_logs())
-    env.process(recipient.start(dest=random.choice(peers)))
+    env.process(recipient.start(dest=choose(env, peers)))
     env.process(recipient.start_loop_cover_traffc())
 
-    print("---------" + str(datetime.datetime.now()) + "---------")
-    print("> Running the system for %s ticks to prepare it for measurment." % (conf["phases"]["burnin"]))
-
-    # env.process(progress_update(env, 5))
-    time_started = env.now
-    time_started_unix = datetime.datetime.now()
-    # ------ RUNNING THE STARTUP PHASE ----------
-    if conf["phases"]["burnin"] > 0.0:
-        env.run(until=conf["phases"]["burnin"])
-    print("> Finished the preparation")
-
-    # Start logging since system in steady state
-    for p in net.peers:
-        p.mixlogging = True
-
-    env.process(SenderT1.simulate_adding_packets_into_buffer(recipient))
-    print("> Started sending traffic for measurments")
-
-    env.run(until=env.stop_sim_event)  # Run until the stop_sim_event is triggered.
-    print("> Main part of simulation finished. Starting cooldown phase.")
-
-
-    # ------ RUNNING THE COOLDOWN PHASE ----------
-    env.run(until=env.now + conf["phases"]["cooldown"])
-
-
-    # Log entropy
-    loggers[2].info(StructuredMessage(metadata=tuple(env.entropy)))
-    print("> Cooldown phase finished.")
-
-    time_finished = env.now
-    time_finished_unix = datetime.datetime.now()
-
-    print("> Total Simulation Time [in ticks]: " + str(time_finished-time_started) + "---------")
-    print("> Total Simulation Time [in unix time]: " + str(time_finished_unix-time_started_unix) + "---------")
-
-    flush_logs(loggers)
+    return (senders, recipient)
 
-    global throughput
-    throughput = float(env.total_messages_received) / float(time_finished-time_started)
 
-    mixthroughputs = []
-    for p in net.peers:
-        mixthroughputs.append(float(p.pkts_sent) / float(time_finished-time_started))
+def pick_target_senders(conf, nodes):
+    ''' Takes the target senders (the number of which is set by "misc" -> "num_target_senders") out of the
+        given list of nodes and labels them 1, 2, ... (label 0 stands for all the other senders, see
+        Packet.sender_estimates). The first target sender sends the tracked messages.
+    '''
+    senders = []
+    for label in range(1, num_labels(conf)):
+        sender = nodes.pop()
+        sender.label = label
+        sender.verbose = True
+        print("Target Sender%d: " % label, sender.id)
+        senders.append(sender)
+    return senders
 
-    print("Network throughput %f / second: " % throughput)
-    print("Average mix throughput %f / second, with std: %f" % (np.mean(mixthroughputs), np.std(mixthroughputs)))
 
+def start_client_server(env, conf, net, source=0, num_sources=1):
+    ''' Function picks the target senders and the target recipient among the clients
+        and starts the traffic of all the clients.
 
+        In a parallel run (see simulation_modes/parallel_mode.py), the traffic is split among
+        num_sources source shards: this one starts the background clients whose row modulo
+        num_sources is source, and the first source shard the target senders and recipient.
 
-def run_client_server(env, conf, net, loggers):
+        Returns the tuple (list of the target senders, target recipient).
+    '''
     clients = net.clients
     print("Number of active clients: ", len(clients))
 
-    SenderT1 = clients.pop()
-    SenderT1.label = 1
-    SenderT1.verbose = True
-    print("Target Sender1: ", SenderT1.id)
-
-    SenderT2 = clients.pop()
-    SenderT2.label = 2
-    SenderT2.verbose = True
-    print("Target Sender2: ", SenderT2.id)
+    senders = pick_target_senders(conf, clients)
 
     recipient = clients.pop()
     recipient.verbose = True
@@ -139,47 +160,98 @@ def run_client_server(env, conf, net, loggers):
 
     net.mixnodes[0].verbose = True
 
-    for c in clients:
-        c.verbose = True
-        env.process(c.start(random.choice(clients)))
-        env.process(c.start_loop_cover_traffc())
-
-    env.process(SenderT1.start(dest=recipient))
-    env.process(SenderT1.start_loop_cover_traffc())
-    env.process(SenderT2.start(dest=random.choice(clients)))
-    env.process(SenderT2.start_loop_cover_traffc())
+    if conf["clients"].get("aggregate_cover", False):
+        # The background clients are replaced by one Poisson source per first mix, see classes/CoverSource.py
+        sources = start_cover_sources(env, conf, net, clients, 1.0 / num_sources)
+        print("Background clients aggregated into %d sources" % len(sources))
+    else:
+        for row in range(source, len(clients), num_sources):
+            c = clients[row]
+            c.verbose = True
+            env.process(c.start(choose(env, clients)))
+            env.process(c.start_loop_cover_traffc())
+
+    if source != 0:
+        return (senders, recipient)
+    env.process(senders[0].start(dest=recipient))
+    env.process(senders[0].start_loop_cover_traffc())
+    for sender in senders[1:]:
+        env.process(sender.start(dest=choose(env, clients)))
+        env.process(sender.start_loop_cover_traffc())
     env.process(recipient.set_start_logs())
-    env.process(recipient.start(dest=random.choice(clients)))
+    env.process(recipient.start(dest=choose(env, clients)))
     env.process(recipient.start_loop_cover_traffc())
 
+    return (senders, recipient)
+
+
+def run_burnin(env, conf, mixnodes):
+    ''' Runs the system for the burn-in phase, to bring it into a steady state before we measure.
+        In the "fixed" burn-in mode it runs for phases -> burnin ticks, in the "adaptive" mode
+        until the pools and the throughput of the mixes are stationary (see classes/SteadyState.py),
+        but at most phases -> burnin ticks. Returns the time at which the burn-in ended.
+    '''
     print("---------" + str(datetime.datetime.now()) + "---------")
-    print("> Running the system for %s ticks to prepare it for measurment." % (conf["phases"]["burnin"]))
 
     # env.process(progress_update(env, 5))
-    time_started = env.now
-    time_started_unix = datetime.datetime.now()
     # ------ RUNNING THE STARTUP PHASE ----------
-    if conf["phases"]["burnin"] > 0.0:
-        env.run(until=conf["phases"]["burnin"])
+    if conf["phases"].get("burnin_mode", "fixed") == "adaptive":
+        print("> Running the system until it reaches a steady state (at most %s ticks)." % (conf["phases"]["burnin"]))
+        detector = SteadyStateDetector(env, mixnodes, sample_interval=conf["phases"]["burnin_sample_interval"],
+                                       min_samples=conf["phases"]["burnin_min_samples"], max_time=env.now + conf["phases"]["burnin"])
+        env.process(detector.monitor())
+        env.run(until=detector.steady)
+        if detector.detected:
+            print("> Steady state detected at %f (stationary since %f)" % (detector.steady_time, detector.truncation_time))
+        else:
+            print("> Steady state not detected, burn-in stopped at %f" % detector.steady_time)
+    else:
+        print("> Running the system for %s ticks to prepare it for measurment." % (conf["phases"]["burnin"]))
+        if conf["phases"]["burnin"] > 0.0:
+            env.run(until=conf["phases"]["burnin"])
     print("> Finished the preparation")
-
+    return env.now
+
+
+def run_measurement(env, conf, mixnodes, loggers, sender, recipient, time_started, time_started_unix, entropy_before_cooldown=True):
+    ''' Runs the measured part of the simulation, i.e., the target sender sends the tracked messages
+        to the target recipient, followed by the cooldown phase. Returns the summary of the run.
+
+        Keyword arguments:
+        env - the simulation environment, after the burn-in phase,
+        conf - the configuration of the simulation,
+        mixnodes - the nodes acting as mixes (peers in the p2p topology),
+        loggers - the tuple of the packet, message and entropy loggers,
+        sender - the target sender, sending the tracked messages,
+        recipient - the target recipient,
+        time_started, time_started_unix - the simulated and the real time at which the run started,
+        entropy_before_cooldown - whether to log the entropy also at the end of the main part.
+    '''
     # Start logging since system in steady state
-    for p in net.mixnodes:
+    for p in mixnodes:
         p.mixlogging = True
 
-    env.process(SenderT1.simulate_adding_packets_into_buffer(recipient))
+    env.process(sender.simulate_adding_packets_into_buffer(recipient))
     print("> Started sending traffic for measurments")
 
     env.run(until=env.stop_sim_event)  # Run until the stop_sim_event is triggered.
     print("> Main part of simulation finished. Starting cooldown phase.")
 
-    # Log entropy
-    loggers[2].info(StructuredMessage(metadata=tuple(env.entropy)))
+    # The reported entropy is the first one logged, i.e., before the cooldown if entropy_before_cooldown
+    env.entropy_accumulator.flush()
+    entropy = float(np.mean(env.entropy))
+    if entropy_before_cooldown and loggers[2] is not None:
+        # Log entropy
+        loggers[2].info(StructuredMessage(metadata=tuple(env.entropy)))
     # ------ RUNNING THE COOLDOWN PHASE ----------
     env.run(until=env.now + conf["phases"]["cooldown"])
 
+    env.entropy_accumulator.flush()
+    if not entropy_before_cooldown:
+        entropy = float(np.mean(env.entropy))
     # Log entropy
-    loggers[2].info(StructuredMessage(metadata=tuple(env.entropy)))
+    if loggers[2] is not None:
+        loggers[2].info(StructuredMessage(metadata=tuple(env.entropy)))
 
     print("> Cooldown phase finished.")
     time_finished = env.now
@@ -190,26 +262,80 @@ def run_client_server(env, conf, net, loggers):
 
     flush_logs(loggers)
 
+    summary = get_summary(env, mixnodes, time_finished-time_started, time_finished_unix-time_started_unix)
+    summary.update(env.metrics.results())
+    summary["entropy"] = entropy
+    summary["mix_packets_dropped"] = int(sum(m.pkts_dropped for m in mixnodes))
+    summary["mass_dropped"] = float(np.mean(env.mass_dropped))
+    summary["entropy_dropped"] = float(np.mean(env.entropy_dropped))
 
+    print("Total number of packets which went through the network: ", float(env.total_messages_received))
+    print("Network throughput %f / second: " % summary["throughput"])
+    print("Average mix throughput %f / second, with std: %f" % (summary["mix_throughput_mean"], summary["mix_throughput_std"]))
+    return summary
+
+
+def run_p2p(env, conf, net, loggers):
+    (senders, recipient) = start_p2p(env, conf, net)
+
+    time_started = env.now
+    time_started_unix = datetime.datetime.now()
+    burnin_time = run_burnin(env, conf, net.peers)
+
+    summary = run_measurement(env, conf, net.peers, loggers, senders[0], recipient, time_started, time_started_unix, entropy_before_cooldown=False)
+    summary["burnin_time"] = burnin_time
+    return summary
+
+
+def run_client_server(env, conf, net, loggers):
+    (senders, recipient) = start_client_server(env, conf, net)
+
+    time_started = env.now
+    time_started_unix = datetime.datetime.now()
+    burnin_time = run_burnin(env, conf, net.mixnodes)
+
+    summary = run_measurement(env, conf, net.mixnodes, loggers, senders[0], recipient, time_started, time_started_unix)
+    summary["burnin_time"] = burnin_time
+    return summary
+
+
+def get_summary(env, mixnodes, sim_time, wall_time):
+    ''' Function collects the performance numbers of a finished run.
+
+        Keyword arguments:
+        env - the simulation environment,
+        mixnodes - the nodes acting as mixes (peers in the p2p topology),
+        sim_time - the simulated duration of the run [in ticks],
+        wall_time - the real duration of the run (datetime.timedelta).
+    '''
     global throughput
-    throughput = float(env.total_messages_received) / float(time_finished-time_started)
+    throughput = float(env.total_messages_received) / float(sim_time)
 
     mixthroughputs = []
-    for m in net.mixnodes:
-        mixthroughputs.append(float(m.pkts_sent) / float(time_finished-time_started))
+    for m in mixnodes:
+        mixthroughputs.append(float(m.pkts_sent) / float(sim_time))
 
-    print("Total number of packets which went through the network: ", float(env.total_messages_received))
-    print("Network throughput %f / second: " % throughput)
-    print("Average mix throughput %f / second, with std: %f" % (np.mean(mixthroughputs), np.std(mixthroughputs)))
+    return {"throughput" : throughput,
+            "mix_throughput_mean" : float(np.mean(mixthroughputs)),
+            "mix_throughput_std" : float(np.std(mixthroughputs)),
+            "total_packets_received" : env.total_messages_received,
+            "packets_dropped" : env.packets_dropped,
+            "sim_time" : float(sim_time),
+            "wall_time" : wall_time.total_seconds()}
 
 
 def flush_logs(loggers):
     for l in loggers:
-        for h in l.handlers:
-            h.flush()
+        if l is None:
+            continue
+        if isinstance(l, ColumnarLogger):
+            l.flush()
+        else:
+            for h in l.handlers:
+                h.flush()
 
 
-def run(exp_dir, conf_file=None, conf_dic=None):
+def run(exp_dir, conf_file=None, conf_dic=None, seed_sequence=None):
     print("The experiment log directory is: %s" %exp_dir)
 
     # Upload config file
@@ -227,15 +353,21 @@ def run(exp_dir, conf_file=None, conf_dic=None):
 
     # Logging directory
     log_dir = os.path.join(exp_dir,conf["logging"]["dir"])
+    os.makedirs(log_dir, exist_ok=True)
     # Setup environment
-    env = setup_env(conf)
+    env = setup_env(conf, seed_sequence)
 
     # Create the network
     type = conf["network"]["topology"]
     loggers = get_loggers(log_dir, conf)
     net = Network(env, type, conf, loggers)
+    profiler = start_profiler(env, conf, net, loggers, exp_dir)
 
     if type == "p2p":
-        run_p2p(env, conf, net, loggers)
+        summary = run_p2p(env, conf, net, loggers)
     else:
-        run_client_server(env, conf, net, loggers)
+        summary = run_client_server(env, conf, net, loggers)
+
+    if profiler is not None:
+        profiler.stop()
+    return summary